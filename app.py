@@ -1,21 +1,42 @@
+import functools
+import inspect
+
 import gradio as gr
 from PIL import Image
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+import json
 import tifffile
-import tempfile
 import os
-from typing import Optional, Literal
+from typing import List, Optional, Literal, Tuple
 
 from core.utils import (
-    WORK_DIR, DEMO_DIR, upscale, load_stack,
-    _start_cleaner, citation_markdown, documentation_markdown
+    WORK_DIR, DEMO_DIR, count_frames,
+    citation_markdown, documentation_markdown
 )
 from core.registration import (
     align_stack_to_reference,
     align_stack_to_stack,
     align_frame_to_frame,
-    _run_align_to_reference,
-    _run_align_to_stack,
+    estimate_transforms,
+    apply_transforms,
+    align_batch,
     _resolve_path,
+    _resolve_all,
+)
+from core.admission import ADMISSION, LIGHT_SLOTS, CPU_SLOTS, MAX_WAITING, ServerBusy
+from core.artifacts import ARTIFACTS
+from core.cache import RESULT_CACHE
+from core.downloads import DOWNLOAD_CACHE
+from core.instrument import ENABLED as INSTRUMENT_ENABLED, metrics_text, register_stats
+from core.preview import PREVIEWS
+from core.jobs import (
+    JOBS,
+    FINISHED_STATES,
+    submit_job,
+    job_status,
+    job_result,
+    cancel_job,
 )
 
 TransformationMode = Literal[
@@ -26,7 +47,49 @@ TransformationMode = Literal[
     "BILINEAR",
 ]
 
-_start_cleaner()
+ExecutorKind = Literal["serial", "thread", "process"]
+
+OutputDtype = Literal["uint8", "float32", "native"]
+
+Prealign = Literal["none", "phase", "phase_only"]
+
+ReferenceStrategy = Literal["fixed", "previous", "mean", "running_mean"]
+
+Pairing = Literal["first", "pairwise", "mean"]
+
+Compression = Literal["none", "zlib", "zstd", "lzw"]
+
+OutputFormat = Literal["tiff", "bigtiff", "ome"]
+
+JobTool = Literal[
+    "align_stack_to_reference",
+    "align_stack_to_stack",
+    "align_frame_to_frame",
+    "estimate_transforms",
+    "apply_transforms",
+    "align_batch",
+]
+
+ARTIFACTS.start()
+
+# Gauges exported at /metrics next to the request timings (see core/instrument.py).
+register_stats("result_cache", RESULT_CACHE.stats)
+register_stats("download_cache", DOWNLOAD_CACHE.stats)
+register_stats("work_dir", ARTIFACTS.stats)
+register_stats("admission", ADMISSION.stats)
+
+# Gradio event concurrency. The CPU itself is shared out by the admission
+# controller (core/admission.py), so the synchronous tool endpoints only need
+# enough room for every call it may run or keep waiting; events that do no
+# registration (job polling, previews) are not limited at all.
+UI_CONCURRENCY = int(os.environ.get("PSR_UI_CONCURRENCY", 4))
+TOOL_CONCURRENCY = CPU_SLOTS + LIGHT_SLOTS + 2 * MAX_WAITING
+# Events waiting in the Gradio queue; further ones are refused ("queue full").
+QUEUE_SIZE = int(os.environ.get("PSR_QUEUE_SIZE", 256))
+
+# Results written for the UI (offered for download) are zlib-compressed:
+# lossless, and several times smaller to transfer.
+_UI_COMPRESSION = "zlib"
 
 def _stage_for_backend(src: str) -> str:
     """Return a sandbox-safe path for *src*.
@@ -42,21 +105,65 @@ def _stage_for_backend(src: str) -> str:
     if any(real == s or real.startswith(s + os.sep) for s in sandboxes):
         return src
     suffix = os.path.splitext(src)[-1] or ".tif"
-    fd, dst = tempfile.mkstemp(suffix=suffix, dir=WORK_DIR)
-    os.close(fd)
+    dst = ARTIFACTS.create(suffix)
     os.unlink(dst)  # remove placeholder so os.link can create the entry
     try:
         os.link(src, dst)
     except OSError:
         shutil.copy2(src, dst)
+    ARTIFACTS.add(dst)
     return dst
 
-def reset_intra_stack():
+def _admitted(tool):
+    """Decorator running a synchronous call of *tool* under admission control.
+
+    A call that cannot be admitted in time fails with a gr.Error telling the
+    client when to retry.
+    """
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            try:
+                with ADMISSION.admit(tool, arguments.arguments):
+                    return fn(*args, **kwargs)
+            except ServerBusy as exc:
+                raise gr.Error(str(exc), title="Server busy") from exc
+        return wrapper
+    return decorate
+
+def _run_as_job(tool, arguments, progress):
+    """Run a backend tool through the job queue, mirroring its progress in the UI."""
+    job_id = submit_job(tool, arguments)["job_id"]
+    try:
+        status = job_status(job_id)
+        while status["state"] not in FINISHED_STATES:
+            if status["frames_total"]:
+                progress((status["frames_done"], status["frames_total"]), desc="Registering", unit="frames")
+            status = JOBS.wait(job_id, timeout=0.25)
+    except BaseException:
+        cancel_job(job_id)
+        raise
+    return job_result(job_id)
+
+def _session(request: Optional[gr.Request]) -> Optional[str]:
+    return request.session_hash if request is not None else None
+
+def close_previews(request: gr.Request):
+    """Close the preview handles of a session (tab reset or browser tab closed)."""
+    PREVIEWS.close_session(_session(request))
+
+def reset_intra_stack(request: gr.Request):
+    close_previews(request)
     return [None, gr.update(value=0, minimum=0, maximum=0), None, gr.update(value=0, minimum=0, maximum=0),
             None, gr.update(value=0, minimum=0, maximum=0), None, gr.update(value=0, minimum=0, maximum=0), None,
             None, None]
 
-def reset_reference_based():
+def reset_reference_based(request: gr.Request):
+    close_previews(request)
     return [None, None, None, gr.update(value=0, minimum=0, maximum=0),
             None, gr.update(value=0, minimum=0, maximum=0), None,
             None, None]
@@ -66,92 +173,102 @@ def reset_frame_to_frame():
             gr.update(value=0, minimum=0, maximum=0), None, None]
 
 # Registration logic — UI wrappers that call the pure backend functions
-def intra_stack_align(f, ref_idx, ext_file, ext_idx, mode):
+def intra_stack_align(f, ref_idx, ext_file, ext_idx, mode, strategy="fixed", window=10,
+                      progress=gr.Progress(), request: gr.Request = None):
     if not f:
         raise gr.Error("Please upload a TIFF stack before running alignment.")
     f = _stage_for_backend(f)
-    # Load and normalise once — reused for both the UI preview and registration
-    orig_stack = load_stack(f)
-    fd, orig_path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-    tifffile.imwrite(orig_path, orig_stack, photometric="minisblack")
-    n_orig = len(orig_stack)
-
-    if ext_file:
-        ref_frame = load_stack(_stage_for_backend(ext_file))[int(ext_idx)]
-    else:
-        ref_frame = orig_stack[int(ref_idx)]
-    aligned = _run_align_to_reference(orig_stack, ref_frame, mode)
-
-    fd, path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-    tifffile.imwrite(path, aligned, photometric="minisblack")
+    # The preview sliders read the original frames straight from the staged input
+    n_orig = len(PREVIEWS.get(_session(request), f))
+
+    # Delegate to pure backend (registers on the full-precision input)
+    path = _run_as_job("align_stack_to_reference", dict(
+        stack_file=f,
+        reference_index=int(ref_idx),
+        mode=mode,
+        external_reference_file=_stage_for_backend(ext_file) if ext_file and strategy not in ("previous", "mean") else None,
+        external_reference_index=int(ext_idx),
+        reference_strategy=strategy,
+        running_mean_window=int(window),
+        compression=_UI_COMPRESSION,
+    ), progress)
     return (
-        Image.fromarray(orig_stack[0]), gr.update(value=0, maximum=n_orig - 1),
-        upscale(Image.fromarray(aligned[0])), gr.update(value=0, maximum=len(aligned) - 1), path,
-        orig_path, path,
+        _read_frame(f, 0, normalize=True, request=request), gr.update(value=0, maximum=n_orig - 1),
+        _read_frame(path, 0, scale=True, request=request), gr.update(value=0, maximum=n_orig - 1), path,
+        f, path,
     )
 
-def reference_align(ref_file, mov_file, mode):
+def reference_align(ref_file, mov_file, mode, pairing="first", progress=gr.Progress(), request: gr.Request = None):
     if not ref_file:
         raise gr.Error("Please upload a reference stack.")
     if not mov_file:
         raise gr.Error("Please upload a moving stack.")
     ref_file = _stage_for_backend(ref_file)
     mov_file = _stage_for_backend(mov_file)
-    # Load both stacks once — reference reused for preview and registration
-    ref_stack = load_stack(ref_file)
-    mov_stack = load_stack(mov_file)
-    fd, ref_path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-    tifffile.imwrite(ref_path, ref_stack, photometric="minisblack")
-    n_ref = len(ref_stack)
-
-    aligned = _run_align_to_stack(ref_stack, mov_stack, mode)
-
-    fd, path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-    tifffile.imwrite(path, aligned, photometric="minisblack")
+    # The preview sliders read the reference frames straight from the staged input
+    n_ref = len(PREVIEWS.get(_session(request), ref_file))
+
+    # Delegate to pure backend (registers on the full-precision input)
+    path = _run_as_job(
+        "align_stack_to_stack",
+        dict(
+            reference_stack_file=ref_file, moving_stack_file=mov_file, mode=mode, pairing=pairing,
+            compression=_UI_COMPRESSION,
+        ),
+        progress,
+    )
     return (
-        Image.fromarray(ref_stack[0]), gr.update(value=0, maximum=n_ref - 1),
-        upscale(Image.fromarray(aligned[0])), gr.update(value=0, maximum=len(aligned) - 1), path,
-        ref_path, path,
+        _read_frame(ref_file, 0, normalize=True, request=request), gr.update(value=0, maximum=n_ref - 1),
+        _read_frame(path, 0, scale=True, request=request),
+        gr.update(value=0, maximum=_count_frames(path) - 1), path,
+        ref_file, path,
     )
 
-def frame_to_frame_align(file, ref_idx, mov_idx, mode):
+def frame_to_frame_align(file, ref_idx, mov_idx, mode, request: gr.Request = None):
     if not file:
         raise gr.Error("Please upload a TIFF stack before running alignment.")
     file = _stage_for_backend(file)
     # Delegate to pure backend
-    path = align_frame_to_frame(
+    arguments = dict(
         stack_file=file,
         reference_index=int(ref_idx),
         moving_index=int(mov_idx),
         mode=mode,
+        compression=_UI_COMPRESSION,
     )
+    try:
+        with ADMISSION.admit("align_frame_to_frame", arguments):
+            path = align_frame_to_frame(**arguments)
+    except ServerBusy as exc:
+        raise gr.Error(f"The server is busy; please try again in about {exc.retry_after} s.") from exc
+    PREVIEWS.keep(_session(request), path)
 
     # Load aligned frame for UI preview (already normalised — read raw to avoid double-normalisation)
     result_stack = tifffile.imread(path)
     return Image.fromarray(result_stack[0]), path
 
-def _read_frame(path, idx, scale=False):
-    """Read a single frame from a TIFF file by index, return a PIL Image."""
+def _read_frame(path, idx, scale=False, normalize=False, request=None):
+    """Render a single frame of a stack by index through the session's preview
+    cache (stretched to uint8 if *normalize*), return a PIL Image."""
     if not path:
         return None
     try:
-        frame = tifffile.imread(path, key=int(idx))
-        img = Image.fromarray(frame)
-        return upscale(img) if scale else img
+        return PREVIEWS.image(_session(request), path, idx, scale=scale, normalize=normalize)
     except Exception:
         return None
 
+def original_preview(idx, path, request: gr.Request):
+    return _read_frame(path, idx, normalize=True, request=request)
+
+def aligned_preview(idx, path, request: gr.Request):
+    return _read_frame(path, idx, scale=True, request=request)
+
 def _count_frames(path: str) -> int:
     """Return the number of frames in a TIFF file without loading pixel data."""
     if not path or not os.path.exists(path):
         return 0
     try:
-        with tifffile.TiffFile(path) as tf:
-            return len(tf.pages)
+        return count_frames(path)
     except Exception as exc:
         raise gr.Error("Unable to read the uploaded TIFF file. Please upload a valid, non-corrupt TIFF stack.") from exc
 
@@ -211,8 +328,20 @@ with gr.Blocks() as demo:
             show_adv = gr.Checkbox(label="Show Advanced Settings", value=False)
             mode_dropdown = gr.Dropdown(["TRANSLATION", "RIGID_BODY", "SCALED_ROTATION", "AFFINE", "BILINEAR"],
                                         value="RIGID_BODY", visible=False, label="Transformation Mode")
-
-        show_adv.change(lambda v: gr.update(visible=v), show_adv, mode_dropdown, show_api=False)
+            strategy_dropdown = gr.Dropdown(["fixed", "previous", "mean", "running_mean"],
+                                            value="fixed", visible=False, label="Reference Strategy")
+            window_number = gr.Number(label="Running-Mean Window (frames)", value=10, minimum=1, precision=0,
+                                      visible=False)
+
+        show_adv.change(
+            lambda v, s: (gr.update(visible=v), gr.update(visible=v), gr.update(visible=v and s == "running_mean")),
+            [show_adv, strategy_dropdown],
+            [mode_dropdown, strategy_dropdown, window_number],
+            show_api=False,
+        )
+        strategy_dropdown.change(
+            lambda s: gr.update(visible=s == "running_mean"), strategy_dropdown, window_number, show_api=False,
+        )
         run_btn = gr.Button("▶️ Align Stack")
 
         with gr.Row():
@@ -234,19 +363,20 @@ with gr.Blocks() as demo:
 
         run_btn.click(
             intra_stack_align,
-            [file_input, reference_frame_slider, ext_ref_file, ext_ref_slider, mode_dropdown],
+            [file_input, reference_frame_slider, ext_ref_file, ext_ref_slider, mode_dropdown,
+             strategy_dropdown, window_number],
             [original_image, original_slider, aligned_image, aligned_slider, download,
              original_path_state, aligned_path_state],
             show_api=False,
         )
 
         original_slider.change(
-            lambda i, path: _read_frame(path, i, scale=False),
-            [original_slider, original_path_state], original_image, show_api=False,
+            original_preview, [original_slider, original_path_state], original_image, show_api=False,
+            concurrency_limit=None,
         )
         aligned_slider.change(
-            lambda i, path: _read_frame(path, i, scale=True),
-            [aligned_slider, aligned_path_state], aligned_image, show_api=False,
+            aligned_preview, [aligned_slider, aligned_path_state], aligned_image, show_api=False,
+            concurrency_limit=None,
         )
 
         gr.Button("🔄 Reset Tab").click(
@@ -279,8 +409,13 @@ with gr.Blocks() as demo:
             show_adv_ref = gr.Checkbox(label="Show Advanced Settings", value=False)
             mode_dropdown_ref = gr.Dropdown(["TRANSLATION", "RIGID_BODY", "SCALED_ROTATION", "AFFINE", "BILINEAR"],
                                             value="RIGID_BODY", visible=False, label="Transformation Mode")
+            pairing_dropdown = gr.Dropdown(["first", "pairwise", "mean"], value="first", visible=False,
+                                           label="Reference Frame Pairing")
 
-        show_adv_ref.change(lambda v: gr.update(visible=v), show_adv_ref, mode_dropdown_ref, show_api=False)
+        show_adv_ref.change(
+            lambda v: (gr.update(visible=v), gr.update(visible=v)),
+            show_adv_ref, [mode_dropdown_ref, pairing_dropdown], show_api=False,
+        )
         ref_btn = gr.Button("▶️ Register")
 
         with gr.Row():
@@ -295,18 +430,18 @@ with gr.Blocks() as demo:
 
         ref_btn.click(
             reference_align,
-            [ref_input, mov_input, mode_dropdown_ref],
+            [ref_input, mov_input, mode_dropdown_ref, pairing_dropdown],
             [ref_image, stack_ref_browse_slider, reg_image, reg_slider, download_ref,
              ref_path_state, reg_path_state],
             show_api=False,
         )
         stack_ref_browse_slider.change(
-            lambda i, path: _read_frame(path, i, scale=False),
-            [stack_ref_browse_slider, ref_path_state], ref_image, show_api=False,
+            original_preview, [stack_ref_browse_slider, ref_path_state], ref_image, show_api=False,
+            concurrency_limit=None,
         )
         reg_slider.change(
-            lambda i, path: _read_frame(path, i, scale=True),
-            [reg_slider, reg_path_state], reg_image, show_api=False,
+            aligned_preview, [reg_slider, reg_path_state], reg_image, show_api=False,
+            concurrency_limit=None,
         )
 
         gr.Button("🔄 Reset Tab").click(
@@ -364,21 +499,35 @@ with gr.Blocks() as demo:
     # MCP / API-only endpoints — thin wrappers that return the output file 
     # as a Gradio FileData so Gradio/MCP can serve it correctly.
     # ---------------------------------------------------------------------------
-    def _as_mcp_file(path: str) -> gr.FileData:
+    def _as_mcp_file(path: str, mime_type: str = "image/tiff") -> gr.FileData:
         """Wrap a generated local file so Gradio exposes it as a served file."""
         return gr.FileData(
             path=path,
             orig_name=os.path.basename(path),
-            mime_type="image/tiff",
+            mime_type=mime_type,
             size=os.path.getsize(path),
         )
 
+    @_admitted("align_stack_to_reference")
     def _mcp_align_stack_to_reference(
         stack_file: str,
         reference_index: int = 0,
         mode: TransformationMode = "RIGID_BODY",
         external_reference_file: Optional[str] = None,
         external_reference_index: int = 0,
+        executor: ExecutorKind = "serial",
+        max_workers: Optional[int] = None,
+        chunk_size: int = 16,
+        output_dtype: OutputDtype = "uint8",
+        pipelined: bool = False,
+        prealign: Prealign = "none",
+        registration_scale: int = 1,
+        reference_strategy: ReferenceStrategy = "fixed",
+        running_mean_window: int = 10,
+        channel: Optional[int] = None,
+        compression: Compression = "none",
+        tile_size: Optional[int] = None,
+        output_format: OutputFormat = "tiff",
     ) -> gr.FileData:
         """Align every frame in a TIFF stack to a chosen reference frame.
 
@@ -397,6 +546,45 @@ with gr.Blocks() as demo:
                 stack from which the reference frame is taken.
             external_reference_index: Zero-based index of the reference frame
                 inside external_reference_file. Default is 0.
+            executor: How frames are distributed across workers. One of:
+                serial, thread, process. Default is serial.
+            max_workers: Number of workers for the thread/process executors.
+                Defaults to the number of CPUs.
+            chunk_size: Number of frames sent to a worker per task. Default is 16.
+            output_dtype: Sample type of the output TIFF. One of: uint8
+                (percentile-stretched, default), float32 (raw intensities),
+                native (input dtype).
+            pipelined: If true and stack_file is a URL, start registering
+                frames while the file is still downloading. Default is false.
+            prealign: Optional FFT phase-correlation pre-alignment. One of:
+                none (default, TurboReg only), phase (coarse translation
+                estimate refined by TurboReg; recovers large drifts; not for
+                BILINEAR), phase_only (translation from phase correlation
+                alone, several times faster; TRANSLATION mode only).
+            registration_scale: Integer downsampling factor N for estimating
+                the motion. N > 1 registers NxN-binned copies of the frames
+                (roughly N^2 times cheaper) and applies the rescaled result to
+                the full-resolution frames. Default is 1. Useful for very
+                large frames (e.g. 4K x 4K).
+            reference_strategy: How each frame's reference is chosen. One of:
+                fixed (default, the selected reference frame), previous (each
+                frame to the one before, matrices composed along the stack;
+                best for slow drift in long recordings; not for BILINEAR),
+                mean (mean of all frames), running_mean (mean of the previous
+                running_mean_window aligned frames).
+            running_mean_window: Frames per running-mean template. Default is 10.
+            channel: Zero-based registration channel of a multi-channel stack
+                (ImageJ hyperstack such as TCYX / TZCYX, or RGB). The motion is
+                estimated on this channel only and applied to every channel;
+                the output keeps the input axes. Default (null) treats every
+                plane as a frame and averages RGB.
+            compression: Lossless output compression. One of: none (default),
+                zlib, zstd, lzw (always with the TIFF predictor). Compressed
+                outputs are much smaller to download.
+            tile_size: Write the output in square tiles of this many pixels
+                (a multiple of 16). Default (null) writes strips.
+            output_format: Output container. One of: tiff (default; BigTIFF
+                automatically above 4 GB), bigtiff, ome (OME-TIFF).
 
         Returns:
             The aligned output TIFF file.
@@ -404,35 +592,90 @@ with gr.Blocks() as demo:
         out = align_stack_to_reference(
             stack_file, reference_index, mode,
             external_reference_file, external_reference_index,
+            executor, max_workers, chunk_size, output_dtype, pipelined, prealign,
+            registration_scale, reference_strategy, running_mean_window, channel,
+            compression, tile_size, output_format,
         )
         return _as_mcp_file(out)
 
+    @_admitted("align_stack_to_stack")
     def _mcp_align_stack_to_stack(
         reference_stack_file: str,
         moving_stack_file: str,
         mode: TransformationMode = "RIGID_BODY",
+        executor: ExecutorKind = "serial",
+        max_workers: Optional[int] = None,
+        chunk_size: int = 16,
+        output_dtype: OutputDtype = "uint8",
+        prealign: Prealign = "none",
+        registration_scale: int = 1,
+        pairing: Pairing = "first",
+        compression: Compression = "none",
+        tile_size: Optional[int] = None,
+        output_format: OutputFormat = "tiff",
     ) -> gr.FileData:
-        """Align every frame in a moving TIFF stack to the first frame of a reference stack.
+        """Align every frame in a moving TIFF stack to a reference TIFF stack.
 
         Args:
             reference_stack_file: Path or HTTP/HTTPS URL to the reference TIFF
-                stack. Its first frame is used as the alignment target.
+                stack. Its first frame is the alignment target unless
+                pairing says otherwise.
             moving_stack_file: Path or HTTP/HTTPS URL to the moving TIFF stack
                 to align.
             mode: Transformation model. One of: TRANSLATION, RIGID_BODY,
                 SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+            executor: How frames are distributed across workers. One of:
+                serial, thread, process. Default is serial.
+            max_workers: Number of workers for the thread/process executors.
+                Defaults to the number of CPUs.
+            chunk_size: Number of frames sent to a worker per task. Default is 16.
+            output_dtype: Sample type of the output TIFF. One of: uint8
+                (percentile-stretched, default), float32 (raw intensities),
+                native (input dtype).
+            prealign: Optional FFT phase-correlation pre-alignment. One of:
+                none (default, TurboReg only), phase (coarse translation
+                estimate refined by TurboReg; recovers large drifts; not for
+                BILINEAR), phase_only (translation from phase correlation
+                alone, several times faster; TRANSLATION mode only).
+            registration_scale: Integer downsampling factor N for estimating
+                the motion. N > 1 registers NxN-binned copies of the frames
+                (roughly N^2 times cheaper) and applies the rescaled result to
+                the full-resolution frames. Default is 1. Useful for very
+                large frames (e.g. 4K x 4K).
+            pairing: Reference frame for each moving frame. One of: first
+                (default, first reference frame), pairwise (reference frame
+                with the same index, e.g. two synchronised cameras; stacks
+                must be equally long), mean (mean of the reference stack).
+            compression: Lossless output compression. One of: none (default),
+                zlib, zstd, lzw (always with the TIFF predictor). Compressed
+                outputs are much smaller to download.
+            tile_size: Write the output in square tiles of this many pixels
+                (a multiple of 16). Default (null) writes strips.
+            output_format: Output container. One of: tiff (default; BigTIFF
+                automatically above 4 GB), bigtiff, ome (OME-TIFF).
 
         Returns:
             The aligned output TIFF file.
         """
-        out = align_stack_to_stack(reference_stack_file, moving_stack_file, mode)
+        out = align_stack_to_stack(
+            reference_stack_file, moving_stack_file, mode,
+            executor, max_workers, chunk_size, output_dtype, prealign,
+            registration_scale, pairing, compression, tile_size, output_format,
+        )
         return _as_mcp_file(out)
 
+    @_admitted("align_frame_to_frame")
     def _mcp_align_frame_to_frame(
         stack_file: str,
         reference_index: int,
         moving_index: int,
         mode: TransformationMode = "RIGID_BODY",
+        output_dtype: OutputDtype = "uint8",
+        prealign: Prealign = "none",
+        registration_scale: int = 1,
+        compression: Compression = "none",
+        tile_size: Optional[int] = None,
+        output_format: OutputFormat = "tiff",
     ) -> gr.FileData:
         """Align a single moving frame to a reference frame within the same TIFF stack.
 
@@ -443,16 +686,308 @@ with gr.Blocks() as demo:
             moving_index: Zero-based index of the frame to align.
             mode: Transformation model. One of: TRANSLATION, RIGID_BODY,
                 SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+            output_dtype: Sample type of the output TIFF. One of: uint8
+                (percentile-stretched, default), float32 (raw intensities),
+                native (input dtype).
+            prealign: Optional FFT phase-correlation pre-alignment. One of:
+                none (default, TurboReg only), phase (coarse translation
+                estimate refined by TurboReg; recovers large drifts; not for
+                BILINEAR), phase_only (translation from phase correlation
+                alone, several times faster; TRANSLATION mode only).
+            registration_scale: Integer downsampling factor N for estimating
+                the motion. N > 1 registers NxN-binned copies of the frames
+                (roughly N^2 times cheaper) and applies the rescaled result to
+                the full-resolution frames. Default is 1. Useful for very
+                large frames (e.g. 4K x 4K).
+            compression: Lossless output compression. One of: none (default),
+                zlib, zstd, lzw (always with the TIFF predictor). Compressed
+                outputs are much smaller to download.
+            tile_size: Write the output in square tiles of this many pixels
+                (a multiple of 16). Default (null) writes strips.
+            output_format: Output container. One of: tiff (default; BigTIFF
+                automatically above 4 GB), bigtiff, ome (OME-TIFF).
 
         Returns:
             The aligned single-frame output TIFF file.
         """
-        out = align_frame_to_frame(stack_file, reference_index, moving_index, mode)
+        out = align_frame_to_frame(
+            stack_file, reference_index, moving_index, mode, output_dtype, prealign, registration_scale,
+            compression, tile_size, output_format,
+        )
         return _as_mcp_file(out)
 
-    gr.api(fn=_mcp_align_stack_to_reference, api_name="align_stack_to_reference")
-    gr.api(fn=_mcp_align_stack_to_stack, api_name="align_stack_to_stack")
-    gr.api(fn=_mcp_align_frame_to_frame, api_name="align_frame_to_frame")
+    @_admitted("estimate_transforms")
+    def _mcp_estimate_transforms(
+        stack_file: str,
+        reference_index: int = 0,
+        mode: TransformationMode = "RIGID_BODY",
+        external_reference_file: Optional[str] = None,
+        external_reference_index: int = 0,
+        executor: ExecutorKind = "serial",
+        max_workers: Optional[int] = None,
+        chunk_size: int = 16,
+        pipelined: bool = False,
+        prealign: Prealign = "none",
+        registration_scale: int = 1,
+        reference_strategy: ReferenceStrategy = "fixed",
+        running_mean_window: int = 10,
+        channel: Optional[int] = None,
+    ) -> gr.FileData:
+        """Estimate per-frame transformation matrices for a TIFF stack without transforming it.
+
+        The matrices are returned as a .npz file that can be passed to
+        apply_transforms to align this stack, or any other stack with the same
+        number of frames (e.g. another channel), without registering again.
+
+        Args:
+            stack_file: Path or HTTP/HTTPS URL to the TIFF stack whose motion
+                will be estimated.
+            reference_index: Zero-based index of the reference frame inside
+                stack_file (ignored when external_reference_file is provided).
+                Default is 0.
+            mode: Transformation model. One of: TRANSLATION, RIGID_BODY,
+                SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+            external_reference_file: Optional path or URL to an external TIFF
+                stack from which the reference frame is taken.
+            external_reference_index: Zero-based index of the reference frame
+                inside external_reference_file. Default is 0.
+            executor: How frames are distributed across workers. One of:
+                serial, thread, process. Default is serial.
+            max_workers: Number of workers for the thread/process executors.
+                Defaults to the number of CPUs.
+            chunk_size: Number of frames sent to a worker per task. Default is 16.
+            pipelined: If true and stack_file is a URL, start registering
+                frames while the file is still downloading. Default is false.
+            prealign: Optional FFT phase-correlation pre-alignment. One of:
+                none (default, TurboReg only), phase (coarse translation
+                estimate refined by TurboReg; recovers large drifts; not for
+                BILINEAR), phase_only (translation from phase correlation
+                alone, several times faster; TRANSLATION mode only).
+            registration_scale: Integer downsampling factor N for estimating
+                the motion. N > 1 registers NxN-binned copies of the frames
+                (roughly N^2 times cheaper) and applies the rescaled result to
+                the full-resolution frames. Default is 1. Useful for very
+                large frames (e.g. 4K x 4K).
+            reference_strategy: How each frame's reference is chosen. One of:
+                fixed (default, the selected reference frame), previous (each
+                frame to the one before, matrices composed along the stack;
+                best for slow drift in long recordings; not for BILINEAR),
+                mean (mean of all frames), running_mean (mean of the previous
+                running_mean_window aligned frames).
+            running_mean_window: Frames per running-mean template. Default is 10.
+            channel: Zero-based channel of a multi-channel stack to estimate
+                the motion on; apply_transforms then transforms every channel
+                of the hyperstack. Default (null) treats every plane as a frame.
+
+        Returns:
+            The .npz transformation file (one matrix per frame plus the mode).
+        """
+        out = estimate_transforms(
+            stack_file, reference_index, mode,
+            external_reference_file, external_reference_index,
+            executor, max_workers, chunk_size, pipelined, prealign,
+            registration_scale, reference_strategy, running_mean_window, channel,
+        )
+        return _as_mcp_file(out, mime_type="application/octet-stream")
+
+    @_admitted("apply_transforms")
+    def _mcp_apply_transforms(
+        stack_file: str,
+        transforms_file: str,
+        executor: ExecutorKind = "serial",
+        max_workers: Optional[int] = None,
+        chunk_size: int = 16,
+        output_dtype: OutputDtype = "uint8",
+        compression: Compression = "none",
+        tile_size: Optional[int] = None,
+        output_format: OutputFormat = "tiff",
+    ) -> gr.FileData:
+        """Apply transformation matrices from estimate_transforms to a TIFF stack.
+
+        Args:
+            stack_file: Path or HTTP/HTTPS URL to the TIFF stack to transform.
+                It must have as many frames as the stack the matrices were
+                estimated on; for a multi-channel ImageJ hyperstack, as many
+                frames per channel (every channel is then transformed).
+            transforms_file: Path or HTTP/HTTPS URL to the .npz file returned by
+                estimate_transforms.
+            executor: How frames are distributed across workers. One of:
+                serial, thread, process. Default is serial.
+            max_workers: Number of workers for the thread/process executors.
+                Defaults to the number of CPUs.
+            chunk_size: Number of frames sent to a worker per task. Default is 16.
+            output_dtype: Sample type of the output TIFF. One of: uint8
+                (percentile-stretched, default), float32 (raw intensities),
+                native (input dtype).
+            compression: Lossless output compression. One of: none (default),
+                zlib, zstd, lzw (always with the TIFF predictor). Compressed
+                outputs are much smaller to download.
+            tile_size: Write the output in square tiles of this many pixels
+                (a multiple of 16). Default (null) writes strips.
+            output_format: Output container. One of: tiff (default; BigTIFF
+                automatically above 4 GB), bigtiff, ome (OME-TIFF).
+
+        Returns:
+            The transformed output TIFF file.
+        """
+        out = apply_transforms(
+            stack_file, transforms_file, executor, max_workers, chunk_size, output_dtype,
+            compression, tile_size, output_format,
+        )
+        return _as_mcp_file(out)
+
+    @_admitted("align_batch")
+    def _mcp_align_batch(
+        stack_files: List[str],
+        reference_index: int = 0,
+        mode: TransformationMode = "RIGID_BODY",
+        output_dtype: OutputDtype = "uint8",
+        item_params: Optional[List[Optional[dict]]] = None,
+        executor: ExecutorKind = "process",
+        max_workers: Optional[int] = None,
+        prealign: Prealign = "none",
+        registration_scale: int = 1,
+        reference_strategy: ReferenceStrategy = "fixed",
+        running_mean_window: int = 10,
+        channel: Optional[int] = None,
+        compression: Compression = "none",
+        tile_size: Optional[int] = None,
+        output_format: OutputFormat = "tiff",
+    ) -> Tuple[dict, List[gr.FileData]]:
+        """Align many TIFF stacks in one call, each to one of its own frames.
+
+        Each stack is processed like align_stack_to_reference; whole stacks are
+        spread across all CPU cores. Use this instead of many separate calls
+        when there are lots of (small) stacks. Failed items are reported in the
+        manifest and do not stop the batch.
+
+        Args:
+            stack_files: Paths or HTTP/HTTPS URLs of the TIFF stacks. An entry
+                ending in .zip is a ZIP archive whose TIFF files are all aligned.
+            reference_index: Zero-based reference frame index for all stacks.
+                Default is 0.
+            mode: Transformation model for all stacks. One of: TRANSLATION,
+                RIGID_BODY, SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+            output_dtype: Sample type of the outputs. One of: uint8, float32,
+                native. Default is uint8.
+            item_params: Optional list with one object (or null) per entry of
+                stack_files, overriding reference_index, mode,
+                external_reference_file, external_reference_index,
+                output_dtype, prealign, registration_scale, reference_strategy,
+                running_mean_window, channel, compression, tile_size or
+                output_format for that entry.
+            executor: How stacks are distributed across workers. One of:
+                serial, thread, process. Default is process.
+            max_workers: Number of workers. Defaults to the number of CPUs.
+            prealign: Phase-correlation pre-alignment for all stacks. One of:
+                none (default), phase, phase_only (TRANSLATION mode only).
+            registration_scale: Downsampling factor for estimating the motion
+                of all stacks. Default is 1 (full resolution).
+            reference_strategy: Reference strategy for all stacks. One of:
+                fixed (default), previous, mean, running_mean.
+            running_mean_window: Frames per running-mean template. Default is 10.
+            channel: Registration channel of multi-channel stacks. Default
+                (null) treats every plane as a frame.
+            compression: Lossless output compression. One of: none (default),
+                zlib, zstd, lzw (always with the TIFF predictor). Compressed
+                outputs are much smaller to download.
+            tile_size: Write the output in square tiles of this many pixels
+                (a multiple of 16). Default (null) writes strips.
+            output_format: Output container. One of: tiff (default; BigTIFF
+                automatically above 4 GB), bigtiff, ome (OME-TIFF).
+
+        Returns:
+            The manifest (one record per stack with index, input, member,
+            status, output, error and seconds, plus succeeded / failed counts)
+            and the aligned TIFF files of the succeeded items, in order.
+        """
+        manifest_path = align_batch(
+            stack_files, reference_index, mode, output_dtype,
+            item_params, executor, max_workers, prealign, registration_scale,
+            reference_strategy, running_mean_window, channel, compression, tile_size,
+            output_format,
+        )
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        files = [_as_mcp_file(item["output"]) for item in manifest["items"] if item["output"]]
+        return manifest, files
+
+    def _mcp_submit_job(tool: JobTool, arguments: dict) -> dict:
+        """Queue a registration tool call and return at once, without waiting for the result.
+
+        Prefer this over calling a tool directly for long runs (large stacks,
+        BILINEAR mode): poll job_status with the returned job_id, then fetch the
+        output with job_result. Many jobs can be submitted and polled at once.
+
+        Args:
+            tool: Name of the tool to run. One of: align_stack_to_reference,
+                align_stack_to_stack, align_frame_to_frame, estimate_transforms,
+                apply_transforms, align_batch.
+            arguments: The tool's arguments as a JSON object, exactly as they
+                would be passed to the tool itself, e.g.
+                {"stack_file": "https://...", "mode": "AFFINE"}.
+
+        Returns:
+            The job status: job_id, tool, state (queued, running, succeeded,
+            failed or cancelled), frames_done, frames_total, progress (0-1),
+            elapsed_seconds, eta_seconds and error.
+        """
+        return submit_job(tool, arguments)
+
+    def _mcp_job_status(job_id: str) -> dict:
+        """Report the state and per-frame progress of a submitted job.
+
+        Args:
+            job_id: The job_id returned by submit_job.
+
+        Returns:
+            The job status: job_id, tool, state (queued, running, succeeded,
+            failed or cancelled), frames_done, frames_total, progress (0-1),
+            elapsed_seconds, eta_seconds (estimated time left) and error.
+        """
+        return job_status(job_id)
+
+    def _mcp_job_result(job_id: str) -> gr.FileData:
+        """Return the output file of a job that has succeeded.
+
+        Fails with the tool's own error message if the job failed, or if it
+        was cancelled or has not finished yet (check job_status first).
+
+        Args:
+            job_id: The job_id returned by submit_job.
+
+        Returns:
+            The output file of the tool (a TIFF stack, the .npz file of
+            estimate_transforms, or the JSON manifest of align_batch).
+        """
+        out = job_result(job_id)
+        if out.endswith(".npz"):
+            return _as_mcp_file(out, mime_type="application/octet-stream")
+        if out.endswith(".json"):
+            return _as_mcp_file(out, mime_type="application/json")
+        return _as_mcp_file(out)
+
+    def _mcp_cancel_job(job_id: str) -> dict:
+        """Cancel a queued or running job. A running job stops after its current chunk of frames.
+
+        Args:
+            job_id: The job_id returned by submit_job.
+
+        Returns:
+            The job status after the request (state "cancelled" once stopped).
+        """
+        return cancel_job(job_id)
+
+    gr.api(fn=_mcp_align_stack_to_reference, api_name="align_stack_to_reference", concurrency_limit=TOOL_CONCURRENCY, concurrency_id="tools")
+    gr.api(fn=_mcp_align_stack_to_stack, api_name="align_stack_to_stack", concurrency_limit=TOOL_CONCURRENCY, concurrency_id="tools")
+    gr.api(fn=_mcp_align_frame_to_frame, api_name="align_frame_to_frame", concurrency_limit=TOOL_CONCURRENCY, concurrency_id="tools")
+    gr.api(fn=_mcp_estimate_transforms, api_name="estimate_transforms", concurrency_limit=TOOL_CONCURRENCY, concurrency_id="tools")
+    gr.api(fn=_mcp_apply_transforms, api_name="apply_transforms", concurrency_limit=TOOL_CONCURRENCY, concurrency_id="tools")
+    gr.api(fn=_mcp_align_batch, api_name="align_batch", concurrency_limit=TOOL_CONCURRENCY, concurrency_id="tools")
+    gr.api(fn=_mcp_submit_job, api_name="submit_job", concurrency_limit=None)
+    gr.api(fn=_mcp_job_status, api_name="job_status", concurrency_limit=None)
+    gr.api(fn=_mcp_job_result, api_name="job_result", concurrency_limit=None)
+    gr.api(fn=_mcp_cancel_job, api_name="cancel_job", concurrency_limit=None)
 
     # ---------------------------------------------------------------------------
     # Page-load handler (UI only — not an MCP tool)
@@ -480,8 +1015,11 @@ with gr.Blocks() as demo:
         # Two-stack file case (for stack-based alignment)
         if "file_url_1" in params and "file_url_2" in params:
             try:
-                results[5] = _resolve_path(params["file_url_1"], "file_url_1")  # ref_input
-                results[6] = _resolve_path(params["file_url_2"], "file_url_2")  # mov_input
+                # Both stacks are downloaded concurrently
+                results[5], results[6] = _resolve_all(
+                    (_resolve_path, params["file_url_1"], "file_url_1"),  # ref_input
+                    (_resolve_path, params["file_url_2"], "file_url_2"),  # mov_input
+                )
             except Exception as e:
                 print(f"[Error loading file_url_1 or file_url_2] {e}")
 
@@ -492,7 +1030,16 @@ with gr.Blocks() as demo:
         outputs=[file_input, reference_frame_slider, frame_file, ref_idx, mov_idx, ref_input, mov_input],
         show_api=False,
     )
+    demo.unload(close_previews)
+
+demo.queue(default_concurrency_limit=UI_CONCURRENCY, max_size=QUEUE_SIZE)
+
+
+def metrics(request):
+    """Prometheus scrape endpoint (not part of the Gradio API)."""
+    return PlainTextResponse(metrics_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 if __name__ == "__main__":
-    demo.launch(mcp_server=True)
\ No newline at end of file
+    routes = [Route("/metrics", metrics)] if INSTRUMENT_ENABLED else []
+    demo.launch(mcp_server=True, app_kwargs={"routes": routes})
\ No newline at end of file
@@ -0,0 +1,7 @@
+"""
+Benchmark suite for the registration pipeline.
+
+Run ``python -m benchmarks.run`` to measure throughput, memory, per-stage time
+and registration accuracy on synthetic stacks, and ``python -m
+benchmarks.compare`` to check a result file against a baseline.
+"""
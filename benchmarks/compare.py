@@ -0,0 +1,81 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare baseline.json results.json
+
+Cases present in both files are matched by name. A case regresses when its
+end-to-end throughput drops by more than ``--max-slowdown`` (a fraction), its
+mean registration error grows by more than ``--max-error-increase`` pixels,
+or its peak RSS grows by more than ``--max-memory-increase`` (a fraction).
+The exit status is 1 if any case regressed, so the command can gate a CI job.
+Timings are only comparable between runs on the same machine and settings.
+"""
+
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+DEFAULT_MAX_SLOWDOWN = 0.10
+DEFAULT_MAX_ERROR_INCREASE = 0.05
+DEFAULT_MAX_MEMORY_INCREASE = 0.20
+
+
+def _load(path: str) -> dict:
+    with open(path) as f:
+        report = json.load(f)
+    return {r["case"]: r for r in report.get("results", [])}
+
+
+def compare(
+    baseline: dict,
+    current: dict,
+    max_slowdown: float = DEFAULT_MAX_SLOWDOWN,
+    max_error_increase: float = DEFAULT_MAX_ERROR_INCREASE,
+    max_memory_increase: float = DEFAULT_MAX_MEMORY_INCREASE,
+) -> List[dict]:
+    """Return one row per case found in both result sets (keyed by case name)."""
+    rows = []
+    for case in [c for c in current if c in baseline]:
+        old, new = baseline[case], current[case]
+        speed = new["frames_per_second"] / old["frames_per_second"] - 1
+        error = new["error_px"]["mean"] - old["error_px"]["mean"]
+        memory = new["peak_rss_mb"] / old["peak_rss_mb"] - 1
+        problems = []
+        if speed < -max_slowdown:
+            problems.append("slower")
+        if error > max_error_increase:
+            problems.append("less accurate")
+        if memory > max_memory_increase:
+            problems.append("more memory")
+        rows.append({"case": case, "speed": speed, "error": error, "memory": memory, "problems": problems})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN)
+    parser.add_argument("--max-error-increase", type=float, default=DEFAULT_MAX_ERROR_INCREASE)
+    parser.add_argument("--max-memory-increase", type=float, default=DEFAULT_MAX_MEMORY_INCREASE)
+    args = parser.parse_args(argv)
+
+    baseline, current = _load(args.baseline), _load(args.current)
+    rows = compare(baseline, current, args.max_slowdown, args.max_error_increase, args.max_memory_increase)
+    width = max([len(r["case"]) for r in rows] + [4])
+    print(f"{'case':<{width}}  {'frames/s':>9}  {'error px':>9}  {'peak RSS':>9}")
+    for r in rows:
+        print(
+            f"{r['case']:<{width}}  {r['speed']:>+9.1%}  {r['error']:>+9.3f}  {r['memory']:>+9.1%}"
+            + (f"  REGRESSION: {', '.join(r['problems'])}" if r["problems"] else "")
+        )
+    for case in sorted(set(baseline) ^ set(current)):
+        print(f"{case:<{width}}  only in {'baseline' if case in baseline else 'current'}")
+    regressions = sum(1 for r in rows if r["problems"])
+    print(f"{len(rows)} case(s) compared, {regressions} regression(s).")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Registration benchmark runner.
+
+    python -m benchmarks.run --preset quick --output results.json
+
+For every combination of mode, frame size and frame count, a synthetic
+drifting uint16 stack with known motion (benchmarks/synthetic.py) is
+generated once and cached in ``--data-dir``. Each case then runs in a fresh
+process, so its peak RSS is its own, and records:
+
+- ``end_to_end_seconds`` / ``frames_per_second``: align_stack_to_reference()
+  as a client calls it (streaming pipeline, result cache disabled);
+- ``stages``: the same work split into load, normalize_input (load_stack()'s
+  uint8 stretch), estimate, transform, normalize_output and write, run one
+  after the other on in-memory arrays;
+- ``peak_rss_mb``: after the end-to-end run and after the staged run (which
+  holds the whole stack in memory);
+- ``error_px``: mean / 95th percentile / max over frames of the RMS distance
+  between estimated and ground-truth point positions.
+
+The results are written as JSON together with the git commit and the library
+versions, so that runs on different commits can be compared with
+``python -m benchmarks.compare``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import List, Optional
+
+# Time the work, not the result cache (read when core.cache is imported).
+os.environ["PSR_RESULT_CACHE_BYTES"] = "0"
+
+import numpy as np  # noqa: E402
+import pystackreg  # noqa: E402
+import tifffile  # noqa: E402
+
+from benchmarks.synthetic import registration_error, write_stack  # noqa: E402
+from core.executor import DEFAULT_CHUNK_SIZE, VALID_EXECUTORS  # noqa: E402
+from core.registration import VALID_MODES  # noqa: E402
+
+SCHEMA_VERSION = 1
+# Bump when the synthetic data changes, so cached stacks are regenerated.
+_DATA_VERSION = 1
+
+PRESETS = {
+    "quick": {"sizes": [64, 256], "frames": [10, 50]},
+    "standard": {"sizes": [64, 256, 1024], "frames": [10, 100, 1000]},
+    "full": {"sizes": [64, 256, 1024, 4096], "frames": [10, 100, 1000, 5000]},
+}
+# Cases whose input stack is larger than this are skipped (--max-stack-mb).
+DEFAULT_MAX_STACK_MB = 2048
+
+_MODE_ORDER = ["TRANSLATION", "RIGID_BODY", "SCALED_ROTATION", "AFFINE", "BILINEAR"]
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss  # KiB on Linux, bytes on macOS
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git() -> dict:
+    def run(*args) -> Optional[str]:
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=_REPO_ROOT, capture_output=True, text=True, check=True, timeout=30,
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    commit = run("rev-parse", "HEAD")
+    status = run("status", "--porcelain", "--untracked-files=no")
+    return {"commit": commit, "dirty": bool(status) if status is not None else None}
+
+
+def _environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pystackreg": getattr(pystackreg, "__version__", None),
+        "tifffile": tifffile.__version__,
+    }
+
+
+def _dataset(data_dir: str, mode: str, size: int, n_frames: int, seed: int) -> str:
+    """Return the path of the cached synthetic stack (generating it if needed);
+    its ground-truth matrices are stored next to it as ``.npy``."""
+    stem = os.path.join(data_dir, f"v{_DATA_VERSION}-{mode}-{size}-{n_frames}-{seed}")
+    if not (os.path.isfile(stem + ".tif") and os.path.isfile(stem + ".npy")):
+        tmp = stem + f".{os.getpid()}.partial.tif"
+        truth = write_stack(tmp, mode, n_frames, size, seed)
+        np.save(stem + ".npy", truth)
+        os.replace(tmp, stem + ".tif")
+    return stem + ".tif"
+
+
+def _run_case(
+    path: str,
+    mode: str,
+    size: int,
+    n_frames: int,
+    executor: str,
+    max_workers: Optional[int],
+    chunk_size: int,
+    repeat: int,
+) -> dict:
+    """Benchmark one stack (runs in its own process)."""
+    from core.artifacts import ARTIFACTS
+    from core.output import TiffOutput
+    from core.registration import (
+        _estimate_frames,
+        _iter_apply_frames,
+        _quantize,
+        align_stack_to_reference,
+    )
+    from core.utils import normalize_stack, open_stack
+
+    baseline_rss = _peak_rss_mb()
+
+    # End to end, as a client calls it; best of *repeat* runs.
+    staged = ARTIFACTS.create(".tif")  # the tools only read from WORK_DIR
+    os.unlink(staged)
+    try:
+        os.link(path, staged)
+    except OSError:
+        shutil.copy2(path, staged)
+    ARTIFACTS.add(staged)
+    end_to_end = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = align_stack_to_reference(
+            staged, reference_index=0, mode=mode,
+            executor=executor, max_workers=max_workers, chunk_size=chunk_size,
+        )
+        end_to_end.append(time.perf_counter() - start)
+        ARTIFACTS.remove(out)
+    ARTIFACTS.remove(staged)
+    end_to_end_rss = _peak_rss_mb()
+
+    # The same work, stage by stage.
+    stages = {}
+
+    def timed(name, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        stages[name] = round(time.perf_counter() - start, 6)
+        return result
+
+    def load():
+        with open_stack(path, normalize=False) as stack:
+            return np.array(stack[:])
+
+    raw = timed("load", load)
+    timed("normalize_input", normalize_stack, raw)
+    tmats = timed("estimate", _estimate_frames, raw, raw[0], mode, executor, max_workers, chunk_size)
+    aligned = timed(
+        "transform",
+        lambda: np.concatenate(list(_iter_apply_frames(raw, tmats, mode, executor, max_workers, chunk_size))),
+    )
+    out8 = timed("normalize_output", _quantize, aligned, "uint8")
+    fd, out_path = tempfile.mkstemp(suffix=".tif")
+    os.close(fd)
+    try:
+        timed("write", TiffOutput().save, out_path, out8)
+        output_bytes = os.path.getsize(out_path)
+    finally:
+        os.unlink(out_path)
+
+    truth = np.load(os.path.splitext(path)[0] + ".npy")
+    errors = registration_error(mode, truth, tmats, size)
+    input_bytes = os.path.getsize(path)
+    best = min(end_to_end)
+    return {
+        "case": f"{mode}/{size}x{size}x{n_frames}",
+        "mode": mode,
+        "size": size,
+        "frames": n_frames,
+        "dtype": str(raw.dtype),
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "end_to_end_seconds": round(best, 6),
+        "frames_per_second": round(n_frames / best, 3),
+        "stages": stages,
+        "load_mb_per_s": round(input_bytes / 1e6 / max(stages["load"], 1e-9), 1),
+        "write_mb_per_s": round(output_bytes / 1e6 / max(stages["write"], 1e-9), 1),
+        "baseline_rss_mb": baseline_rss,
+        "end_to_end_peak_rss_mb": end_to_end_rss,
+        "peak_rss_mb": _peak_rss_mb(),
+        "workers_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if executor == "process" else None,
+        "error_px": {
+            "mean": round(float(errors.mean()), 4),
+            "p95": round(float(np.percentile(errors, 95)), 4),
+            "max": round(float(errors.max()), 4),
+        },
+    }
+
+
+def _csv(kind):
+    return lambda value: [kind(v) for v in value.split(",") if v]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--modes", type=_csv(str), default=_MODE_ORDER, help="comma-separated (default: all)")
+    parser.add_argument("--sizes", type=_csv(int), help="comma-separated frame sizes (overrides the preset)")
+    parser.add_argument("--frames", type=_csv(int), help="comma-separated frame counts (overrides the preset)")
+    parser.add_argument("--executor", choices=sorted(VALID_EXECUTORS), default="serial")
+    parser.add_argument("--max-workers", type=int)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--repeat", type=int, default=1, help="end-to-end runs per case; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-stack-mb", type=float, default=DEFAULT_MAX_STACK_MB)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "psr_bench"))
+    parser.add_argument("--output", "-o", default="-", help="JSON result file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.modes) - VALID_MODES
+    if unknown:
+        parser.error(f"invalid mode(s) {', '.join(sorted(unknown))}; choose from {', '.join(_MODE_ORDER)}")
+    sizes = args.sizes or PRESETS[args.preset]["sizes"]
+    frame_counts = args.frames or PRESETS[args.preset]["frames"]
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    results, skipped = [], []
+    ctx = get_context("spawn")
+    for mode in args.modes:
+        for size in sizes:
+            for n_frames in frame_counts:
+                case = f"{mode}/{size}x{size}x{n_frames}"
+                if n_frames * size * size * 2 > args.max_stack_mb * 1024 ** 2:
+                    skipped.append({"case": case, "reason": f"input larger than {args.max_stack_mb:g} MB"})
+                    print(f"{case}: skipped (--max-stack-mb)", file=sys.stderr)
+                    continue
+                path = _dataset(args.data_dir, mode, size, n_frames, args.seed)
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    result = pool.submit(
+                        _run_case, path, mode, size, n_frames,
+                        args.executor, args.max_workers, args.chunk_size, args.repeat,
+                    ).result()
+                results.append(result)
+                print(
+                    f"{case}: {result['frames_per_second']:.1f} frames/s, "
+                    f"peak {result['peak_rss_mb']:.0f} MB, error {result['error_px']['mean']:.3f} px",
+                    file=sys.stderr,
+                )
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git": _git(),
+        "environment": _environment(),
+        "settings": {
+            "preset": args.preset,
+            "executor": args.executor,
+            "max_workers": args.max_workers,
+            "chunk_size": args.chunk_size,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "data_version": _DATA_VERSION,
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
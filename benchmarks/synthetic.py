@@ -0,0 +1,152 @@
+"""
+Synthetic drifting stacks with known ground-truth motion.
+
+Every frame of a stack is the same smooth random scene, sampled through a
+transformation of the requested mode that drifts from the identity (frame 0)
+as a random walk: translation for TRANSLATION, plus rotation for RIGID_BODY,
+plus isotropic scale for SCALED_ROTATION, plus shear for AFFINE, plus an xy
+term for BILINEAR. The scene is rendered on a larger canvas and cropped, so
+frames have no empty borders.
+
+Matrices follow pystackreg's convention: frame ``i`` holds ``scene(T_i p)``
+at pixel ``p``, and registering frame ``i`` to frame 0 should return a matrix
+``M_i`` with ``T_i(M_i p) = p``. registration_error() measures how far that
+is from true, in pixels.
+"""
+
+from typing import Callable, Iterator
+
+import numpy as np
+import tifffile
+from pystackreg import StackReg
+
+from core.utils import get_sr_mode
+
+# Per-frame random-walk step of each motion component, and its bound.
+_DRIFT_STEP, _DRIFT_MAX = 0.5, 0.04          # pixels; fraction of the frame size
+_ROTATION_STEP, _ROTATION_MAX = 0.15, 3.0    # degrees
+_SCALE_STEP, _SCALE_MAX = 0.002, 0.03
+_SHEAR_STEP, _SHEAR_MAX = 0.002, 0.02
+_BILINEAR_STEP, _BILINEAR_MAX = 0.1, 1.0     # pixels of xy displacement at the corners
+
+
+def _basis(mode: str, pts: np.ndarray) -> np.ndarray:
+    """Columns of the point map of *mode* at (N, 2) points *pts*, in matrix order."""
+    x, y = pts[:, 0], pts[:, 1]
+    one = np.ones_like(x)
+    if mode == "BILINEAR":
+        return np.stack([x, y, x * y, one], axis=1)
+    return np.stack([x, y, one], axis=1)
+
+
+def apply_matrix(mode: str, tmat: np.ndarray, pts: np.ndarray) -> np.ndarray:
+    """Map (N, 2) points (x, y) through a pystackreg matrix of *mode*."""
+    return _basis(mode, pts) @ tmat[:2].T
+
+
+def _fit_matrix(mode: str, point_map: Callable[[np.ndarray], np.ndarray], size: int) -> np.ndarray:
+    """The matrix of *mode* reproducing *point_map*, fitted on a grid (exact for
+    maps of that form)."""
+    g = np.linspace(0, size, 5)
+    pts = np.stack(np.meshgrid(g, g), axis=-1).reshape(-1, 2)
+    dim = 4 if mode == "BILINEAR" else 3
+    tmat = np.identity(dim)
+    tmat[:2] = np.linalg.lstsq(_basis(mode, pts), point_map(pts), rcond=None)[0].T
+    # Drop the fit's rounding noise: TurboReg samples a whole row off when a
+    # coordinate lands a hair below an integer.
+    return np.round(tmat, 12)
+
+
+def _walk(rng: np.random.Generator, n: int, step: float, bound: float, dims: int = 1) -> np.ndarray:
+    """Bounded random walk of *n* steps starting at 0."""
+    walk = np.cumsum(rng.normal(0, step, (n, dims)), axis=0)
+    walk -= walk[0]
+    return np.clip(walk, -bound, bound)
+
+
+def motion(mode: str, n_frames: int, size: int, seed: int = 0) -> np.ndarray:
+    """Ground-truth matrices (n_frames, 3, 3) — (n_frames, 4, 4) for BILINEAR —
+    of frames of *size* x *size* pixels, starting at the identity."""
+    rng = np.random.default_rng(seed)
+    shift = _walk(rng, n_frames, _DRIFT_STEP, _DRIFT_MAX * size, 2)
+    zeros = np.zeros(n_frames)
+    angle = np.radians(_walk(rng, n_frames, _ROTATION_STEP, _ROTATION_MAX)[:, 0]) \
+        if mode != "TRANSLATION" else zeros
+    scale = _walk(rng, n_frames, _SCALE_STEP, _SCALE_MAX)[:, 0] \
+        if mode in ("SCALED_ROTATION", "AFFINE", "BILINEAR") else zeros
+    shear = _walk(rng, n_frames, _SHEAR_STEP, _SHEAR_MAX)[:, 0] \
+        if mode in ("AFFINE", "BILINEAR") else zeros
+    half = size / 2
+    xy = _walk(rng, n_frames, _BILINEAR_STEP, _BILINEAR_MAX, 2) / half ** 2 \
+        if mode == "BILINEAR" else np.zeros((n_frames, 2))
+
+    tmats = []
+    for i in range(n_frames):
+        c, s = np.cos(angle[i]), np.sin(angle[i])
+        linear = (1 + scale[i]) * np.array([[c, -s], [s, c]]) @ np.array([[1, shear[i]], [0, 1]])
+
+        def point_map(pts, i=i, linear=linear):
+            u = pts - half  # rotate and scale about the frame centre
+            return half + u @ linear.T + shift[i] + (u[:, :1] * u[:, 1:]) * xy[i]
+
+        tmats.append(_fit_matrix(mode, point_map, size))
+    return np.stack(tmats)
+
+
+def scene(size: int, seed: int = 0) -> np.ndarray:
+    """A smooth random float64 image of *size* x *size* pixels, values 0-1."""
+    rng = np.random.default_rng(seed)
+    k = np.fft.fftfreq(size)
+    # Features about 1/40 of the frame across, whatever its size.
+    blur = np.exp(-(k[:, None] ** 2 + k[None, :] ** 2) * (size / 10.0) ** 2)
+    img = np.real(np.fft.ifft2(np.fft.fft2(rng.random((size, size))) * blur))
+    img -= img.min()
+    return img / img.max()
+
+
+def drifting_frames(
+    mode: str,
+    tmats: np.ndarray,
+    size: int,
+    seed: int = 0,
+    dtype=np.uint16,
+    noise: float = 0.01,
+) -> Iterator[np.ndarray]:
+    """Yield the frames of a stack moving by *tmats* (see motion()), one at a
+    time, with Gaussian noise of *noise* times the intensity range added."""
+    margin = int(0.15 * size) + 8
+    canvas = scene(size + 2 * margin, seed)
+    sr = StackReg(get_sr_mode(mode))
+    rng = np.random.default_rng(seed + 1)
+    info = np.iinfo(dtype) if np.dtype(dtype).kind in "ui" else None
+    low, span = (1000.0, 3000.0) if info is not None else (0.0, 1.0)
+    for tmat in tmats:
+        shifted = _fit_matrix(mode, lambda pts: apply_matrix(mode, tmat, pts - margin) + margin, size + 2 * margin)
+        frame = sr.transform(canvas, shifted)[margin:margin + size, margin:margin + size]
+        frame = low + span * (frame + rng.normal(0, noise, frame.shape))
+        if info is not None:
+            frame = np.clip(np.rint(frame), info.min, info.max)
+        yield frame.astype(dtype)
+
+
+def write_stack(path: str, mode: str, n_frames: int, size: int, seed: int = 0, dtype=np.uint16) -> np.ndarray:
+    """Write a drifting stack to the TIFF *path* frame by frame; return its
+    ground-truth matrices."""
+    tmats = motion(mode, n_frames, size, seed)
+    with tifffile.TiffWriter(path, bigtiff=n_frames * size * size * np.dtype(dtype).itemsize > 2 ** 31) as tw:
+        for frame in drifting_frames(mode, tmats, size, seed, dtype):
+            tw.write(frame, contiguous=True, photometric="minisblack")
+    return tmats
+
+
+def registration_error(mode: str, truth: np.ndarray, estimated: np.ndarray, size: int) -> np.ndarray:
+    """Per-frame RMS distance, in pixels, between where the estimated matrices
+    and the ground truth put a grid of points covering the central 80% of the
+    frame."""
+    g = np.linspace(0.1 * size, 0.9 * size, 9)
+    pts = np.stack(np.meshgrid(g, g), axis=-1).reshape(-1, 2)
+    errors = [
+        np.sqrt(np.mean(np.sum((apply_matrix(mode, t, apply_matrix(mode, m, pts)) - pts) ** 2, axis=1)))
+        for t, m in zip(truth, estimated)
+    ]
+    return np.asarray(errors)
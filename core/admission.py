@@ -0,0 +1,354 @@
+"""
+Admission control for registration calls.
+
+Registration is CPU-bound and its working set grows with the frame size, so
+starting every call the moment it arrives oversubscribes the cores and the
+memory and makes every call slow. Each call is therefore admitted against
+two budgets before it starts:
+
+- CPU: a call claims one slot per worker it will use (one for the serial
+  executor);
+- memory: a call claims an estimate of its working set, the frames in flight
+  in the pipeline at any time.
+
+Its cost, frames x pixels x a per-mode weight read from the TIFF headers
+only, decides its lane. Each lane has its own CPU slots and its own FIFO
+queue, so a small call is never stuck behind a giant one:
+
+- ``light``: calls of less than LIGHT_WORK_UNITS (a few seconds of work,
+  e.g. align_frame_to_frame), with LIGHT_SLOTS slots. Their working set is
+  small, so only their CPU slots are counted;
+- ``heavy``: everything else (and stacks given as URLs, whose size is not
+  known yet), with CPU_SLOTS slots and MEMORY_BUDGET_BYTES.
+
+A call that does not fit waits in its lane's queue. Synchronous calls give
+up with ServerBusy after MAX_WAIT_SECONDS, or at once when MAX_WAITING calls
+are already waiting in their lane; its retry_after estimates when capacity
+will be free, from the lane's measured throughput. Jobs wait in the queue
+until they are admitted. A call claiming more than a whole budget runs alone
+in its lane.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import tifffile
+
+from core.executor import DEFAULT_CHUNK_SIZE, resolve_workers
+from core.registration import _check_file, _is_url, _is_zip_name
+
+# CPU slots of the heavy lane (default: one per CPU).
+CPU_SLOTS = int(os.environ.get("PSR_CPU_SLOTS", os.cpu_count() or 1))
+# CPU slots of the light lane, on top of CPU_SLOTS.
+LIGHT_SLOTS = int(os.environ.get("PSR_LIGHT_SLOTS", 2))
+# Estimated working set of all running heavy calls together.
+MEMORY_BUDGET_BYTES = int(os.environ.get("PSR_MEMORY_BUDGET_BYTES", 4 * 1024 ** 3))
+# How long a synchronous call waits for admission before it is turned away.
+MAX_WAIT_SECONDS = float(os.environ.get("PSR_ADMISSION_WAIT", 30))
+# Synchronous calls allowed to wait per lane; further ones are turned away at once.
+MAX_WAITING = int(os.environ.get("PSR_ADMISSION_QUEUE", 8))
+
+# Calls of less work than this (about 4 s on one core) take the light lane.
+LIGHT_WORK_UNITS = 4 * 1024 ** 2
+
+LIGHT, HEAVY = "light", "heavy"
+LANES = (LIGHT, HEAVY)
+
+# Per-pixel cost of registering a frame, relative to transforming it, as
+# measured for TurboReg (one unit is about 1 us on a current core).
+_REGISTER_WEIGHTS = {
+    "TRANSLATION": 0.7,
+    "RIGID_BODY": 0.9,
+    "SCALED_ROTATION": 0.9,
+    "AFFINE": 1.1,
+    "BILINEAR": 2.2,
+}
+_TRANSFORM_WEIGHT = 0.3
+_PHASE_ONLY_WEIGHT = 0.1
+_DEFAULT_SECONDS_PER_UNIT = 1e-6
+# Calls shorter than this do not update the measured seconds per unit.
+_MIN_LEARN_SECONDS = 1.0
+# Working set per frame in flight, per pixel: the raw input plus the float64
+# result of TurboReg.
+_BYTES_PER_PIXEL = 16
+# Assumed size of an input that is not on disk yet (a URL).
+_UNKNOWN_FRAMES = 500
+_UNKNOWN_PIXELS = 1024 * 1024
+
+
+class ServerBusy(RuntimeError):
+    """Raised when a call cannot be admitted in time; see ``retry_after``."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """The estimated cost of one call and its claim on the budgets."""
+
+    def __init__(self, tool: str, lane: str, slots: int, memory_bytes: int, work: float, sized: bool = True):
+        self.tool = tool
+        self.lane = lane
+        self.slots = slots
+        self.memory_bytes = memory_bytes
+        self.work = work
+        self.sized = sized  # False if some input was a URL, so *work* is a guess
+        self.admitted_at: Optional[float] = None
+        self.estimated_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "lane": self.lane,
+            "cpu_slots": self.slots,
+            "memory_bytes": self.memory_bytes,
+            "work_units": int(self.work),
+        }
+
+
+# ---------------------------------------------------------------------------
+# Cost estimates (header-only)
+# ---------------------------------------------------------------------------
+
+def _scan(path: Optional[str], channel: Optional[int] = None) -> Tuple[int, int, int]:
+    """(frames, pixels per frame, channels) of a local stack, from its headers.
+
+    Only the IFD chain and the first page are parsed: one frame per page,
+    of the first page's size. With a *channel*, the pages of a ``C`` axis
+    count as one frame per channel. URLs, non-TIFF files and paths that
+    cannot be read (which the tool itself will report) count as a stack of
+    unknown size.
+    """
+    if path is None or _is_url(path):
+        return _UNKNOWN_FRAMES, _UNKNOWN_PIXELS, 1
+    try:
+        _check_file(path)
+        with tifffile.TiffFile(path) as tf:
+            first = tf.pages.first
+            frames = len(tf.pages)
+            pixels = int(first.imagelength) * int(first.imagewidth)
+            if channel is None:
+                return frames, pixels, 1
+            series = tf.series[0]
+            if "C" in series.axes:
+                channels = int(series.shape[series.axes.index("C")])
+                return max(1, frames // channels), pixels, channels
+            return frames, pixels, int(first.samplesperpixel)
+    except Exception:
+        return _UNKNOWN_FRAMES, _UNKNOWN_PIXELS, 1
+
+
+def _frame_work(mode: str, prealign: str = "none", registration_scale: int = 1, channels: int = 1,
+                register: bool = True, transform: bool = True) -> float:
+    """Work units per pixel of one frame."""
+    work = 0.0
+    if register:
+        weight = _PHASE_ONLY_WEIGHT if prealign == "phase_only" else _REGISTER_WEIGHTS.get(mode, 1.0)
+        work += weight / max(1, registration_scale) ** 2
+    if transform:
+        work += _TRANSFORM_WEIGHT * channels
+    return work
+
+
+def _slots(executor: str, max_workers: Optional[int]) -> int:
+    return 1 if executor == "serial" else resolve_workers(max_workers)
+
+
+def estimate(tool: str, arguments: dict) -> Ticket:
+    """Estimate the cost of calling *tool* with keyword *arguments*.
+
+    Only TIFF headers of local inputs are read; invalid arguments are left
+    for the tool to report.
+    """
+    get = arguments.get
+    mode = get("mode", "RIGID_BODY")
+    prealign = get("prealign", "none")
+    scale = get("registration_scale", 1) or 1
+    executor = get("executor", "process" if tool == "align_batch" else "serial")
+    slots = _slots(executor, get("max_workers"))
+    chunk_size = get("chunk_size", DEFAULT_CHUNK_SIZE) or DEFAULT_CHUNK_SIZE
+    remote = False
+
+    if tool == "align_frame_to_frame":
+        # Only two frames are read, whatever the size of the stack (or download).
+        _, pixels, _ = _scan(get("stack_file"))
+        frames, slots, in_flight = 1, 1, 2
+        work = pixels * _frame_work(mode, prealign, scale)
+        sized = not _is_url(get("stack_file") or "")
+    elif tool == "align_batch":
+        stacks = []
+        for path in get("stack_files") or []:
+            unknown = _is_url(path) or _is_zip_name(path)
+            remote = remote or unknown
+            stacks.append(_scan(None if unknown else path, get("channel")))
+        frames = sum(n for n, _, _ in stacks)
+        pixels = max([p for _, p, _ in stacks] or [0])
+        work = sum(n * p * _frame_work(mode, prealign, scale, c) for n, p, c in stacks)
+        in_flight = DEFAULT_CHUNK_SIZE * slots  # every worker registers one stack serially
+    else:
+        if tool == "align_stack_to_stack":
+            path = get("moving_stack_file")
+            remote = any(_is_url(p or "") for p in (path, get("reference_stack_file")))
+        else:
+            path = get("stack_file")
+            remote = _is_url(path or "") or _is_url(get("transforms_file") or "")
+        frames, pixels, channels = _scan(path, get("channel"))
+        per_pixel = _frame_work(
+            mode, prealign, scale, channels,
+            register=tool != "apply_transforms", transform=tool != "estimate_transforms",
+        )
+        work = frames * pixels * per_pixel
+        in_flight = chunk_size * (1 if executor == "serial" else 2 * slots)
+
+    if tool != "align_frame_to_frame":
+        sized = not remote
+    memory = min(frames, in_flight) * pixels * _BYTES_PER_PIXEL
+    lane = LIGHT if work < LIGHT_WORK_UNITS and not remote else HEAVY
+    return Ticket(tool, lane, slots, memory, work, sized)
+
+
+# ---------------------------------------------------------------------------
+# Controller
+# ---------------------------------------------------------------------------
+
+class AdmissionController:
+    """CPU-slot and memory budgets, with one FIFO queue per lane."""
+
+    def __init__(
+        self,
+        cpu_slots: int = CPU_SLOTS,
+        light_slots: int = LIGHT_SLOTS,
+        memory_bytes: int = MEMORY_BUDGET_BYTES,
+        max_waiting: int = MAX_WAITING,
+    ):
+        self.slots = {HEAVY: max(1, cpu_slots), LIGHT: max(1, light_slots)}
+        self.memory_bytes = memory_bytes
+        self.max_waiting = max_waiting
+        self._cond = threading.Condition()
+        self._running: List[Ticket] = []
+        self._waiting: Dict[str, deque] = {lane: deque() for lane in LANES}
+        # Core-seconds per work unit, an exponential moving average per lane.
+        self._rate = {lane: _DEFAULT_SECONDS_PER_UNIT for lane in LANES}
+        self.admitted = {lane: 0 for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+        self.wait_seconds = {lane: 0.0 for lane in LANES}
+
+    def _claim(self, ticket: Ticket) -> Tuple[int, int]:
+        """The slots and bytes *ticket* holds, clamped to the budgets."""
+        return min(ticket.slots, self.slots[ticket.lane]), min(ticket.memory_bytes, self.memory_bytes)
+
+    def _fits_locked(self, ticket: Ticket) -> bool:
+        slots, memory = self._claim(ticket)
+        running = [t for t in self._running if t.lane == ticket.lane]
+        if sum(self._claim(t)[0] for t in running) + slots > self.slots[ticket.lane]:
+            return False
+        return ticket.lane == LIGHT or sum(self._claim(t)[1] for t in running) + memory <= self.memory_bytes
+
+    def _seconds_locked(self, ticket: Ticket) -> float:
+        return ticket.work * self._rate[ticket.lane] / self._claim(ticket)[0]
+
+    def _retry_after_locked(self, lane: str, ticket: Optional[Ticket] = None) -> int:
+        """Seconds until the running calls of *lane*, and those waiting ahead
+        of *ticket*, should be done."""
+        now = time.time()
+        busy = sum(max(0.0, t.estimated_seconds - (now - t.admitted_at)) * self._claim(t)[0]
+                   for t in self._running if t.lane == lane)
+        for t in self._waiting[lane]:
+            if t is ticket:
+                break
+            busy += self._seconds_locked(t) * self._claim(t)[0]
+        return max(1, math.ceil(busy / self.slots[lane]))
+
+    def _busy(self, ticket: Ticket, reason: str) -> ServerBusy:
+        self.rejected[ticket.lane] += 1
+        retry_after = self._retry_after_locked(ticket.lane, ticket)
+        return ServerBusy(
+            f"Server busy: {reason} Retry in about {retry_after} s, or run {ticket.tool} "
+            "as a job (submit_job), which waits in the queue instead.",
+            retry_after,
+        )
+
+    def acquire(self, ticket: Ticket, timeout: Optional[float] = None,
+                cancel: Optional[threading.Event] = None) -> bool:
+        """Wait until *ticket* is admitted; return False if *cancel* was set first.
+
+        With a *timeout*, raises ServerBusy when the lane's queue is full or
+        the call is still not admitted after *timeout* seconds.
+        """
+        start = time.time()
+        with self._cond:
+            queue = self._waiting[ticket.lane]
+            must_wait = bool(queue) or not self._fits_locked(ticket)
+            if timeout is not None and must_wait and len(queue) >= self.max_waiting:
+                raise self._busy(ticket, f"{len(queue)} {ticket.lane} calls are already waiting.")
+            queue.append(ticket)
+            try:
+                while not (queue[0] is ticket and self._fits_locked(ticket)):
+                    if cancel is not None and cancel.is_set():
+                        return False
+                    remaining = None if timeout is None else start + timeout - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise self._busy(ticket, f"no {ticket.lane} capacity was free within {timeout:g} s.")
+                    # Wake up now and then to notice *cancel*.
+                    self._cond.wait(0.5 if remaining is None else min(remaining, 0.5))
+            finally:
+                queue.remove(ticket)
+                self._cond.notify_all()
+            ticket.admitted_at = time.time()
+            ticket.estimated_seconds = self._seconds_locked(ticket)
+            self._running.append(ticket)
+            self.admitted[ticket.lane] += 1
+            self.wait_seconds[ticket.lane] += ticket.admitted_at - start
+        return True
+
+    def release(self, ticket: Ticket) -> None:
+        """Return the budgets held by an admitted *ticket*, and learn from its run time."""
+        with self._cond:
+            self._running.remove(ticket)
+            elapsed = time.time() - ticket.admitted_at
+            # Short calls are mostly overhead (or result cache hits).
+            if ticket.sized and ticket.work > 0 and elapsed >= _MIN_LEARN_SECONDS:
+                rate = elapsed * self._claim(ticket)[0] / ticket.work
+                self._rate[ticket.lane] = 0.8 * self._rate[ticket.lane] + 0.2 * rate
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, tool: str, arguments: dict, timeout: Optional[float] = MAX_WAIT_SECONDS) -> Iterator[Ticket]:
+        """Context manager running a synchronous call of *tool* once admitted."""
+        ticket = estimate(tool, arguments)
+        self.acquire(ticket, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def retry_after(self, lane: str) -> int:
+        with self._cond:
+            return self._retry_after_locked(lane)
+
+    def stats(self) -> dict:
+        """Return usage, queue lengths and counters per lane."""
+        with self._cond:
+            lanes = {}
+            for lane in LANES:
+                running = [t for t in self._running if t.lane == lane]
+                lanes[lane] = {
+                    "running": len(running),
+                    "waiting": len(self._waiting[lane]),
+                    "cpu_slots": self.slots[lane],
+                    "cpu_slots_used": sum(self._claim(t)[0] for t in running),
+                    "memory_bytes_used": sum(self._claim(t)[1] for t in running),
+                    "admitted": self.admitted[lane],
+                    "rejected": self.rejected[lane],
+                    "wait_seconds": round(self.wait_seconds[lane], 3),
+                    "seconds_per_unit": self._rate[lane],
+                }
+            return {"memory_bytes": self.memory_bytes, **lanes}
+
+
+ADMISSION = AdmissionController()
@@ -0,0 +1,324 @@
+"""
+Managed store of the files written to WORK_DIR.
+
+Every tool output, staged upload and downloaded input lives in WORK_DIR. The
+store keeps an in-memory index of these files (size, last access, and who
+still holds them) instead of walking the directory, and deletes them under
+three rules, least recently used first:
+
+- ``ttl``: files not accessed for TTL_SECONDS (the old 30-minute sweep);
+- ``budget``: once the files together exceed WORK_DIR_BYTES;
+- ``pressure``: once the free space of the file system drops below
+  MIN_FREE_BYTES.
+
+A file is never deleted while it is leased (by a browser session that shows
+or offers it, or by a job whose result it is), while it is still being
+written, or within GRACE_SECONDS of its last access, which is how long an MCP
+client is given to fetch or chain an output it was just handed.
+
+A background thread checks the rules every CHECK_INTERVAL seconds, and is
+woken early when a new file pushes the store over budget or the disk runs
+low. Files the index does not know about (left over from a previous run, for
+example) are adopted by a directory scan once per TTL_SECONDS.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from core.utils import TTL_SECONDS, WORK_DIR
+
+# Byte budget of WORK_DIR; set PSR_WORK_DIR_BYTES=0 for no budget.
+WORK_DIR_BYTES = int(os.environ.get("PSR_WORK_DIR_BYTES", 8 * 1024 ** 3))
+# Free-space watermark of the file system holding WORK_DIR; 0 disables it.
+MIN_FREE_BYTES = int(os.environ.get("PSR_MIN_FREE_BYTES", 1024 ** 3))
+# Files accessed more recently than this are never evicted.
+GRACE_SECONDS = 5 * 60
+CHECK_INTERVAL = 30
+
+
+class _Artifact:
+    __slots__ = ("path", "size", "created", "last_access", "pending", "holders")
+
+    def __init__(self, path: str, size: int = 0, last_access: Optional[float] = None, pending: bool = False):
+        self.path = path
+        self.size = size
+        self.created = time.time()
+        self.last_access = self.created if last_access is None else last_access
+        self.pending = pending
+        self.holders: Set[str] = set()
+
+
+class ArtifactStore:
+    """Index and eviction policy of the files in WORK_DIR."""
+
+    def __init__(
+        self,
+        root: str = WORK_DIR,
+        max_bytes: int = WORK_DIR_BYTES,
+        min_free_bytes: int = MIN_FREE_BYTES,
+        ttl: float = TTL_SECONDS,
+        grace: float = GRACE_SECONDS,
+    ):
+        self.root = os.path.realpath(root)
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.ttl = ttl
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._entries: "OrderedDict[str, _Artifact]" = OrderedDict()  # least recently accessed first
+        self._leases: Dict[str, Set[str]] = {}
+        self._bytes = 0
+        self._last_scan = 0.0
+        self.evictions = {"ttl": 0, "budget": 0, "pressure": 0}
+        self.evicted_bytes = 0
+        self.sweeps = 0
+        self.last_sweep_seconds = 0.0
+        os.makedirs(root, exist_ok=True)
+        self.scan()
+
+    # -- registration -------------------------------------------------------
+
+    def _key(self, path: str) -> Optional[str]:
+        real = os.path.realpath(path)
+        return real if os.path.dirname(real) == self.root else None
+
+    def create(self, suffix: str = "") -> str:
+        """Create an empty file in WORK_DIR and return its path.
+
+        The file counts as being written, and is not evicted, until add() is
+        called on it (or TTL_SECONDS have passed).
+        """
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.root)
+        os.close(fd)
+        with self._lock:
+            self._entries[path] = _Artifact(path, pending=True)
+        if self._low_on_space():
+            self._wake.set()
+        return path
+
+    def add(self, path: str) -> None:
+        """Index the finished file *path* (or update its size) and mark it accessed.
+
+        Paths outside WORK_DIR are ignored.
+        """
+        key = self._key(path)
+        if key is None:
+            return
+        try:
+            size = os.stat(key).st_size
+        except FileNotFoundError:
+            self.discard(key)
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Artifact(key)
+                entry.holders = self._leases.get(key, set())
+            self._bytes += size - (0 if entry.pending else entry.size)
+            entry.size, entry.pending = size, False
+            entry.last_access = time.time()
+            self._entries.move_to_end(key)
+            over = self.max_bytes > 0 and self._bytes > self.max_bytes
+        if over or self._low_on_space():
+            self._wake.set()
+
+    def touch(self, path: str) -> None:
+        """Mark *path* as just accessed (indexing it if it is not yet known)."""
+        key = self._key(path)
+        if key is None:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_access = time.time()
+                self._entries.move_to_end(key)
+                return
+        self.add(key)
+
+    def discard(self, path: str) -> None:
+        """Forget *path* (moved away or deleted by its owner)."""
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.pop(key, None) if key is not None else None
+            if entry is not None and not entry.pending:
+                self._bytes -= entry.size
+
+    def remove(self, path: str) -> None:
+        """Delete *path*, if it still exists, and forget it."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.discard(path)
+
+    # -- leases -------------------------------------------------------------
+
+    def lease(self, path: str, holder: str) -> None:
+        """Keep *path* from being evicted until *holder* is released."""
+        key = self._key(path)
+        if key is None:
+            return
+        with self._lock:
+            holders = self._leases.setdefault(key, set())
+            holders.add(holder)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.holders = holders
+        self.touch(key)
+
+    def release(self, holder: str) -> None:
+        """Drop every lease of *holder*; its files age out normally afterwards."""
+        with self._lock:
+            for key in [k for k, holders in self._leases.items() if holder in holders]:
+                holders = self._leases[key]
+                holders.discard(holder)
+                if not holders:
+                    del self._leases[key]
+
+    # -- eviction -----------------------------------------------------------
+
+    def _free_bytes(self) -> Optional[int]:
+        try:
+            return shutil.disk_usage(self.root).free
+        except OSError:
+            return None
+
+    def _low_on_space(self) -> bool:
+        if self.min_free_bytes <= 0:
+            return False
+        free = self._free_bytes()
+        return free is not None and free < self.min_free_bytes
+
+    def scan(self) -> None:
+        """Reconcile the index with the directory: adopt unknown files (by
+        mtime) and forget files that have disappeared."""
+        found = {}
+        with os.scandir(self.root) as it:
+            for de in it:
+                try:
+                    if de.is_file(follow_symlinks=False):
+                        st = de.stat(follow_symlinks=False)
+                        found[os.path.join(self.root, de.name)] = (st.st_size, st.st_mtime)
+                except FileNotFoundError:
+                    continue
+        with self._lock:
+            for key in [k for k in self._entries if k not in found]:
+                entry = self._entries.pop(key)
+                if not entry.pending:
+                    self._bytes -= entry.size
+            adopted = False
+            for key, (size, mtime) in found.items():
+                if key not in self._entries:
+                    entry = self._entries[key] = _Artifact(key, size, last_access=mtime)
+                    entry.holders = self._leases.get(key, set())
+                    self._bytes += size
+                    adopted = True
+            if adopted:
+                self._entries = OrderedDict(sorted(self._entries.items(), key=lambda kv: kv[1].last_access))
+            self._last_scan = time.time()
+
+    def sweep(self) -> int:
+        """Apply the TTL, budget and free-space rules now; return the bytes freed."""
+        start = time.perf_counter()
+        now = time.time()
+        free = self._free_bytes() if self.min_free_bytes > 0 else None
+        with self._lock:
+            # Files still being written past the TTL were abandoned: settle them.
+            for entry in self._entries.values():
+                if entry.pending and now - entry.created > self.ttl:
+                    try:
+                        entry.size = os.stat(entry.path).st_size
+                    except FileNotFoundError:
+                        entry.size = 0
+                    entry.pending = False
+                    self._bytes += entry.size
+            victims = []
+            over = self._bytes - self.max_bytes if self.max_bytes > 0 else 0
+            short = self.min_free_bytes - free if free is not None else 0
+            for entry in self._entries.values():
+                if entry.pending or entry.holders or now - entry.last_access < self.grace:
+                    continue
+                if now - entry.last_access > self.ttl:
+                    reason = "ttl"
+                elif over > 0:
+                    reason = "budget"
+                elif short > 0:
+                    reason = "pressure"
+                else:
+                    break  # the rest are more recently used, hence within the TTL
+                victims.append((entry, reason))
+                over -= entry.size
+                short -= entry.size
+            for entry, _ in victims:
+                del self._entries[entry.path]
+                self._bytes -= entry.size
+            over_budget = self.max_bytes > 0 and self._bytes > self.max_bytes
+        freed = 0
+        for entry, reason in victims:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"[cleanup] {e}")
+                continue
+            freed += entry.size
+            with self._lock:
+                self.evictions[reason] += 1
+                self.evicted_bytes += entry.size
+        if over_budget or (short > 0 and free is not None):
+            print("[cleanup] WORK_DIR is still over its limits; the remaining files are in use.")
+        with self._lock:
+            self.sweeps += 1
+            self.last_sweep_seconds = time.perf_counter() - start
+        return freed
+
+    def start(self) -> None:
+        """Start the background sweeper (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="psr-artifacts")
+        self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            self._wake.wait(CHECK_INTERVAL)
+            self._wake.clear()
+            try:
+                if time.time() - self._last_scan > self.ttl:
+                    self.scan()
+                self.sweep()
+            except Exception as e:
+                print(f"[cleanup] {e}")
+
+    def stats(self) -> dict:
+        """Return current usage and eviction counters."""
+        free = self._free_bytes()
+        with self._lock:
+            leased = [e for e in self._entries.values() if e.holders]
+            return {
+                "files": len(self._entries),
+                "bytes": self._bytes,
+                "writing": sum(1 for e in self._entries.values() if e.pending),
+                "leased_files": len(leased),
+                "leased_bytes": sum(e.size for e in leased),
+                "holders": len({h for holders in self._leases.values() for h in holders}),
+                "max_bytes": self.max_bytes,
+                "free_bytes": free,
+                "min_free_bytes": self.min_free_bytes,
+                "evictions": dict(self.evictions),
+                "evicted_bytes": self.evicted_bytes,
+                "sweeps": self.sweeps,
+                "last_sweep_seconds": round(self.last_sweep_seconds, 6),
+            }
+
+
+ARTIFACTS = ArtifactStore()
@@ -0,0 +1,187 @@
+"""
+Content-addressed cache of registration results.
+
+A result is keyed on the SHA-256 of every input file plus the parameters that
+affect the output (mode, indices, output dtype, ...), so re-running the same
+job — after a browser refresh or an MCP agent retry — returns immediately,
+even if the input was re-uploaded or re-downloaded under a different name.
+
+Cached files live under APP_TMP_ROOT/results and are evicted least-recently-
+used once the cache exceeds its byte budget. A hit is hard-linked into
+WORK_DIR, so callers always receive a fresh sandbox path and eviction never
+invalidates a path that has already been handed out.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from core.utils import APP_TMP_ROOT, WORK_DIR
+
+RESULT_CACHE_DIR = os.path.join(APP_TMP_ROOT, "results")
+# Byte budget of the result cache; set PSR_RESULT_CACHE_BYTES=0 to disable it.
+RESULT_CACHE_BYTES = int(os.environ.get("PSR_RESULT_CACHE_BYTES", 2 * 1024 ** 3))
+# Bump whenever a change to the registration pipeline alters its outputs.
+_CACHE_VERSION = 1
+
+# Memoised file digests, least recently used first.
+_MAX_DIGESTS = 1024
+_DIGESTS: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_DIGESTS_LOCK = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 hex digest of *path*'s contents.
+
+    Digests of the last _MAX_DIGESTS files are memoised on (real path, size,
+    mtime) so that a file used by several calls in a row is only hashed once.
+    """
+    st = os.stat(path)
+    memo_key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+    with _DIGESTS_LOCK:
+        digest = _DIGESTS.get(memo_key)
+        if digest is not None:
+            _DIGESTS.move_to_end(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with _DIGESTS_LOCK:
+            _DIGESTS[memo_key] = digest
+            while len(_DIGESTS) > _MAX_DIGESTS:
+                _DIGESTS.popitem(last=False)
+    return digest
+
+
+def array_digest(*arrays) -> str:
+    """Return the SHA-256 hex digest of the dtypes, shapes and contents of *arrays*."""
+    h = hashlib.sha256()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f"{a.dtype.str}{a.shape}".encode("utf-8"))
+        h.update(a.data)
+    return h.hexdigest()
+
+
+def _link_into(src: str, directory: str, suffix: str) -> str:
+    """Hard-link *src* to a new unique path in *directory* (copy if linking fails)."""
+    fd, dst = tempfile.mkstemp(suffix=suffix, dir=directory)
+    os.close(fd)
+    os.unlink(dst)  # remove placeholder so os.link can create the entry
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+class ResultCache:
+    """Size-bounded LRU cache of output files, addressed by content hash."""
+
+    def __init__(self, root: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        # Rebuild the index from disk, oldest access first.
+        files = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, os.path.splitext(name)[0], path, st.st_size))
+        for _, key, path, size in sorted(files):
+            self._entries[key] = (path, size)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(kind: str, inputs: Iterable[Optional[str]], params: dict) -> str:
+        """Return the cache key for a call of *kind* on *inputs* with *params*."""
+        payload = {
+            "version": _CACHE_VERSION,
+            "kind": kind,
+            "inputs": [file_digest(p) if p is not None else None for p in inputs],
+            "params": params,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a fresh WORK_DIR path holding the cached result for *key*, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        path = entry[0]
+        try:
+            os.utime(path)  # persist the LRU order across restarts
+            out = _link_into(path, WORK_DIR, os.path.splitext(path)[1])
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(key, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return out
+
+    def put(self, key: str, path: str) -> None:
+        """Store the output file *path* under *key* and evict old entries if needed."""
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return
+        dst = os.path.join(self.root, key + os.path.splitext(path)[1])
+        try:
+            os.link(path, dst)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copy2(path, dst)
+        with self._lock:
+            self._entries[key] = (dst, size)
+            self._entries.move_to_end(key)
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        total = sum(size for _, size in self._entries.values())
+        while total > self.max_bytes and self._entries:
+            _, (path, size) = self._entries.popitem(last=False)
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current usage."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": sum(size for _, size in self._entries.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,566 @@
+"""
+Safe, cached HTTP(S) downloads for remote inputs.
+
+MCP clients and ``?file_url=`` deep links pass URLs instead of files. Every
+download is protected against SSRF (private/internal addresses are refused,
+including after redirects), capped in size and checked for the expected magic
+bytes.
+
+Downloads are cached on disk, keyed on the URL:
+
+- Cached entries keep the server's ETag / Last-Modified validators and are
+  revalidated with a conditional GET; a ``304 Not Modified`` reuses the file.
+- The cache is evicted least-recently-used once it exceeds its byte budget.
+- Concurrent requests for the same URL share a single download (single-flight).
+- Demo files from the pystackreg repository are kept permanently in DEMO_DIR.
+
+Callers receive a path inside the sandbox (WORK_DIR or DEMO_DIR); cache
+entries are handed out as fresh hard links, so eviction never invalidates a
+path that has already been returned.
+
+StreamingDownload runs a download in the background and lets a reader consume
+the file while it is still arriving, so decoding and registration can overlap
+with the network transfer.
+"""
+
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, Optional, Tuple
+
+from core.artifacts import ARTIFACTS
+from core.cache import _link_into
+from core.instrument import span
+from core.utils import APP_TMP_ROOT, WORK_DIR, _demo_path_for_url, _is_demo_url
+
+# Maximum size allowed for HTTP downloads (prevents resource-exhaustion attacks).
+_MAX_DOWNLOAD_BYTES = 500 * 1024 * 1024  # 500 MB
+_DOWNLOAD_TIMEOUT = 30  # seconds
+
+# Valid TIFF magic byte sequences (little/big-endian classic and BigTIFF).
+_TIFF_MAGIC = (
+    b"II\x2A\x00",  # little-endian TIFF
+    b"MM\x00\x2A",  # big-endian TIFF
+    b"II\x2B\x00",  # little-endian BigTIFF
+    b"MM\x00\x2B",  # big-endian BigTIFF
+)
+
+# ZIP archives; transformation sidecars are written with np.savez, i.e. as ZIP.
+_ZIP_MAGIC = (b"PK\x03\x04",)
+_NPZ_MAGIC = _ZIP_MAGIC
+
+
+
+class DownloadCancelled(Exception):
+    """Raised inside a download that was cancelled through its cancel event."""
+
+
+class _Progress:
+    """State shared between a running download and readers of its partial file."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.file = None  # read handle on the temp file, once streaming
+        self.claimed = False  # whether a reader took over (and closes) the handle
+        self.size: Optional[int] = None  # announced Content-Length
+        self.received = 0
+        self.done = False
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+    def start(self, path: str, size: int) -> None:
+        # Opened here, before the file can be moved into the cache or removed.
+        handle = open(path, "rb", buffering=0)
+        with self._cond:
+            self.file, self.size = handle, size
+            self._cond.notify_all()
+
+    def advance(self, received: int) -> None:
+        with self._cond:
+            self.received = received
+            self._cond.notify_all()
+
+    def finish(self, result: Optional[str] = None, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            if self.file is not None and not self.claimed:
+                self.file.close()  # nobody is going to read it any more
+                self.file = None
+            self._cond.notify_all()
+
+    def claim(self) -> Optional[io.RawIOBase]:
+        """Block until the partial file can be read or the download is over.
+
+        Returns the read handle, which the caller must close, or None when
+        there is nothing to stream (any more).
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.file is not None or self.done)
+            if self.file is None:
+                return None
+            self.claimed = True
+            return self.file
+
+    def wait_for(self, nbytes: int) -> None:
+        """Block until *nbytes* have been written; raise the download's error, if any."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.received >= nbytes or self.done)
+            if self.error is not None:
+                raise self.error
+            if self.received < nbytes:
+                raise EOFError("download ended before the requested data arrived")
+
+
+class _GrowingFile(io.RawIOBase):
+    """Read-only, seekable view of a file that is still being downloaded.
+
+    Reads block until the requested bytes have arrived. The file reports its
+    announced final size, so parsers can seek freely before the download ends.
+    Deliberately has no fileno(), so readers cannot bypass the blocking reads.
+    """
+
+    def __init__(self, progress: _Progress, handle: io.RawIOBase):
+        super().__init__()
+        self._progress = progress
+        self._f = handle
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._progress.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")  # callers may pass typed arrays
+        end = min(self._pos + len(view), self._progress.size)
+        if end <= self._pos:
+            return 0
+        self._progress.wait_for(end)
+        self._f.seek(self._pos)
+        n = self._f.readinto(view[: end - self._pos])
+        self._pos += n
+        return n
+
+    def close(self) -> None:
+        self._f.close()
+        super().close()
+
+
+DOWNLOAD_CACHE_DIR = os.path.join(APP_TMP_ROOT, "downloads")
+# Byte budget of the download cache; set PSR_DOWNLOAD_CACHE_BYTES=0 to disable it.
+DOWNLOAD_CACHE_BYTES = int(os.environ.get("PSR_DOWNLOAD_CACHE_BYTES", 2 * 1024 ** 3))
+
+
+def _block_private_url(url: str) -> None:
+    """Raise ValueError if *url* resolves to a private, loopback, link-local,
+    reserved, or multicast address (SSRF protection)."""
+    parsed = urllib.parse.urlparse(url)
+    host = parsed.hostname
+    if not host:
+        raise ValueError(f"Could not parse host from URL: {url!r}")
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror as exc:
+        raise ValueError(f"Could not resolve host '{host}': {exc}") from exc
+    for info in infos:
+        addr_str = info[4][0]
+        try:
+            addr = ipaddress.ip_address(addr_str)
+        except ValueError:
+            continue
+        if (
+            addr.is_private
+            or addr.is_loopback
+            or addr.is_link_local
+            or addr.is_reserved
+            or addr.is_multicast
+            or addr.is_unspecified
+        ):
+            raise ValueError(
+                f"Requests to private or internal addresses are not allowed "
+                f"('{host}' resolved to {addr})."
+            )
+
+
+class _SafeRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _block_private_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_SAFE_URL_OPENER = urllib.request.build_opener(_SafeRedirectHandler)
+
+
+def _fetch(
+    url: str,
+    label: str,
+    suffix: str = ".tif",
+    magic: tuple = _TIFF_MAGIC,
+    kind: str = "TIFF",
+    headers: Optional[Dict[str, str]] = None,
+    cancel: Optional[threading.Event] = None,
+    progress: Optional[_Progress] = None,
+) -> Tuple[Optional[str], dict]:
+    """Download *url* to a temp file in WORK_DIR, validating magic bytes and size.
+
+    Uses chunked streaming so that the full file is never held in memory.
+    Returns ``(local_path, validators)``; *local_path* is None when the server
+    answered a conditional request (*headers*) with 304 Not Modified.
+    Raises ValueError on SSRF, size-limit, or magic-byte failures, and
+    DownloadCancelled as soon as *cancel* is set (checked between chunks).
+    Cleans up the temp file before raising on any error.
+
+    If *progress* is given and the server announces a Content-Length, the temp
+    file is published through it and flushed after every chunk, so that it can
+    be read while the download is still running.
+    """
+    _block_private_url(url)
+
+    local_path = ARTIFACTS.create(suffix)
+
+    total = 0
+    first4 = b""
+
+    try:
+        request = urllib.request.Request(url, headers=headers or {})
+        try:
+            resp = _SAFE_URL_OPENER.open(request, timeout=_DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as exc:
+            if exc.code != 304:
+                raise
+            with exc:
+                _block_private_url(exc.geturl())
+            ARTIFACTS.remove(local_path)
+            return None, {}
+
+        with resp, open(local_path, "wb") as f:
+            _block_private_url(resp.geturl())
+            validators = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+            }
+            length = resp.headers.get("Content-Length")
+            streaming = progress is not None and length is not None and length.isdigit()
+            if streaming:
+                length = int(length)
+                if length > _MAX_DOWNLOAD_BYTES:
+                    raise ValueError(
+                        f"{label} exceeds the maximum allowed download size of "
+                        f"{_MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB."
+                    )
+                progress.start(local_path, length)
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled(f"Download of {label} was cancelled.")
+                chunk = resp.read1(1024 * 1024)  # whatever has arrived, up to 1 MB
+                if not chunk:
+                    break
+
+                if len(first4) < 4:
+                    first4 = (first4 + chunk[: 4 - len(first4)])[:4]
+                    if len(first4) == 4 and not any(first4.startswith(m) for m in magic):
+                        raise ValueError(f"{label} does not appear to be a valid {kind} file.")
+
+                total += len(chunk)
+                if total > _MAX_DOWNLOAD_BYTES:
+                    raise ValueError(
+                        f"{label} exceeds the maximum allowed download size of "
+                        f"{_MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB."
+                    )
+
+                f.write(chunk)
+                if streaming:
+                    f.flush()
+                    progress.advance(total)
+
+        if total == 0:
+            raise ValueError(f"{label} is empty.")
+
+        if len(first4) < 4 or not any(first4.startswith(m) for m in magic):
+            raise ValueError(f"{label} does not appear to be a valid {kind} file.")
+
+        if streaming and total != length:
+            raise ValueError(f"{label} download was incomplete ({total} of {length} bytes).")
+
+        ARTIFACTS.add(local_path)
+        return local_path, validators
+
+    except Exception:
+        ARTIFACTS.remove(local_path)
+        raise
+
+
+class DownloadCache:
+    """URL-keyed on-disk cache with conditional revalidation and LRU eviction."""
+
+    def __init__(self, root: str = DOWNLOAD_CACHE_DIR, max_bytes: int = DOWNLOAD_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        metas = []
+        for name in os.listdir(root):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(root, name)) as f:
+                    meta = json.load(f)
+                metas.append((os.path.getmtime(meta["path"]), meta))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, meta in sorted(metas, key=lambda m: m[0]):
+            self._entries[meta["url"]] = meta
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _stem(self, url: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32])
+
+    def fetch(
+        self,
+        url: str,
+        label: str,
+        suffix: str,
+        magic: tuple,
+        kind: str,
+        cancel: Optional[threading.Event] = None,
+        progress: Optional[_Progress] = None,
+    ) -> str:
+        """Return a local path for *url*, downloading or revalidating as needed."""
+        while True:
+            with self._lock:
+                future = self._inflight.get(url)
+                leader = future is None
+                if leader:
+                    future = self._inflight[url] = Future()
+            if leader:
+                break
+            # Another request is already fetching this URL: share its result,
+            # unless that request was cancelled, in which case take over.
+            try:
+                path = self._wait_for(future, label, cancel)
+            except DownloadCancelled:
+                if cancel is not None and cancel.is_set():
+                    raise
+                continue
+            try:
+                return self._hand_out(path, label, suffix, magic, kind, shared=True)
+            except FileNotFoundError:
+                continue  # the leader's caller already removed its uncached file
+        try:
+            path = self._fetch_into_cache(url, label, suffix, magic, kind, cancel, progress)
+            future.set_result(path)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+        return self._hand_out(path, label, suffix, magic, kind)
+
+    @staticmethod
+    def _wait_for(future: Future, label: str, cancel: Optional[threading.Event]) -> str:
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled(f"Download of {label} was cancelled.")
+            try:
+                return future.result(timeout=0.25)
+            except FutureTimeout:
+                pass
+
+    def _hand_out(self, path: str, label: str, suffix: str, magic: tuple, kind: str, shared: bool = False) -> str:
+        # Entries are keyed on the URL alone, so a file revalidated (or
+        # fetched by another request) as one kind may be asked for as another.
+        with open(path, "rb") as f:
+            if not any(f.read(4).startswith(m) for m in magic):
+                raise ValueError(f"{label} does not appear to be a valid {kind} file.")
+        # Cache entries may be evicted later, so callers get their own link.
+        # An uncached download belongs to the request that fetched it; the
+        # requests that joined it (*shared*) get their own link as well.
+        # Demo files are permanent and handed out as they are.
+        directory = os.path.dirname(path)
+        if directory == self.root or (shared and directory == WORK_DIR):
+            path = _link_into(path, WORK_DIR, suffix)
+        ARTIFACTS.add(path)
+        return path
+
+    def _fetch_into_cache(
+        self,
+        url: str,
+        label: str,
+        suffix: str,
+        magic: tuple,
+        kind: str,
+        cancel: Optional[threading.Event] = None,
+        progress: Optional[_Progress] = None,
+    ) -> str:
+        if _is_demo_url(url):
+            demo_path = _demo_path_for_url(url, suffix)
+            if not os.path.isfile(demo_path):
+                tmp, _ = _fetch(url, label, suffix, magic, kind, cancel=cancel, progress=progress)
+                os.replace(tmp, demo_path)
+                ARTIFACTS.discard(tmp)
+            return demo_path
+
+        with self._lock:
+            meta = self._entries.get(url)
+        headers = {}
+        if meta is not None and os.path.isfile(meta["path"]):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        tmp, validators = _fetch(url, label, suffix, magic, kind, headers, cancel, progress)
+        if tmp is None:
+            try:
+                os.utime(meta["path"])  # persist the LRU order across restarts
+            except FileNotFoundError:
+                # Evicted while revalidating: fetch unconditionally instead.
+                tmp, validators = _fetch(url, label, suffix, magic, kind, cancel=cancel, progress=progress)
+            else:
+                with self._lock:
+                    self.hits += 1
+                    self.revalidated += 1
+                    if url in self._entries:
+                        self._entries.move_to_end(url)
+                return meta["path"]
+
+        with self._lock:
+            self.misses += 1
+        if not (validators["etag"] or validators["last_modified"]):
+            return tmp  # nothing to revalidate against: not worth caching
+
+        size = os.path.getsize(tmp)
+        if size > self.max_bytes:
+            return tmp
+        path = self._stem(url) + suffix
+        os.replace(tmp, path)
+        ARTIFACTS.discard(tmp)
+        meta = {"url": url, "path": path, "size": size, **validators}
+        with open(self._stem(url) + ".json", "w") as f:
+            json.dump(meta, f)
+        with self._lock:
+            self._entries[url] = meta
+            self._entries.move_to_end(url)
+            self._evict_locked()
+        return path
+
+    def _evict_locked(self) -> None:
+        total = sum(meta["size"] for meta in self._entries.values())
+        while total > self.max_bytes and self._entries:
+            url, meta = self._entries.popitem(last=False)
+            total -= meta["size"]
+            for p in (meta["path"], self._stem(url) + ".json"):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current usage."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "entries": len(self._entries),
+                "bytes": sum(meta["size"] for meta in self._entries.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+
+DOWNLOAD_CACHE = DownloadCache()
+
+
+def _download_to_work_dir(
+    url: str,
+    label: str,
+    suffix: str = ".tif",
+    magic: tuple = _TIFF_MAGIC,
+    kind: str = "TIFF",
+    cancel: Optional[threading.Event] = None,
+    progress: Optional[_Progress] = None,
+) -> str:
+    """Return a sandbox-safe local copy of *url* (see DownloadCache).
+
+    Raises ValueError on SSRF, size-limit, or magic-byte failures, and
+    DownloadCancelled if *cancel* is set while the download is running.
+    """
+    with span("download"):
+        if not DOWNLOAD_CACHE.enabled and not _is_demo_url(url):
+            return _fetch(url, label, suffix, magic, kind, cancel=cancel, progress=progress)[0]
+        return DOWNLOAD_CACHE.fetch(url, label, suffix, magic, kind, cancel, progress)
+
+
+def _download_tiff_to_work_dir(url: str, label: str, cancel: Optional[threading.Event] = None) -> str:
+    """Download a TIFF from *url* to WORK_DIR (see _download_to_work_dir)."""
+    return _download_to_work_dir(url, label, cancel=cancel)
+
+
+class StreamingDownload:
+    """Download a TIFF from *url* in the background, readable while it arrives.
+
+    open() returns a blocking file object over the partial download, or None
+    when there is nothing to stream (cache hit, demo file, no Content-Length,
+    a request that joined another one already in flight, or a download that
+    is already over); result() waits
+    for the download and returns its local path, like _download_tiff_to_work_dir().
+    """
+
+    def __init__(self, url: str, label: str):
+        self._progress = _Progress()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(url, label), daemon=True)
+        self._thread.start()
+
+    def _run(self, url: str, label: str) -> None:
+        try:
+            path = _download_to_work_dir(url, label, cancel=self._cancel, progress=self._progress)
+        except BaseException as exc:
+            self._progress.finish(error=exc)
+        else:
+            self._progress.finish(result=path)
+
+    def open(self) -> Optional[io.RawIOBase]:
+        handle = self._progress.claim()
+        if handle is None:
+            return None
+        return _GrowingFile(self._progress, handle)
+
+    def result(self) -> str:
+        with span("download"):
+            self._thread.join()
+        if self._progress.error is not None:
+            raise self._progress.error
+        return self._progress.result
+
+    def cancel(self) -> None:
+        """Abort the download (if still running) and wait for it to stop."""
+        self._cancel.set()
+        self._thread.join()
@@ -0,0 +1,114 @@
+"""
+Pluggable executor layer for per-frame work.
+
+Registration cost is dominated by independent per-frame TurboReg calls, so the
+backend splits a stack into chunks of frames and maps a worker function over
+those chunks using one of three strategies:
+
+- ``serial``: run everything in the calling thread (default, no overhead).
+- ``thread``: a shared ``ThreadPoolExecutor``.
+- ``process``: a shared ``ProcessPoolExecutor`` (true multi-core scaling, since
+  the TurboReg extension holds the GIL while it runs).
+
+Results are always yielded in submission order, so output frame order is
+deterministic regardless of which worker finishes first.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from core.instrument import iterate
+
+VALID_EXECUTORS = {"serial", "thread", "process"}
+
+DEFAULT_CHUNK_SIZE = 16
+
+_POOLS: Dict[Tuple[str, int], Executor] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def validate_executor(executor: str, max_workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """Raise ValueError if the executor settings are not usable."""
+    if executor not in VALID_EXECUTORS:
+        raise ValueError(
+            f"Invalid executor '{executor}'. "
+            f"Must be one of: {', '.join(sorted(VALID_EXECUTORS))}."
+        )
+    if max_workers is not None and max_workers < 1:
+        raise ValueError(f"max_workers must be at least 1 (got {max_workers}).")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1 (got {chunk_size}).")
+
+
+def resolve_workers(max_workers: Optional[int] = None) -> int:
+    """Return the effective worker count (defaults to the number of CPUs)."""
+    return max_workers or os.cpu_count() or 1
+
+
+def get_pool(executor: str, max_workers: Optional[int] = None) -> Optional[Executor]:
+    """Return a shared pool for *executor*, or None for serial execution.
+
+    Pools are created lazily and reused across calls so that worker processes
+    (and the per-worker StackReg instances they hold) survive between jobs.
+    """
+    if executor == "serial":
+        return None
+    workers = resolve_workers(max_workers)
+    key = (executor, workers)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+            pool = cls(max_workers=workers)
+            _POOLS[key] = pool
+        return pool
+
+
+def iter_map(
+    fn: Callable[..., Any],
+    tasks: Iterable[Tuple[Any, ...]],
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+) -> Iterator[Any]:
+    """Yield ``fn(*task)`` for every task, in submission order.
+
+    *tasks* is consumed lazily and at most ``2 * workers`` tasks are in flight
+    at any time, so memory stays bounded even for very long stacks. For the
+    ``process`` executor, *fn* and the task arguments must be picklable.
+
+    The time spent waiting for each result is reported as a stage named after
+    *fn* (``_register_chunk`` -> ``register``).
+    """
+    stage = fn.__name__.strip("_")
+    if stage.endswith("_chunk"):
+        stage = stage[:-len("_chunk")]
+    return iterate(stage, _iter_map(fn, tasks, executor, max_workers))
+
+
+def _iter_map(
+    fn: Callable[..., Any],
+    tasks: Iterable[Tuple[Any, ...]],
+    executor: str,
+    max_workers: Optional[int],
+) -> Iterator[Any]:
+    pool = get_pool(executor, max_workers)
+    if pool is None:
+        for task in tasks:
+            yield fn(*task)
+        return
+
+    window = 2 * resolve_workers(max_workers)
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(pool.submit(fn, *task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
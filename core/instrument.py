@@ -0,0 +1,300 @@
+"""
+Per-request timing, metrics and profiling.
+
+Every backend tool call runs inside request(), which collects a breakdown of
+where its time went, by stage:
+
+- span(name) times a block, and iterate(name, it) the time spent producing
+  each item of an iterator (reading chunks, waiting for registered chunks
+  from the workers, ...). Times are exclusive: a stage nested in another
+  (e.g. the reads that feed the registration of a chunk, or the frames a
+  writer pulls through the pipeline) is charged to itself only, so the
+  stages of a request add up to its wall time. What no stage covers is
+  reported as ``other``.
+- Only the thread running the request is timed; spans anywhere else (worker
+  threads, the web UI outside a tool call) cost one attribute lookup.
+- With PSR_INSTRUMENT=0, span() and iterate() return no-op objects.
+
+Finished requests are aggregated into Prometheus metrics (request counts and
+a duration histogram per tool, seconds per tool and stage) that
+metrics_text() renders together with the gauges of register_stats()
+sources (caches, WORK_DIR, jobs). The web app serves them at ``/metrics``.
+Jobs attach the breakdown of their run to their status.
+
+Set PSR_PROFILE_DIR to run requests under cProfile and write one ``.prof``
+file per request there (PSR_PROFILE_SAMPLE, 0-1, profiles only a random
+fraction of them). For sampling a live process from outside, py-spy works
+as usual; job worker threads are named ``psr-job-<lane>``.
+"""
+
+import cProfile
+import functools
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+ENABLED = os.environ.get("PSR_INSTRUMENT", "1") != "0"
+PROFILE_DIR = os.environ.get("PSR_PROFILE_DIR") or None
+PROFILE_SAMPLE = float(os.environ.get("PSR_PROFILE_SAMPLE", 1.0))
+
+# Upper bounds of the request duration histogram, in seconds.
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+_NOOP = nullcontext()
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+
+_REQUESTS: Dict[Tuple[str, str], int] = {}
+_IN_PROGRESS: Dict[str, int] = {}
+_DURATIONS: Dict[str, List[float]] = {}  # tool -> [bucket counts..., sum, count]
+_STAGE_SECONDS: Dict[Tuple[str, str], float] = {}
+_STATS: List[Tuple[str, Callable[[], dict]]] = []
+
+
+class Timings:
+    """Exclusive seconds per stage of one request."""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.stages: Dict[str, float] = {}
+        self.total = 0.0
+        self.profile: Optional[str] = None
+        # Open frames of this thread: [name, start, seconds spent in nested frames]
+        self._stack: List[list] = []
+
+    def _push(self, name: str) -> None:
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def _pop(self) -> None:
+        name, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed - nested
+
+    def as_dict(self) -> dict:
+        return {
+            "total_seconds": round(self.total, 6),
+            "stages": {name: round(s, 6) for name, s in sorted(self.stages.items(), key=lambda kv: -kv[1])},
+            "profile": self.profile,
+        }
+
+
+class _Span:
+    __slots__ = ("timings", "name")
+
+    def __init__(self, timings: Timings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.timings._push(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.timings._pop()
+        return False
+
+
+def current() -> Optional[Timings]:
+    """The Timings of the request running in this thread, if any."""
+    return getattr(_LOCAL, "timings", None)
+
+
+def span(name: str):
+    """Context manager charging the time of its block to stage *name*."""
+    timings = getattr(_LOCAL, "timings", None) if ENABLED else None
+    return _Span(timings, name) if timings is not None else _NOOP
+
+
+def iterate(name: str, iterable: Iterable) -> Iterator:
+    """Pass *iterable* through, charging the time taken by each ``next()`` to stage *name*."""
+    if not ENABLED:
+        return iter(iterable)
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name: str, it: Iterator) -> Iterator:
+    try:
+        while True:
+            timings = getattr(_LOCAL, "timings", None)
+            if timings is None:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            else:
+                timings._push(name)
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    timings._pop()
+            yield item
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()  # e.g. cancel the futures of an abandoned iter_map()
+
+
+@contextmanager
+def request(tool: str) -> Iterator[Optional[Timings]]:
+    """Time a backend call of *tool* in this thread and record its metrics.
+
+    Yields the Timings of the request (None when instrumentation is off). A
+    request started inside another one is timed as a stage of the outer one
+    (or not at all if it has the same name, e.g. a job running its tool).
+    """
+    outer = getattr(_LOCAL, "timings", None) if ENABLED else None
+    if not ENABLED or outer is not None:
+        with span(tool) if outer is not None and outer.tool != tool else _NOOP:
+            yield outer
+        return
+
+    timings = Timings(tool)
+    profiler = None
+    if PROFILE_DIR and random.random() < PROFILE_SAMPLE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active in this thread
+            profiler = None
+    with _LOCK:
+        _IN_PROGRESS[tool] = _IN_PROGRESS.get(tool, 0) + 1
+    _LOCAL.timings = timings
+    timings._push("other")
+    status = "error"
+    try:
+        yield timings
+        status = "ok"
+    finally:
+        while len(timings._stack) > 1:  # frames left open by an abandoned iterator
+            timings._pop()
+        start = timings._stack[0][1]
+        timings._pop()
+        timings.total = time.perf_counter() - start
+        _LOCAL.timings = None
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{tool}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof")
+            profiler.dump_stats(path)
+            timings.profile = path
+        _record(timings, status)
+
+
+def _record(timings: Timings, status: str) -> None:
+    tool = timings.tool
+    with _LOCK:
+        _IN_PROGRESS[tool] -= 1
+        _REQUESTS[(tool, status)] = _REQUESTS.get((tool, status), 0) + 1
+        hist = _DURATIONS.setdefault(tool, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if timings.total <= bound:
+                hist[i] += 1
+        hist[-2] += timings.total
+        hist[-1] += 1
+        for stage, seconds in timings.stages.items():
+            _STAGE_SECONDS[(tool, stage)] = _STAGE_SECONDS.get((tool, stage), 0.0) + seconds
+
+
+def traced(fn: Callable) -> Callable:
+    """Decorator running every call of *fn* as a request named after it."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with request(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# ---------------------------------------------------------------------------
+# Prometheus text exposition
+# ---------------------------------------------------------------------------
+
+def register_stats(prefix: str, stats: Callable[[], dict]) -> None:
+    """Export the numeric values of ``stats()`` as gauges ``psr_<prefix>_<key>``
+    (nested dicts are flattened with ``_``)."""
+    with _LOCK:
+        _STATS.append((prefix, stats))
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def _flatten(prefix: str, values: dict) -> Iterator[Tuple[str, float]]:
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (bool, int, float)):
+            yield name, float(value)
+
+
+def _process_lines() -> List[str]:
+    lines = [
+        "# HELP process_cpu_seconds_total Total user and system CPU time spent in seconds.",
+        "# TYPE process_cpu_seconds_total counter",
+        f"process_cpu_seconds_total {time.process_time():.6f}",
+    ]
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return lines
+    return lines + [
+        "# HELP process_resident_memory_bytes Resident memory size in bytes.",
+        "# TYPE process_resident_memory_bytes gauge",
+        f"process_resident_memory_bytes {rss}",
+    ]
+
+
+def metrics_text() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    with _LOCK:
+        requests = sorted(_REQUESTS.items())
+        in_progress = sorted(_IN_PROGRESS.items())
+        durations = {tool: list(hist) for tool, hist in sorted(_DURATIONS.items())}
+        stages = sorted(_STAGE_SECONDS.items())
+        sources = list(_STATS)
+
+    lines = [
+        "# HELP psr_requests_total Finished backend tool calls.",
+        "# TYPE psr_requests_total counter",
+    ]
+    lines += [f"psr_requests_total{_labels(tool=t, status=s)} {n}" for (t, s), n in requests]
+    lines += [
+        "# HELP psr_requests_in_progress Backend tool calls currently running.",
+        "# TYPE psr_requests_in_progress gauge",
+    ]
+    lines += [f"psr_requests_in_progress{_labels(tool=t)} {n}" for t, n in in_progress]
+    lines += [
+        "# HELP psr_request_duration_seconds Wall time of backend tool calls.",
+        "# TYPE psr_request_duration_seconds histogram",
+    ]
+    for tool, hist in durations.items():
+        for bound, n in zip(DURATION_BUCKETS, hist):
+            lines.append(f"psr_request_duration_seconds_bucket{_labels(tool=tool, le=bound)} {n}")
+        lines.append(f"psr_request_duration_seconds_bucket{_labels(tool=tool, le='+Inf')} {hist[-1]}")
+        lines.append(f"psr_request_duration_seconds_sum{_labels(tool=tool)} {hist[-2]:.6f}")
+        lines.append(f"psr_request_duration_seconds_count{_labels(tool=tool)} {hist[-1]}")
+    lines += [
+        "# HELP psr_stage_seconds_total Time spent in each stage of backend tool calls (exclusive).",
+        "# TYPE psr_stage_seconds_total counter",
+    ]
+    lines += [f"psr_stage_seconds_total{_labels(tool=t, stage=s)} {v:.6f}" for (t, s), v in stages]
+    for prefix, stats in sources:
+        try:
+            values = stats()
+        except Exception:
+            continue
+        for name, value in _flatten(f"psr_{prefix}", values):
+            lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+    lines += _process_lines()
+    return "\n".join(lines) + "\n"
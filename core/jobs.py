@@ -0,0 +1,292 @@
+"""
+Asynchronous job queue for long-running registrations.
+
+A synchronous tool call holds its HTTP request (and a Gradio worker) open for
+the whole registration, which can hit proxy timeouts on long BILINEAR runs and
+reports no progress. Jobs decouple the two:
+
+- submit_job() checks the request and queues it on a bounded pool of job
+  workers, returning at once with the job's status (including its id).
+  Each admission lane (see core/admission.py) has a pool of its own, and a
+  job stays queued until the admission controller lets it start;
+- job_status() reports the state, frames done / total and an ETA (for
+  align_batch, the "frames" are whole stacks), and once the job has
+  finished, where its time went (see core/instrument.py);
+- job_result() returns the output path once the job has succeeded;
+- cancel_job() drops a queued job or stops a running one at its next chunk.
+
+Finished jobs are forgotten after TTL_SECONDS. Until then each job holds a
+lease on its output file (for align_batch, on the manifest and every output
+it lists), so the artifact store cannot evict them.
+"""
+
+import inspect
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from core.admission import ADMISSION, LANES, ServerBusy, Ticket, estimate
+from core.artifacts import ARTIFACTS
+from core.instrument import Timings, register_stats, request
+from core.registration import (
+    _batch_outputs,
+    align_batch,
+    align_frame_to_frame,
+    align_stack_to_reference,
+    align_stack_to_stack,
+    apply_transforms,
+    estimate_transforms,
+)
+from core.utils import TTL_SECONDS
+
+JOB_TOOLS: Dict[str, Callable[..., str]] = {
+    "align_stack_to_reference": align_stack_to_reference,
+    "align_stack_to_stack": align_stack_to_stack,
+    "align_frame_to_frame": align_frame_to_frame,
+    "estimate_transforms": estimate_transforms,
+    "apply_transforms": apply_transforms,
+    "align_batch": align_batch,
+}
+
+# Jobs running at the same time, per admission lane; each may still use a
+# thread/process executor.
+MAX_RUNNING_JOBS = int(os.environ.get("PSR_MAX_JOBS", 2))
+# Jobs waiting for a worker; further submissions are refused until some start.
+MAX_QUEUED_JOBS = int(os.environ.get("PSR_MAX_QUEUED_JOBS", 64))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED_STATES = {SUCCEEDED, FAILED, CANCELLED}
+
+
+class JobCancelled(Exception):
+    """Raised from a job's progress callback once the job has been cancelled."""
+
+
+class Job:
+    """Book-keeping for a single submitted tool call."""
+
+    def __init__(self, tool: str, arguments: dict, ticket: Ticket):
+        self.id = uuid.uuid4().hex
+        self.tool = tool
+        self.arguments = arguments
+        self.ticket = ticket
+        self.state = QUEUED
+        self.frames_done = 0
+        self.frames_total = 0
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.timings: Optional[Timings] = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.future: Optional[Future] = None
+
+    def progress_callback(self, current_iteration: int, end_iteration: int) -> None:
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled.")
+        self.frames_done = current_iteration
+        self.frames_total = end_iteration
+
+    def status(self) -> dict:
+        now = self.finished_at or time.time()
+        elapsed = now - self.started_at if self.started_at is not None else 0.0
+        progress = eta = None
+        if self.state == SUCCEEDED:
+            progress, eta = 1.0, 0.0
+        elif self.frames_total:
+            progress = self.frames_done / self.frames_total
+            if self.state == RUNNING and self.frames_done:
+                eta = elapsed / self.frames_done * (self.frames_total - self.frames_done)
+        return {
+            "job_id": self.id,
+            "tool": self.tool,
+            "lane": self.ticket.lane,
+            "state": self.state,
+            "frames_done": self.frames_done,
+            "frames_total": self.frames_total,
+            "progress": progress,
+            "elapsed_seconds": round(elapsed, 3),
+            "eta_seconds": round(eta, 3) if eta is not None else None,
+            "error": str(self.error) if self.error is not None else None,
+            "timings": self.timings.as_dict() if self.timings is not None and self.state in FINISHED_STATES else None,
+        }
+
+
+class JobManager:
+    """Bounded pools of job workers (one per lane) plus the table of known jobs."""
+
+    def __init__(self, max_running: int = MAX_RUNNING_JOBS, max_queued: int = MAX_QUEUED_JOBS):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self._pools = {
+            lane: ThreadPoolExecutor(max_workers=max_running, thread_name_prefix=f"psr-job-{lane}")
+            for lane in LANES
+        }
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+
+    def submit(self, tool: str, arguments: Optional[dict] = None) -> Job:
+        """Queue a call of *tool* with keyword *arguments*; return the new Job.
+
+        Raises ValueError for an unknown tool or arguments it does not accept,
+        and ServerBusy (a RuntimeError) if the queue is full.
+        """
+        fn = JOB_TOOLS.get(tool)
+        if fn is None:
+            raise ValueError(
+                f"Invalid tool '{tool}'. Must be one of: {', '.join(sorted(JOB_TOOLS))}."
+            )
+        arguments = dict(arguments or {})
+        if "progress_callback" in arguments:
+            raise ValueError("progress_callback cannot be passed to a job.")
+        try:
+            inspect.signature(fn).bind(**arguments)
+        except TypeError as exc:
+            raise ValueError(f"Invalid arguments for {tool}: {exc}") from exc
+
+        job = Job(tool, arguments, estimate(tool, arguments))
+        with self._lock:
+            self._prune_locked()
+            queued = sum(1 for j in self._jobs.values() if j.state == QUEUED)
+            if queued >= self.max_queued:
+                retry_after = ADMISSION.retry_after(job.ticket.lane)
+                raise ServerBusy(
+                    f"Too many queued jobs ({queued}); retry in about {retry_after} s.", retry_after
+                )
+            self._jobs[job.id] = job
+            job.future = self._pools[job.ticket.lane].submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., str]) -> None:
+        if not ADMISSION.acquire(job.ticket, cancel=job.cancel_event):
+            with self._lock:
+                job.state = CANCELLED
+                job.finished_at = time.time()
+            job.done_event.set()
+            return
+        try:
+            self._run_admitted(job, fn)
+        finally:
+            ADMISSION.release(job.ticket)
+
+    def _run_admitted(self, job: Job, fn: Callable[..., str]) -> None:
+        with self._lock:
+            if job.state != QUEUED:
+                return
+            job.state = RUNNING
+            job.started_at = time.time()
+        kwargs = dict(job.arguments)
+        if "progress_callback" in inspect.signature(fn).parameters:
+            kwargs["progress_callback"] = job.progress_callback
+        try:
+            with request(job.tool) as timings:
+                job.timings = timings
+                result = fn(**kwargs)
+        except JobCancelled:
+            state, result = CANCELLED, None
+        except Exception as exc:
+            state, result = FAILED, None
+            job.error = exc
+        else:
+            state = SUCCEEDED
+            self._lease_outputs(job, result)
+        with self._lock:
+            job.state, job.result = state, result
+            job.finished_at = time.time()
+        job.done_event.set()
+
+    @staticmethod
+    def _lease_outputs(job: Job, result: str) -> None:
+        holder = f"job:{job.id}"
+        ARTIFACTS.lease(result, holder)
+        if job.tool == "align_batch":
+            # The manifest is only useful while the stacks it lists exist.
+            for path in _batch_outputs(result):
+                ARTIFACTS.lease(path, holder)
+
+    def get(self, job_id: str) -> Job:
+        """Return the job with *job_id*; raise ValueError if it is unknown or expired."""
+        with self._lock:
+            self._prune_locked()
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job id '{job_id}' (jobs expire {TTL_SECONDS // 60} min after finishing).")
+        return job
+
+    def status(self, job_id: str) -> dict:
+        return self.get(job_id).status()
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> dict:
+        """Wait up to *timeout* seconds for the job to finish; return its status."""
+        job = self.get(job_id)
+        job.done_event.wait(timeout)
+        return job.status()
+
+    def result(self, job_id: str) -> str:
+        """Return the output path of a succeeded job.
+
+        Re-raises the tool's own exception if the job failed; raises
+        RuntimeError if it was cancelled or has not finished yet.
+        """
+        job = self.get(job_id)
+        if job.state == SUCCEEDED:
+            return job.result
+        if job.state == FAILED:
+            raise job.error
+        if job.state == CANCELLED:
+            raise RuntimeError(f"Job {job_id} was cancelled.")
+        raise RuntimeError(f"Job {job_id} is still {job.state}; poll job_status until it has finished.")
+
+    def cancel(self, job_id: str) -> dict:
+        """Cancel a queued or running job (no-op once finished); return its status."""
+        job = self.get(job_id)
+        job.cancel_event.set()
+        with self._lock:
+            if job.state == QUEUED and job.future.cancel():
+                job.state = CANCELLED
+                job.finished_at = time.time()
+                job.done_event.set()
+        return job.status()
+
+    def stats(self) -> dict:
+        """Return the number of known jobs in each state."""
+        with self._lock:
+            counts = {state: 0 for state in (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+        return {**counts, "max_running_per_lane": self.max_running, "max_queued": self.max_queued}
+
+    def _prune_locked(self) -> None:
+        cutoff = time.time() - TTL_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+            ARTIFACTS.release(f"job:{job_id}")
+
+
+JOBS = JobManager()
+register_stats("jobs", JOBS.stats)
+
+
+def submit_job(tool: str, arguments: Optional[dict] = None) -> dict:
+    """Queue *tool* with keyword *arguments*; return the job's status (incl. ``job_id``)."""
+    return JOBS.submit(tool, arguments).status()
+
+
+def job_status(job_id: str) -> dict:
+    """Return state, frames done / total, progress fraction and ETA of a job."""
+    return JOBS.status(job_id)
+
+
+def job_result(job_id: str) -> str:
+    """Return the output path of a finished job (see JobManager.result)."""
+    return JOBS.result(job_id)
+
+
+def cancel_job(job_id: str) -> dict:
+    """Cancel a queued or running job; return its status."""
+    return JOBS.cancel(job_id)
@@ -0,0 +1,117 @@
+"""
+Encoding settings for the output TIFFs.
+
+By default outputs are written uncompressed as one contiguous series, which
+keeps them memory-mappable but makes WORK_DIR, and every download by an MCP
+client, as large as the raw pixels. A TiffOutput bundles the encoding choices
+of a tool call:
+
+- ``compression``: "none", "zlib", "zstd" or "lzw". Compressed outputs always
+  use the TIFF predictor (horizontal differencing, or floating-point for
+  float data), which is what makes smooth microscopy images shrink.
+- ``tile_size``: write square tiles of this size instead of strips, for
+  viewers that read regions of very large frames.
+- ``output_format``: "tiff" (classic TIFF, switched to BigTIFF when the
+  output would pass its 4 GB limit), "bigtiff", or "ome" (OME-TIFF, likewise
+  BigTIFF past 4 GB).
+
+The compressed segments (strips or tiles) of every page handed to one
+``write()`` call are encoded in parallel by tifffile's thread pool
+(``maxworkers``); the codecs release the GIL while they run.
+"""
+
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import tifffile
+
+from core.executor import resolve_workers
+from core.instrument import span
+
+VALID_COMPRESSIONS = {"none", "zlib", "zstd", "lzw"}
+
+VALID_OUTPUT_FORMATS = {"tiff", "bigtiff", "ome"}
+
+# Classic TIFF offsets are 32-bit; leave room for the IFDs and metadata.
+_CLASSIC_TIFF_LIMIT = 2**32 - 2**25
+
+
+def validate_output(compression: str = "none", tile_size: Optional[int] = None, output_format: str = "tiff") -> None:
+    """Raise ValueError if the output encoding settings are not usable."""
+    if compression not in VALID_COMPRESSIONS:
+        raise ValueError(
+            f"Invalid compression '{compression}'. "
+            f"Must be one of: {', '.join(sorted(VALID_COMPRESSIONS))}."
+        )
+    if tile_size is not None and (
+        isinstance(tile_size, bool) or not isinstance(tile_size, (int, np.integer))
+        or tile_size < 16 or tile_size % 16
+    ):
+        raise ValueError(f"tile_size must be a positive multiple of 16 or None (got {tile_size!r}).")
+    if output_format not in VALID_OUTPUT_FORMATS:
+        raise ValueError(
+            f"Invalid output_format '{output_format}'. "
+            f"Must be one of: {', '.join(sorted(VALID_OUTPUT_FORMATS))}."
+        )
+
+
+class TiffOutput:
+    """Compression, tiling and container format of an output TIFF."""
+
+    def __init__(self, compression: str = "none", tile_size: Optional[int] = None, output_format: str = "tiff"):
+        validate_output(compression, tile_size, output_format)
+        self.compression = compression
+        self.tile_size = None if tile_size is None else int(tile_size)
+        self.output_format = output_format
+
+    @property
+    def contiguous(self) -> bool:
+        """Whether frames can be appended one by one to a single uncompressed series."""
+        return self.compression == "none" and self.tile_size is None and self.output_format != "ome"
+
+    def params(self) -> dict:
+        """The settings that differ from the defaults (for result cache keys)."""
+        params = {}
+        if self.compression != "none":
+            params["compression"] = self.compression
+        if self.tile_size is not None:
+            params["tile_size"] = self.tile_size
+        if self.output_format != "tiff":
+            params["output_format"] = self.output_format
+        return params
+
+    def writer(self, path: str, nbytes: int = 0, imagej: bool = False) -> tifffile.TiffWriter:
+        """Open a TiffWriter for an output of about *nbytes* pixel bytes.
+
+        *imagej* asks for an ImageJ hyperstack, which is honoured only for
+        classic TIFF output (ImageJ reads neither BigTIFF nor OME metadata).
+        """
+        ome = self.output_format == "ome"
+        bigtiff = self.output_format == "bigtiff" or nbytes > _CLASSIC_TIFF_LIMIT
+        return tifffile.TiffWriter(path, bigtiff=bigtiff, ome=ome, imagej=imagej and not (ome or bigtiff))
+
+    def write_options(self) -> dict:
+        """Keyword arguments of ``TiffWriter.write()`` for one (multi-page) series."""
+        options = {}
+        if self.compression != "none":
+            options.update(compression=self.compression, predictor=True, maxworkers=resolve_workers())
+        if self.tile_size is not None:
+            options["tile"] = (self.tile_size, self.tile_size)
+        return options
+
+    def segments(self, frames: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Split an iterator of frames into what ``write()`` expects from one:
+        the frames themselves, or their tiles in row-major order when tiled."""
+        if self.tile_size is None:
+            yield from frames
+            return
+        t = self.tile_size
+        for frame in frames:
+            for y in range(0, frame.shape[0], t):
+                for x in range(0, frame.shape[1], t):
+                    yield frame[y:y + t, x:x + t]
+
+    def save(self, path: str, data: np.ndarray, **kwargs) -> None:
+        """Write the whole array *data* to *path* as a single series."""
+        with span("write"), self.writer(path, data.nbytes) as tw:
+            tw.write(data, **self.write_options(), **kwargs)
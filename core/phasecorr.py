@@ -0,0 +1,78 @@
+"""
+FFT phase correlation for translation estimates.
+
+TurboReg refines a transformation by local optimisation starting from the
+identity, so a drift of more than a few pixels converges slowly or lands in
+the wrong minimum. Phase correlation finds the translation between two
+frames directly, whatever its size, from the peak of the normalised
+cross-power spectrum — and does so for a whole chunk of frames in a single
+batched FFT. The registration backend uses it either as a coarse stage in
+front of TurboReg or, for pure translation, as the whole registration.
+
+Shifts follow pystackreg's convention: ``(tx, ty)`` is the offset of the
+moving frame relative to the reference, i.e. the translation column of the
+matrix that register() would return.
+"""
+
+import numpy as np
+
+_EPS = 1e-12
+
+
+def _window(shape) -> np.ndarray:
+    """2-D Hann window, which keeps the frame borders from dominating the spectrum."""
+    return np.outer(np.hanning(shape[0]), np.hanning(shape[1])).astype(np.float32)
+
+
+def _spectrum(frames: np.ndarray, window: np.ndarray) -> np.ndarray:
+    frames = np.asarray(frames, dtype=np.float32)
+    frames = frames - frames.mean(axis=(-2, -1), keepdims=True)
+    return np.fft.rfft2(frames * window, axes=(-2, -1))
+
+
+def _peak_offset(before: np.ndarray, peak: np.ndarray, after: np.ndarray) -> np.ndarray:
+    """Sub-sample position of a peak from a parabola through three samples."""
+    denom = before - 2.0 * peak + after
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(denom < 0, 0.5 * (before - after) / denom, 0.0)
+    return np.clip(offset, -0.5, 0.5)
+
+
+def phase_correlate(ref_frame: np.ndarray, frames: np.ndarray) -> np.ndarray:
+    """Estimate the translation of every frame in *frames* relative to *ref_frame*.
+
+    Args:
+        ref_frame: 2-D reference frame, or (N, H, W) references, one per frame.
+        frames: (N, H, W) frames of the same size as *ref_frame*.
+
+    Returns:
+        (N, 2) float64 array of ``(tx, ty)`` shifts in pixels, with sub-pixel
+        precision. Shifts are defined modulo the frame size, so they are
+        reported in ``[-W/2, W/2)`` x ``[-H/2, H/2)``.
+    """
+    frames = np.asarray(frames)
+    h, w = ref_frame.shape[-2:]
+    window = _window((h, w))
+    cross = _spectrum(frames, window) * np.conj(_spectrum(ref_frame, window))
+    cross /= np.abs(cross) + _EPS
+    corr = np.fft.irfft2(cross, s=(h, w), axes=(-2, -1))
+
+    n = len(corr)
+    flat = corr.reshape(n, -1).argmax(axis=1)
+    iy, ix = np.divmod(flat, w)
+    rows = np.arange(n)
+    peak = corr[rows, iy, ix]
+    dy = _peak_offset(corr[rows, (iy - 1) % h, ix], peak, corr[rows, (iy + 1) % h, ix])
+    dx = _peak_offset(corr[rows, iy, (ix - 1) % w], peak, corr[rows, iy, (ix + 1) % w])
+
+    # Wrap peak positions past the middle of the frame to negative shifts.
+    ty = (iy + h // 2) % h - h // 2 + dy
+    tx = (ix + w // 2) % w - w // 2 + dx
+    return np.stack([tx, ty], axis=1).astype(np.float64)
+
+
+def translation_matrices(shifts: np.ndarray) -> np.ndarray:
+    """Return the (N, 3, 3) pystackreg matrices for the ``(tx, ty)`` *shifts*."""
+    tmats = np.repeat(np.eye(3)[np.newaxis], len(shifts), axis=0)
+    tmats[:, :2, 2] = shifts
+    return tmats
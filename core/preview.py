@@ -0,0 +1,257 @@
+"""
+Frame previews for the web UI.
+
+The browse sliders show one frame of a stack at a time. Rather than writing a
+normalised copy of every input stack to WORK_DIR just so the sliders can read
+it back, previews are served straight from the staged input file:
+
+- a PreviewSource keeps the stack open (one TiffFile handle, memory-mapped
+  where possible) and stretches each frame to uint8 only when it is shown,
+  computing that frame's 1-99% percentiles once;
+- the PreviewRegistry holds the open sources of every browser session, keyed
+  by file, and closes them when the session ends or its tab is reset. Until
+  then the session also holds a lease on each file, so the artifact store
+  never evicts a file that is still on screen.
+
+Frames look exactly as they did with the normalised copy (same per-frame
+stretch as load_stack()).
+
+Scrubbing a slider asks for many frames in quick succession, so the registry
+also keeps the rendered images of each session in an LRU cache keyed by
+(file, frame, scale), and after every request renders the next few frames in
+the direction the slider is moving on a background thread. A newer request
+from the same slider abandons the prefetch of an older one, so fast scrubbing
+never builds up a backlog. Frames larger than MAX_PREVIEW_SIDE are
+box-downsampled before rendering, and the upscale of the aligned previews is
+reduced so that no rendered image grows much larger than a screen.
+"""
+
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from core.artifacts import ARTIFACTS
+from core.utils import frame_percentiles, open_stack, stretch_rows, upscale
+
+# Open sources kept per session; the least recently used one is closed first.
+MAX_SOURCES_PER_SESSION = 8
+# Byte budget of the rendered preview images cached per session.
+PREVIEW_CACHE_BYTES = int(os.environ.get("PSR_PREVIEW_CACHE_BYTES", 128 * 1024 ** 2))
+# Frames rendered ahead of the slider; set PSR_PREVIEW_PREFETCH=0 to disable.
+PREFETCH_FRAMES = int(os.environ.get("PSR_PREVIEW_PREFETCH", 4))
+# Longest side of a frame before upscaling; larger frames are downsampled.
+MAX_PREVIEW_SIDE = 1024
+# Longest side an upscaled preview may grow to.
+MAX_SCALED_SIDE = 1536
+UPSCALE_FACTOR = 3
+
+
+class PreviewSource:
+    """One stack file, opened once and read frame by frame for previews.
+
+    With *normalize* True every frame is stretched to uint8 between its own
+    1st and 99th percentiles (computed on first use and remembered); with
+    False, uint8 frames (e.g. of the aligned outputs) are shown as stored and
+    only other dtypes are stretched.
+    """
+
+    def __init__(self, path: str, normalize: bool = True):
+        self.path = path
+        self._stack = open_stack(path, normalize=False)
+        self.normalize = normalize
+        self._bounds: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._stack)
+
+    def frame(self, idx: int) -> np.ndarray:
+        """Return frame *idx* as a 2-D uint8 array."""
+        raw = self._stack[int(idx)]
+        if not self.normalize and raw.dtype == np.uint8:
+            return np.asarray(raw)
+        with self._lock:
+            bounds = self._bounds.get(idx)
+        if bounds is None:
+            bounds = frame_percentiles(raw)
+            with self._lock:
+                self._bounds[idx] = bounds
+        buf = np.array(raw, dtype=np.float32).reshape(1, -1)
+        stretch_rows(buf, bounds[:1], bounds[1:])
+        return buf.reshape(raw.shape).astype(np.uint8)
+
+    def image(self, idx: int, scale: bool = False) -> Image.Image:
+        """Render frame *idx* for display, upscaled (by up to 3x) if *scale*."""
+        img = Image.fromarray(self.frame(idx))
+        step = math.ceil(max(img.size) / MAX_PREVIEW_SIDE)
+        if step > 1:
+            img = img.reduce(step)
+        if scale:
+            factor = max(1, min(UPSCALE_FACTOR, MAX_SCALED_SIDE // max(img.size)))
+            if factor > 1:
+                img = upscale(img, factor)
+        return img
+
+    def close(self) -> None:
+        self._stack.close()
+
+
+class _Session:
+    """The open sources and cached preview images of one browser session."""
+
+    def __init__(self):
+        self.sources: "OrderedDict[Tuple[str, bool], PreviewSource]" = OrderedDict()
+        self.images: "OrderedDict[Tuple[str, bool, int, bool], Image.Image]" = OrderedDict()
+        self.nbytes = 0
+        # Per slider (file, normalize, scale): the last frame requested, and a
+        # counter bumped by every request that stale prefetches check.
+        self.last: Dict[Tuple[str, bool, bool], int] = {}
+        self.generation: Dict[Tuple[str, bool, bool], int] = {}
+        self.closed = False
+
+
+def _holder(session: Optional[str]) -> str:
+    return f"session:{session}"
+
+
+def _image_nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+class PreviewRegistry:
+    """Open PreviewSources and rendered preview images, per browser session."""
+
+    def __init__(
+        self,
+        max_per_session: int = MAX_SOURCES_PER_SESSION,
+        cache_bytes: int = PREVIEW_CACHE_BYTES,
+        prefetch: int = PREFETCH_FRAMES,
+    ):
+        self.max_per_session = max_per_session
+        self.cache_bytes = cache_bytes
+        self.prefetch = prefetch
+        self._lock = threading.Lock()
+        self._sessions: Dict[Optional[str], _Session] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _state(self, session: Optional[str]) -> _Session:
+        with self._lock:
+            return self._sessions.setdefault(session, _Session())
+
+    def get(self, session: Optional[str], path: str, normalize: bool = True) -> PreviewSource:
+        """Return the source of *path* for *session*, opening it on first use."""
+        return self._source(self._state(session), path, normalize, session)
+
+    def keep(self, session: Optional[str], path: str) -> None:
+        """Keep *path* in WORK_DIR until *session* is closed, without opening it."""
+        ARTIFACTS.lease(path, _holder(session))
+
+    def _source(self, state: _Session, path: str, normalize: bool, session: Optional[str]) -> PreviewSource:
+        key = (path, normalize)
+        with self._lock:
+            source = state.sources.get(key)
+            if source is not None:
+                state.sources.move_to_end(key)
+                return source
+        ARTIFACTS.lease(path, _holder(session))
+        source = PreviewSource(path, normalize)
+        evicted = []
+        with self._lock:
+            closed = state.closed
+            if closed or key in state.sources:  # session ended, or opened concurrently
+                evicted.append(source)
+                source = state.sources.get(key)
+            else:
+                state.sources[key] = source
+            while len(state.sources) > self.max_per_session:
+                evicted.append(state.sources.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        if closed:
+            raise RuntimeError(f"The preview session of {path} has been closed.")
+        return source
+
+    def image(
+        self, session: Optional[str], path: str, idx: int, scale: bool = False, normalize: bool = True,
+    ) -> Image.Image:
+        """Return the rendered preview of frame *idx* of *path* (see
+        PreviewSource.image()), from the cache when possible, and start
+        prefetching the frames that follow it in the slider's direction."""
+        idx = int(idx)
+        slider = (path, normalize, scale)
+        with self._lock:
+            state = self._sessions.setdefault(session, _Session())
+            direction = -1 if idx < state.last.get(slider, idx) else 1
+            state.last[slider] = idx
+            generation = state.generation[slider] = state.generation.get(slider, 0) + 1
+        img = self._image(state, session, path, idx, scale, normalize)
+        if self.prefetch > 0:
+            self._prefetch_pool().submit(self._prefetch, state, session, slider, generation, idx, direction)
+        return img
+
+    def _image(
+        self, state: _Session, session: Optional[str], path: str, idx: int, scale: bool, normalize: bool,
+    ) -> Image.Image:
+        key = (path, normalize, idx, scale)
+        with self._lock:
+            img = state.images.get(key)
+            if img is not None:
+                state.images.move_to_end(key)
+                return img
+        img = self._source(state, path, normalize, session).image(idx, scale)
+        nbytes = _image_nbytes(img)
+        with self._lock:
+            if state.closed or nbytes > self.cache_bytes or key in state.images:
+                return img
+            state.images[key] = img
+            state.nbytes += nbytes
+            while state.nbytes > self.cache_bytes:
+                state.nbytes -= _image_nbytes(state.images.popitem(last=False)[1])
+        return img
+
+    def _prefetch_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="psr-preview")
+            return self._pool
+
+    def _prefetch(
+        self, state: _Session, session: Optional[str], slider: tuple, generation: int, idx: int, direction: int,
+    ) -> None:
+        path, normalize, scale = slider
+        try:
+            n = len(self._source(state, path, normalize, session))
+            for nxt in range(idx + direction, idx + direction * (self.prefetch + 1), direction):
+                with self._lock:
+                    if state.closed or state.generation.get(slider) != generation:
+                        return
+                if not 0 <= nxt < n:
+                    return
+                self._image(state, session, path, nxt, scale, normalize)
+        except Exception:
+            pass  # best effort: the file may have been closed or removed meanwhile
+
+    def close_session(self, session: Optional[str]) -> None:
+        """Close every source opened for *session*, drop its cached images and
+        release its files."""
+        ARTIFACTS.release(_holder(session))
+        with self._lock:
+            state = self._sessions.pop(session, None)
+            if state is None:
+                return
+            state.closed = True
+            sources = list(state.sources.values())
+            state.sources.clear()
+            state.images.clear()
+            state.nbytes = 0
+        for source in sources:
+            source.close()
+
+
+PREVIEWS = PreviewRegistry()
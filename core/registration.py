@@ -4,24 +4,53 @@ Pure backend registration functions for pystackreg-app.
 These functions implement the three image-registration workflows as
 file-based, MCP-friendly operations. They take TIFF file paths as inputs
 and return the path to the output TIFF file. No Gradio objects are returned.
+A two-phase variant (estimate_transforms / apply_transforms) stores the
+per-frame matrices in a ``.npz`` sidecar so they can be reused, and
+align_batch() registers many stacks in one call, returning a JSON manifest.
 
 Gradio MCP uses function names, type hints, and docstrings to build MCP
-tool schemas, so all three are kept clear and complete.
+tool schemas, so all of them are kept clear and complete.
 """
 
-import ipaddress
+import itertools
+import json
 import os
-import socket
-import tempfile
+import threading
+import time
 import urllib.parse
-import urllib.request
-from typing import Optional
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
-import tifffile
 from pystackreg import StackReg
 
-from core.utils import WORK_DIR, DEMO_DIR, get_sr_mode, load_stack, normalize_stack
+from core.artifacts import ARTIFACTS
+from core.cache import RESULT_CACHE, array_digest
+from core.downloads import (
+    _MAX_DOWNLOAD_BYTES,
+    _NPZ_MAGIC,
+    _TIFF_MAGIC,
+    _ZIP_MAGIC,
+    StreamingDownload,
+    _download_tiff_to_work_dir,
+    _download_to_work_dir,
+)
+from core.executor import DEFAULT_CHUNK_SIZE, iter_map, resolve_workers, validate_executor
+from core.instrument import span, traced
+from core.output import TiffOutput, validate_output
+from core.phasecorr import phase_correlate, translation_matrices
+from core.utils import (
+    WORK_DIR,
+    DEMO_DIR,
+    TiffPageStream,
+    TiffStreamError,
+    count_channels,
+    get_sr_mode,
+    normalize_stack,
+    open_stack,
+)
 
 # ---------------------------------------------------------------------------
 # Validation helpers
@@ -29,113 +58,31 @@ from core.utils import WORK_DIR, DEMO_DIR, get_sr_mode, load_stack, normalize_st
 
 VALID_MODES = {"TRANSLATION", "RIGID_BODY", "SCALED_ROTATION", "AFFINE", "BILINEAR"}
 
-# Maximum size allowed for HTTP downloads (prevents resource-exhaustion attacks).
-_MAX_DOWNLOAD_BYTES = 500 * 1024 * 1024  # 500 MB
-_DOWNLOAD_TIMEOUT = 30  # seconds
-
-# Valid TIFF magic byte sequences (little/big-endian classic and BigTIFF).
-_TIFF_MAGIC = (
-    b"II\x2A\x00",  # little-endian TIFF
-    b"MM\x00\x2A",  # big-endian TIFF
-    b"II\x2B\x00",  # little-endian BigTIFF
-    b"MM\x00\x2B",  # big-endian BigTIFF
-)
-
-
-def _block_private_url(url: str) -> None:
-    """Raise ValueError if *url* resolves to a private, loopback, link-local,
-    reserved, or multicast address (SSRF protection)."""
-    parsed = urllib.parse.urlparse(url)
-    host = parsed.hostname
-    if not host:
-        raise ValueError(f"Could not parse host from URL: {url!r}")
-    try:
-        infos = socket.getaddrinfo(host, None)
-    except socket.gaierror as exc:
-        raise ValueError(f"Could not resolve host '{host}': {exc}") from exc
-    for info in infos:
-        addr_str = info[4][0]
-        try:
-            addr = ipaddress.ip_address(addr_str)
-        except ValueError:
-            continue
-        if (
-            addr.is_private
-            or addr.is_loopback
-            or addr.is_link_local
-            or addr.is_reserved
-            or addr.is_multicast
-            or addr.is_unspecified
-        ):
-            raise ValueError(
-                f"Requests to private or internal addresses are not allowed "
-                f"('{host}' resolved to {addr})."
-            )
+# Sample type of written outputs: "uint8" (1-99% percentile stretch),
+# "float32" (raw transformed intensities) or "native" (input dtype).
+VALID_OUTPUT_DTYPES = {"uint8", "float32", "native"}
 
+# Optional FFT phase-correlation stage: "none" (TurboReg only), "phase"
+# (phase correlation, then TurboReg refines from there) or "phase_only"
+# (phase correlation alone; TRANSLATION mode only).
+VALID_PREALIGN = {"none", "phase", "phase_only"}
 
-class _SafeRedirectHandler(urllib.request.HTTPRedirectHandler):
-    def redirect_request(self, req, fp, code, msg, headers, newurl):
-        _block_private_url(newurl)
-        return super().redirect_request(req, fp, code, msg, headers, newurl)
+# Reference of each frame in align_stack_to_reference() / estimate_transforms():
+# "fixed" (the selected reference frame), "previous" (the preceding frame, with
+# the matrices composed along the stack), "mean" (the mean of all frames) or
+# "running_mean" (the mean of the previous window of aligned frames).
+VALID_REFERENCE_STRATEGIES = {"fixed", "previous", "mean", "running_mean"}
 
+# How align_stack_to_stack() pairs moving frames with references: "first" (the
+# first reference frame), "pairwise" (frame i with frame i) or "mean" (the mean
+# of the reference stack).
+VALID_PAIRINGS = {"first", "pairwise", "mean"}
 
-_SAFE_URL_OPENER = urllib.request.build_opener(_SafeRedirectHandler)
+# Smallest frame side (in pixels) left after binning by registration_scale.
+_MIN_BINNED_SIZE = 16
 
 
-def _download_tiff_to_work_dir(url: str, label: str) -> str:
-    """Download *url* to a temp file in WORK_DIR, validating TIFF magic and size.
-
-    Uses chunked streaming so that the full file is never held in memory.
-    Raises ValueError on SSRF, size-limit, or magic-byte failures.
-    Cleans up the temp file before raising on any error.
-    """
-    _block_private_url(url)
-
-    fd, local_path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-
-    total = 0
-    first4 = b""
-
-    try:
-        with _SAFE_URL_OPENER.open(url, timeout=_DOWNLOAD_TIMEOUT) as resp, open(local_path, "wb") as f:
-            _block_private_url(resp.geturl())
-            while True:
-                chunk = resp.read(1024 * 1024)
-                if not chunk:
-                    break
-
-                if len(first4) < 4:
-                    first4 = (first4 + chunk[: 4 - len(first4)])[:4]
-                    if len(first4) == 4 and not any(first4.startswith(magic) for magic in _TIFF_MAGIC):
-                        raise ValueError(f"{label} does not appear to be a valid TIFF file.")
-
-                total += len(chunk)
-                if total > _MAX_DOWNLOAD_BYTES:
-                    raise ValueError(
-                        f"{label} exceeds the maximum allowed download size of "
-                        f"{_MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB."
-                    )
-
-                f.write(chunk)
-
-        if total == 0:
-            raise ValueError(f"{label} is empty.")
-
-        if len(first4) < 4 or not any(first4.startswith(magic) for magic in _TIFF_MAGIC):
-            raise ValueError(f"{label} does not appear to be a valid TIFF file.")
-
-        return local_path
-
-    except Exception:
-        try:
-            os.unlink(local_path)
-        except FileNotFoundError:
-            pass
-        raise
-
-
-def _resolve_path(path_or_url: str, label: str = "file") -> str:
+def _resolve_path(path_or_url: str, label: str = "file", cancel: Optional[threading.Event] = None) -> str:
     """Return a local, sandbox-safe path for *path_or_url*.
 
     - If the value starts with ``http://`` or ``https://``, the file is
@@ -145,12 +92,72 @@ def _resolve_path(path_or_url: str, label: str = "file") -> str:
       the app sandbox enforced by _require_file(): WORK_DIR (for outputs from
       previous tool calls) or DEMO_DIR (for cached demo files).
     """
-    if path_or_url.startswith(("http://", "https://")):
-        return _download_tiff_to_work_dir(path_or_url, label)
+    if _is_url(path_or_url):
+        return _download_tiff_to_work_dir(path_or_url, label, cancel)
     _require_file(path_or_url, label)
     return path_or_url
 
 
+def _resolve_transforms_path(
+    path_or_url: str, label: str = "transforms_file", cancel: Optional[threading.Event] = None
+) -> str:
+    """Like _resolve_path(), but for ``.npz`` transformation sidecars."""
+    if _is_url(path_or_url):
+        return _download_to_work_dir(path_or_url, label, ".npz", _NPZ_MAGIC, "transforms (.npz)", cancel)
+    _require_file(path_or_url, label)
+    return path_or_url
+
+
+def _is_url(value: str) -> bool:
+    return value.startswith(("http://", "https://"))
+
+
+def _resolve_all(*requests: Tuple[Callable[..., str], Optional[str], str]) -> list:
+    """Resolve several ``(resolver, path_or_url, label)`` inputs at once.
+
+    Local paths are checked first; URLs are then downloaded concurrently, so
+    the latency is that of the slowest download rather than the sum. If any
+    input fails, the remaining downloads are cancelled, files already fetched
+    for this call are removed and the first error is raised. None values are
+    passed through unchanged.
+    """
+    results = [None] * len(requests)
+    remote = []
+    for i, (resolver, value, label) in enumerate(requests):
+        if value is None:
+            continue
+        if _is_url(value):
+            remote.append(i)
+        else:
+            results[i] = resolver(value, label)
+    if not remote:
+        return results
+    if len(remote) == 1:
+        resolver, value, label = requests[remote[0]]
+        results[remote[0]] = resolver(value, label)
+        return results
+
+    cancel = threading.Event()
+    error = None
+    with span("download"), ThreadPoolExecutor(max_workers=max(1, len(remote))) as pool:
+        futures = {pool.submit(requests[i][0], requests[i][1], requests[i][2], cancel): i for i in remote}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as exc:
+                if error is None:
+                    error = exc
+                    cancel.set()
+    if error is not None:
+        work_dir = os.path.realpath(WORK_DIR)
+        for i in remote:
+            path = results[i]
+            if path is not None and os.path.realpath(path).startswith(work_dir + os.sep):
+                ARTIFACTS.remove(path)
+        raise error
+    return results
+
+
 def _validate_mode(mode: str) -> None:
     """Raise ValueError if *mode* is not a supported transformation mode."""
     if mode not in VALID_MODES:
@@ -160,6 +167,77 @@ def _validate_mode(mode: str) -> None:
         )
 
 
+def _validate_output_dtype(output_dtype: str) -> None:
+    """Raise ValueError if *output_dtype* is not a supported output sample type."""
+    if output_dtype not in VALID_OUTPUT_DTYPES:
+        raise ValueError(
+            f"Invalid output_dtype '{output_dtype}'. "
+            f"Must be one of: {', '.join(sorted(VALID_OUTPUT_DTYPES))}."
+        )
+
+
+def _validate_prealign(prealign: str, mode: str) -> None:
+    """Raise ValueError if *prealign* is not supported, or not usable with *mode*."""
+    if prealign not in VALID_PREALIGN:
+        raise ValueError(
+            f"Invalid prealign '{prealign}'. "
+            f"Must be one of: {', '.join(sorted(VALID_PREALIGN))}."
+        )
+    if prealign == "phase" and mode == "BILINEAR":
+        raise ValueError("prealign 'phase' cannot be combined with mode BILINEAR.")
+    if prealign == "phase_only" and mode != "TRANSLATION":
+        raise ValueError(f"prealign 'phase_only' requires mode TRANSLATION (got {mode}).")
+
+
+def _validate_registration_scale(registration_scale: int) -> None:
+    """Raise ValueError if *registration_scale* is not a positive integer."""
+    if isinstance(registration_scale, bool) or not isinstance(registration_scale, (int, np.integer)) \
+            or registration_scale < 1:
+        raise ValueError(f"registration_scale must be a positive integer (got {registration_scale!r}).")
+
+
+def _validate_reference_strategy(
+    reference_strategy: str,
+    mode: str,
+    external_reference_file: Optional[str] = None,
+    running_mean_window: int = 10,
+) -> None:
+    """Raise ValueError if *reference_strategy* is not supported or conflicts with the other arguments."""
+    if reference_strategy not in VALID_REFERENCE_STRATEGIES:
+        raise ValueError(
+            f"Invalid reference_strategy '{reference_strategy}'. "
+            f"Must be one of: {', '.join(sorted(VALID_REFERENCE_STRATEGIES))}."
+        )
+    if reference_strategy == "previous" and mode == "BILINEAR":
+        raise ValueError(
+            "reference_strategy 'previous' cannot be combined with mode BILINEAR "
+            "(bilinear transformations do not compose)."
+        )
+    if reference_strategy in ("previous", "mean") and external_reference_file is not None:
+        raise ValueError(
+            f"external_reference_file cannot be combined with reference_strategy '{reference_strategy}'."
+        )
+    if running_mean_window < 1:
+        raise ValueError(f"running_mean_window must be at least 1 (got {running_mean_window}).")
+
+
+def _validate_pairing(pairing: str) -> None:
+    """Raise ValueError if *pairing* is not a supported stack-to-stack pairing."""
+    if pairing not in VALID_PAIRINGS:
+        raise ValueError(
+            f"Invalid pairing '{pairing}'. "
+            f"Must be one of: {', '.join(sorted(VALID_PAIRINGS))}."
+        )
+
+
+def _validate_channel(channel: Optional[int]) -> None:
+    """Raise ValueError if *channel* is neither None nor a non-negative integer."""
+    if channel is None:
+        return
+    if isinstance(channel, bool) or not isinstance(channel, (int, np.integer)) or channel < 0:
+        raise ValueError(f"channel must be a non-negative integer or None (got {channel!r}).")
+
+
 def _validate_index(idx: int, stack_len: int, name: str = "frame index") -> None:
     """Raise IndexError if *idx* is outside [0, stack_len)."""
     if not (0 <= idx < stack_len):
@@ -169,7 +247,7 @@ def _validate_index(idx: int, stack_len: int, name: str = "frame index") -> None
         )
 
 
-def _require_file(path: str, label: str = "file") -> None:
+def _check_file(path: str, label: str = "file") -> None:
     """Raise an error if *path* does not exist or is outside the app's sandbox.
 
     Allowed locations are WORK_DIR (outputs from previous tool calls, enabling
@@ -190,25 +268,952 @@ def _require_file(path: str, label: str = "file") -> None:
         raise FileNotFoundError(f"{label} not found: {path}")
 
 
+def _require_file(path: str, label: str = "file") -> None:
+    """Check *path* like _check_file() and mark it as used in ARTIFACTS."""
+    _check_file(path, label)
+    ARTIFACTS.touch(path)
+
+
 # ---------------------------------------------------------------------------
 # Private computation helpers (array-in / array-out, no file I/O)
 # ---------------------------------------------------------------------------
 
-def _run_align_to_reference(
-    stack: np.ndarray, ref_frame: np.ndarray, mode: str
+_WORKER_STATE = threading.local()
+
+
+def _get_stackreg(mode: str) -> StackReg:
+    """Return the StackReg instance owned by the current worker for *mode*.
+
+    Each thread (and therefore each worker process) keeps its own instances,
+    so no registration state is ever shared between concurrent workers.
+    """
+    instances = getattr(_WORKER_STATE, "instances", None)
+    if instances is None:
+        instances = _WORKER_STATE.instances = {}
+    sr = instances.get(mode)
+    if sr is None:
+        sr = instances[mode] = StackReg(get_sr_mode(mode))
+    return sr
+
+
+# Frames whose overlap with the reference after pre-alignment is narrower than
+# this (in pixels) keep the phase-correlation estimate without refinement.
+_MIN_PREALIGN_OVERLAP = 16
+
+
+def _translation(tx: float, ty: float) -> np.ndarray:
+    tmat = np.eye(3)
+    tmat[:2, 2] = tx, ty
+    return tmat
+
+
+def _refs_for(ref_frame: np.ndarray, frames: np.ndarray) -> Iterable[np.ndarray]:
+    """Pair each of *frames* with its reference: *ref_frame* itself, or its
+    matching entry when a (N, H, W) stack of per-frame references is given."""
+    return ref_frame if ref_frame.ndim == 3 else itertools.repeat(ref_frame, len(frames))
+
+
+def _prealigned_matrices(sr: StackReg, ref_frame: np.ndarray, frames: np.ndarray, prealign: str) -> np.ndarray:
+    """Return the matrices aligning *frames* to *ref_frame*, starting from phase correlation.
+
+    The translation of the whole chunk is estimated with one batched FFT. For
+    "phase", TurboReg then registers the region where each frame overlaps the
+    reference once shifted by the rounded estimate (a crop, so no empty
+    borders are introduced), and the result is mapped back to frame
+    coordinates. pystackreg has no way to seed its optimiser, so this is how
+    the estimate is passed on as the initialisation.
+    """
+    shifts = phase_correlate(ref_frame, frames)
+    tmats = translation_matrices(shifts)
+    if prealign == "phase_only":
+        return tmats
+    h, w = ref_frame.shape[-2:]
+    for i, (ref, (tx, ty)) in enumerate(zip(_refs_for(ref_frame, frames), np.rint(shifts).astype(int))):
+        x0, y0, x1, y1 = max(0, -tx), max(0, -ty), min(w, w - tx), min(h, h - ty)
+        if min(x1 - x0, y1 - y0) < _MIN_PREALIGN_OVERLAP:
+            continue
+        refined = sr.register(ref[y0:y1, x0:x1], frames[i, y0 + ty:y1 + ty, x0 + tx:x1 + tx])
+        tmats[i] = _translation(x0 + tx, y0 + ty) @ refined @ _translation(-x0, -y0)
+    return tmats
+
+
+def _bin_frames(frames: np.ndarray, factor: int) -> np.ndarray:
+    """Block-mean *frames* (one frame or a chunk) by *factor* along both image axes.
+
+    Trailing rows/columns that do not fill a whole block are dropped, so binned
+    pixel ``u`` covers full-resolution pixels ``factor*u`` to ``factor*u + factor - 1``.
+    """
+    h, w = frames.shape[-2] // factor, frames.shape[-1] // factor
+    if min(h, w) < _MIN_BINNED_SIZE:
+        raise ValueError(
+            f"registration_scale {factor} is too large for {frames.shape[-1]}x{frames.shape[-2]} "
+            f"frames (binned frames must be at least {_MIN_BINNED_SIZE} pixels wide and high)."
+        )
+    cropped = np.asarray(frames[..., :h * factor, :w * factor], dtype=np.float32)
+    blocks = cropped.reshape(cropped.shape[:-2] + (h, factor, w, factor))
+    return blocks.mean(axis=(-3, -1))
+
+
+def _upscale_matrices(tmats: np.ndarray, factor: int) -> np.ndarray:
+    """Convert matrices estimated on frames binned by *factor* to full resolution.
+
+    Binned coordinate ``u`` is the centre of full-resolution pixels
+    ``x = factor*u + c`` with ``c = (factor - 1) / 2``. For the 3x3 matrices the
+    linear part is unchanged and the translation becomes
+    ``factor*t + c - A @ (c, c)``; the xy term of BILINEAR matrices, whose
+    rows hold the coefficients of ``(x, y, xy, 1)``, is rescaled likewise.
+    """
+    c = (factor - 1) / 2
+    tmats = np.array(tmats, dtype=np.float64)
+    lin_x, lin_y, trans = tmats[:, :2, 0].copy(), tmats[:, :2, 1].copy(), tmats[:, :2, -1].copy()
+    trans = factor * trans + c - (lin_x + lin_y) * c
+    if tmats.shape[-1] == 4:
+        xy = tmats[:, :2, 2].copy()
+        tmats[:, :2, 0] = lin_x - xy * c / factor
+        tmats[:, :2, 1] = lin_y - xy * c / factor
+        tmats[:, :2, 2] = xy / factor
+        trans += xy * c * c / factor
+    tmats[:, :2, -1] = trans
+    return tmats
+
+
+def _chunk_matrices(
+    sr: StackReg,
+    ref_frame: np.ndarray,
+    frames: np.ndarray,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> np.ndarray:
+    """Return the full-resolution matrices aligning each of *frames* to *ref_frame*
+    (one frame, or one reference per frame)."""
+    if registration_scale > 1:
+        ref_frame, frames = _bin_frames(ref_frame, registration_scale), _bin_frames(frames, registration_scale)
+    if prealign == "none":
+        tmats = np.stack([sr.register(ref, fr) for ref, fr in zip(_refs_for(ref_frame, frames), frames)])
+    else:
+        tmats = _prealigned_matrices(sr, ref_frame, frames, prealign)
+    if registration_scale > 1:
+        tmats = _upscale_matrices(tmats, registration_scale)
+    return tmats
+
+
+def _register_chunk(
+    mode: str,
+    ref_frame: np.ndarray,
+    frames: np.ndarray,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> np.ndarray:
+    """Register and transform a chunk of frames against *ref_frame* (runs in a worker)."""
+    sr = _get_stackreg(mode)
+    if prealign == "none" and registration_scale == 1:
+        return np.stack([sr.register_transform(ref, fr) for ref, fr in zip(_refs_for(ref_frame, frames), frames)])
+    tmats = _chunk_matrices(sr, ref_frame, frames, prealign, registration_scale)
+    return np.stack([sr.transform(fr, tmat) for fr, tmat in zip(frames, tmats)])
+
+
+def _estimate_chunk(
+    mode: str,
+    ref_frame: np.ndarray,
+    frames: np.ndarray,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> np.ndarray:
+    """Compute the transformation matrix of each frame in a chunk (runs in a worker)."""
+    return _chunk_matrices(_get_stackreg(mode), ref_frame, frames, prealign, registration_scale)
+
+
+def _align_chunk(
+    mode: str,
+    ref_frame: np.ndarray,
+    frames: np.ndarray,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the matrices of a chunk of frames, the transformed frames and
+    their coverage (runs in a worker).
+
+    The coverage marks, per frame, the output pixels that the transformed
+    frame actually covers (a ones-mask transformed with the same matrix),
+    so that they can be told apart from pixels that are merely dark.
+    """
+    sr = _get_stackreg(mode)
+    tmats = _chunk_matrices(sr, ref_frame, frames, prealign, registration_scale)
+    ones = np.ones(frames.shape[1:])
+    aligned = np.stack([sr.transform(fr, tmat) for fr, tmat in zip(frames, tmats)])
+    covered = np.stack([sr.transform(ones, tmat) > 0.5 for tmat in tmats])
+    return tmats, aligned, covered
+
+
+def _transform_chunk(mode: str, frames: np.ndarray, tmats: np.ndarray) -> np.ndarray:
+    """Apply one stored transformation matrix per frame in a chunk (runs in a worker)."""
+    sr = _get_stackreg(mode)
+    return np.stack([sr.transform(fr, tmat) for fr, tmat in zip(frames, tmats)])
+
+
+def _transform_channels_chunk(mode: str, frames: np.ndarray, tmats: np.ndarray) -> np.ndarray:
+    """Apply one matrix per frame to every channel of a (N, C, Y, X) chunk (runs in a worker)."""
+    sr = _get_stackreg(mode)
+    return np.stack([[sr.transform(plane, tmat) for plane in fr] for fr, tmat in zip(frames, tmats)])
+
+
+def _iter_chunks(stack, chunk_size: int) -> Iterator[np.ndarray]:
+    """Yield consecutive chunks of at most *chunk_size* frames from *stack*.
+
+    A stack of unknown length (TiffPageStream) is consumed as an iterator.
+    """
+    if not hasattr(stack, "__len__"):
+        frames = iter(stack)
+        while True:
+            with span("read"):
+                chunk = list(itertools.islice(frames, chunk_size))
+                if chunk:
+                    chunk = np.stack(chunk)
+            if not len(chunk):
+                return
+            yield chunk
+    for start in range(0, len(stack), chunk_size):
+        with span("read"):
+            chunk = np.asarray(stack[start:start + chunk_size])
+        yield chunk
+
+
+def _iter_register_frames(
+    stack,
+    ref_frame: np.ndarray,
+    mode: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> Iterator[np.ndarray]:
+    """Yield aligned chunks of *stack*, registered against *ref_frame*, in input order."""
+    tasks = (
+        (mode, ref_frame, chunk, prealign, registration_scale)
+        for chunk in _iter_chunks(stack, chunk_size)
+    )
+    return iter_map(_register_chunk, tasks, executor, max_workers)
+
+
+def _estimate_frames(
+    stack,
+    ref_frame: np.ndarray,
+    mode: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress_callback: Optional[Callable[..., None]] = None,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> np.ndarray:
+    """Return the (N, 3, 3) — or (N, 4, 4) for BILINEAR — matrices aligning *stack* to *ref_frame*."""
+    tasks = (
+        (mode, ref_frame, chunk, prealign, registration_scale)
+        for chunk in _iter_chunks(stack, chunk_size)
+    )
+    tmats = iter_map(_estimate_chunk, tasks, executor, max_workers)
+    return np.concatenate(list(_with_progress(tmats, _stack_len(stack), progress_callback)))
+
+
+def _iter_apply_frames(
+    stack,
+    tmats: np.ndarray,
+    mode: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[np.ndarray]:
+    """Yield chunks of *stack* transformed with their matrices from *tmats*, in input order."""
+    tasks = (
+        (mode, chunk, tmats[start:start + len(chunk)])
+        for start, chunk in zip(range(0, len(stack), chunk_size), _iter_chunks(stack, chunk_size))
+    )
+    return iter_map(_transform_chunk, tasks, executor, max_workers)
+
+
+def _iter_apply_channels(
+    stack,
+    tmats: np.ndarray,
+    mode: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[np.ndarray]:
+    """Yield (N, C, Y, X) chunks holding every channel of *stack*, transformed
+    with the matrices from *tmats* (one per frame), in input order."""
+    n = stack.channel_frames
+    tasks = (
+        (
+            mode,
+            np.stack([stack.channel_planes(i) for i in range(start, min(start + chunk_size, n))]),
+            tmats[start:start + chunk_size],
+        )
+        for start in range(0, n, chunk_size)
+    )
+    return iter_map(_transform_channels_chunk, tasks, executor, max_workers)
+
+
+def _with_progress(
+    chunks: Iterable[np.ndarray],
+    total: int,
+    progress_callback: Optional[Callable[..., None]] = None,
+    start: int = 0,
+) -> Iterator[np.ndarray]:
+    """Pass *chunks* through, reporting the number of frames done after each one.
+
+    The callback is called pystackreg-style, as
+    ``progress_callback(current_iteration=done, end_iteration=total)``; *total*
+    is 0 when the stack length is not known yet, and counting begins at
+    *start* for work done in an earlier pass. An exception raised by the
+    callback (e.g. to cancel a job) stops the pipeline.
+    """
+    if progress_callback is None:
+        yield from chunks
+        return
+    done = start
+    progress_callback(current_iteration=done, end_iteration=total)
+    for chunk in chunks:
+        done += len(chunk)
+        progress_callback(current_iteration=done, end_iteration=total)
+        yield chunk
+
+
+def _stack_len(stack) -> int:
+    """Number of frames in *stack*, or 0 for a stream of unknown length."""
+    return len(stack) if hasattr(stack, "__len__") else 0
+
+
+# ---------------------------------------------------------------------------
+# Reference strategies
+# ---------------------------------------------------------------------------
+
+def _iter_previous_pairs(stack, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield ``(previous frames, frames)`` chunks covering every frame but the first."""
+    last = None
+    for chunk in _iter_chunks(stack, chunk_size):
+        if last is None:
+            refs, frames = chunk[:-1], chunk[1:]
+        else:
+            refs, frames = np.concatenate([last[np.newaxis], chunk[:-1]]), chunk
+        last = chunk[-1]
+        if len(frames):
+            yield refs, frames
+
+
+def _estimate_previous(
+    stack,
+    reference_index: int,
+    mode: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prealign: str = "none",
+    registration_scale: int = 1,
+    progress_callback: Optional[Callable[..., None]] = None,
+    progress_total: Optional[int] = None,
+) -> np.ndarray:
+    """Return the matrices aligning every frame of *stack* to frame *reference_index* through its neighbours.
+
+    Each frame is registered to the one before it. The pairs do not depend on
+    each other, so they are spread across the executor like any other chunks;
+    the matrices are then composed along the stack, as pystackreg's
+    ``register_stack(reference="previous")`` does, and re-anchored on frame
+    *reference_index*.
+    """
+    total = len(stack)
+    tasks = (
+        (mode, refs, frames, prealign, registration_scale)
+        for refs, frames in _iter_previous_pairs(stack, chunk_size)
+    )
+    pair_tmats = _with_progress(
+        iter_map(_estimate_chunk, tasks, executor, max_workers),
+        progress_total or total, progress_callback, start=1,
+    )
+    tmats = [np.eye(3)]
+    for chunk in pair_tmats:
+        for pair in chunk:
+            tmats.append(pair @ tmats[-1])
+    tmats = np.stack(tmats)
+    return tmats @ np.linalg.inv(tmats[reference_index])
+
+
+def _iter_previous_frames(
+    stack,
+    reference_index: int,
+    mode: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prealign: str = "none",
+    registration_scale: int = 1,
+    progress_callback: Optional[Callable[..., None]] = None,
+) -> Iterator[np.ndarray]:
+    """Yield chunks of *stack* aligned with _estimate_previous() matrices, in input order.
+
+    The stack is read twice (estimate, then transform), so progress runs up
+    to twice its length.
+    """
+    total = len(stack)
+    tmats = _estimate_previous(
+        stack, reference_index, mode, executor, max_workers, chunk_size,
+        prealign, registration_scale, progress_callback, 2 * total,
+    )
+    yield from _with_progress(
+        _iter_apply_frames(stack, tmats, mode, executor, max_workers, chunk_size),
+        2 * total, progress_callback, start=total,
+    )
+
+
+def _mean_frame(stack, chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """Return the mean of all frames of *stack*, accumulated chunk by chunk."""
+    total, n = 0.0, 0
+    for chunk in _iter_chunks(stack, chunk_size):
+        total = total + chunk.sum(axis=0, dtype=np.float64)
+        n += len(chunk)
+    return total / n
+
+
+def _iter_running_mean(
+    stack,
+    ref_frame: np.ndarray,
+    mode: str,
+    window: int,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield ``(matrices, aligned frames)`` chunks of *stack*, in input order.
+
+    The stack is processed in blocks of *window* frames. The first block is
+    registered against *ref_frame*, every later one against the mean of the
+    previous block's aligned frames, so the template follows the sample as it
+    changes while the matrices stay relative to *ref_frame*. The mean is
+    accumulated chunk by chunk over the pixels each transformed frame covers,
+    so the empty borders left by the transformation are ignored while
+    genuinely dark pixels count; pixels no frame covers keep the previous
+    template.
+    Frames of a block are independent and are spread across the executor,
+    in chunks small enough to keep every worker busy.
+    """
+    workers = 1 if executor == "serial" else resolve_workers(max_workers)
+    template = ref_frame
+    for block in _iter_chunks(stack, window):
+        total = np.zeros(block.shape[1:])
+        count = np.zeros(block.shape[1:])
+        size = max(1, min(chunk_size, -(-len(block) // workers)))
+        tasks = (
+            (mode, template, chunk, prealign, registration_scale)
+            for chunk in _iter_chunks(block, size)
+        )
+        for tmats, aligned, covered in iter_map(_align_chunk, tasks, executor, max_workers):
+            total += np.where(covered, aligned, 0).sum(axis=0)
+            count += covered.sum(axis=0)
+            yield tmats, aligned
+        with np.errstate(invalid="ignore", divide="ignore"):
+            template = np.where(count > 0, total / count, template)
+
+
+def _quantize(chunk: np.ndarray, output_dtype: str = "uint8", native_dtype=None) -> np.ndarray:
+    """Convert full-precision aligned frames to the requested output sample type.
+
+    This is the only quantisation step of the pipeline: registration itself
+    always runs on the raw intensities.
+    """
+    if output_dtype == "uint8":
+        return normalize_stack(chunk)
+    if output_dtype == "float32" or native_dtype is None:
+        return chunk.astype(np.float32)
+    native_dtype = np.dtype(native_dtype)
+    if native_dtype.kind in "ui":
+        info = np.iinfo(native_dtype)
+        return np.clip(np.rint(chunk), info.min, info.max).astype(native_dtype)
+    return chunk.astype(native_dtype)
+
+
+@contextmanager
+def _new_output(suffix: str = ".tif") -> Iterator[str]:
+    """Create an output file in WORK_DIR for the block; remove it if the block fails."""
+    out_path = ARTIFACTS.create(suffix)
+    try:
+        yield out_path
+    except BaseException:
+        ARTIFACTS.remove(out_path)
+        raise
+
+
+def _write_stream(
+    chunks: Iterable[np.ndarray],
+    out_path: str,
+    output_dtype: str = "uint8",
+    native_dtype=None,
+    output: Optional[TiffOutput] = None,
+    n_frames: int = 0,
+) -> None:
+    """Quantise each chunk of aligned frames and append it to *out_path*.
+
+    Only the chunks currently in flight are ever held in memory. Uncompressed
+    frames are written one by one into a single contiguous series. With
+    compression or tiling, the frames of a stack of known length *n_frames*
+    are streamed into one series written by a single call, so tifffile
+    encodes the pages in parallel; a stream of unknown length is written
+    chunk by chunk as plain pages. *n_frames* also decides whether the output
+    needs BigTIFF. The caller removes a partially written file if the
+    pipeline fails (see _new_output()).
+    """
+    output = output or TiffOutput()
+    options = dict(photometric="minisblack", **output.write_options())
+    chunks = (_quantize(chunk, output_dtype, native_dtype) for chunk in chunks)
+    first = next(chunks)
+    frames = itertools.chain(first, (frame for chunk in chunks for frame in chunk))
+    with span("write"), output.writer(out_path, first[0].nbytes * n_frames) as tw:
+        if output.contiguous:
+            for frame in frames:
+                tw.write(frame, contiguous=True, photometric="minisblack")
+        elif n_frames:
+            tw.write(
+                output.segments(frames), shape=(n_frames,) + first.shape[1:], dtype=first.dtype, **options
+            )
+        else:
+            for chunk in itertools.chain([first], chunks):
+                tw.write(chunk, metadata=None, **options)
+
+
+def _imagej_compatible(axes: str, dtype: np.dtype, rgb: bool) -> bool:
+    """Whether a series with *axes* and *dtype* can be written as an ImageJ hyperstack."""
+    in_order = "".join(a for a in "TZCYXS" if a in axes) == axes
+    return in_order and (dtype == np.uint8 if rgb else dtype.char in "BHhf")
+
+
+def _write_hyperstack(
+    chunks: Iterable[np.ndarray],
+    out_path: str,
+    stack,
+    output_dtype: str = "uint8",
+    output: Optional[TiffOutput] = None,
+) -> None:
+    """Quantise (N, C, Y, X) chunks of aligned frames and write them with the axes of *stack*.
+
+    The channel axis is kept: the series is written as ``frame_axes + C + YX``
+    (or with the RGB samples last), as an ImageJ hyperstack when ImageJ
+    supports the axes and sample type and as a shaped TIFF (or OME-TIFF)
+    otherwise; a generic frame axis is written as T. The uint8 stretch is
+    computed per channel plane. Pages are streamed into the file as the
+    chunks arrive; the caller removes a partially written file if the
+    pipeline fails.
+    """
+    output = output or TiffOutput()
+    rgb = stack.channel_axis == "S"
+    frame_axes = "T" if stack.frame_axes in ("I", "Q") else stack.frame_axes
+    axes = frame_axes + ("YXS" if rgb else "CYX")
+    planes = (stack.n_channels,) + stack.frame_shape
+    shape = stack.frame_axes_shape + (stack.frame_shape + (stack.n_channels,) if rgb else planes)
+    dtype = np.dtype(np.uint8 if output_dtype == "uint8" else np.float32 if output_dtype == "float32" else stack.dtype)
+
+    def pages() -> Iterator[np.ndarray]:
+        for chunk in chunks:
+            chunk = _quantize(chunk.reshape((-1,) + stack.frame_shape), output_dtype, stack.dtype)
+            for frame in chunk.reshape((-1,) + planes):
+                if rgb:
+                    yield np.moveaxis(frame, 0, -1)
+                else:
+                    yield from frame
+
+    imagej = _imagej_compatible(axes, dtype, rgb)
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    with span("write"), output.writer(out_path, nbytes, imagej=imagej) as tw:
+        tw.write(
+            output.segments(pages()), shape=shape, dtype=dtype, metadata={"axes": axes},
+            photometric="rgb" if rgb else "minisblack", **output.write_options(),
+        )
+
+
+def _iter_register_to_stack(
+    ref_stack,
+    mov_stack,
+    mode: str,
+    pairing: str = "first",
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prealign: str = "none",
+    registration_scale: int = 1,
+) -> Iterator[np.ndarray]:
+    """Yield aligned chunks of *mov_stack*, in input order.
+
+    With "pairwise", chunk *k* of *mov_stack* is sent to a worker together
+    with chunk *k* of *ref_stack*, so every pair is registered independently;
+    otherwise all frames share one reference: the first frame of *ref_stack*
+    or its mean.
+    """
+    if pairing == "pairwise":
+        tasks = (
+            (mode, refs, frames, prealign, registration_scale)
+            for refs, frames in zip(_iter_chunks(ref_stack, chunk_size), _iter_chunks(mov_stack, chunk_size))
+        )
+        return iter_map(_register_chunk, tasks, executor, max_workers)
+    ref_frame = _mean_frame(ref_stack, chunk_size) if pairing == "mean" else ref_stack[0]
+    return _iter_register_frames(
+        mov_stack, ref_frame, mode, executor, max_workers, chunk_size, prealign, registration_scale
+    )
+
+
+def _select_reference_frame(
+    stack,
+    reference_index: int,
+    external_reference_file: Optional[str],
+    external_reference_index: int,
 ) -> np.ndarray:
-    """Register every frame in *stack* against *ref_frame*. Returns normalised uint8 array."""
-    sr = StackReg(get_sr_mode(mode))
-    return normalize_stack(np.stack([sr.register_transform(ref_frame, fr) for fr in stack]))
+    """Return the reference frame, read from *stack* or from the external file.
+
+    Only the single requested frame of the external stack is decoded, with
+    the same normalisation setting as *stack* and, if it has several
+    channels, from the registration channel of *stack*.
+    """
+    if external_reference_file is not None:
+        channel = getattr(stack, "channel", None)
+        if channel is not None and count_channels(external_reference_file) == 1:
+            channel = None  # a single-channel reference serves any channel
+        with open_stack(external_reference_file, normalize=stack.normalize, channel=channel) as ext_stack:
+            _validate_index(external_reference_index, len(ext_stack), "external_reference_index")
+            return ext_stack[external_reference_index]
+    if not hasattr(stack, "__len__"):
+        return stack[reference_index]  # streamed: the length is not known yet
+    _validate_index(reference_index, len(stack), "reference_index")
+    return stack[reference_index]
 
 
-def _run_align_to_stack(
-    ref_stack: np.ndarray, mov_stack: np.ndarray, mode: str
+def _estimate_strategy(
+    stack,
+    mode: str,
+    reference_index: int = 0,
+    external_reference_file: Optional[str] = None,
+    external_reference_index: int = 0,
+    reference_strategy: str = "fixed",
+    running_mean_window: int = 10,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prealign: str = "none",
+    registration_scale: int = 1,
+    progress_callback: Optional[Callable[..., None]] = None,
 ) -> np.ndarray:
-    """Register every frame in *mov_stack* against the first frame of *ref_stack*.
-    Returns normalised uint8 array."""
-    sr = StackReg(get_sr_mode(mode))
-    return normalize_stack(np.stack([sr.register_transform(ref_stack[0], fr) for fr in mov_stack]))
+    """Return the matrices aligning every frame of *stack* under *reference_strategy*."""
+    if reference_strategy == "previous":
+        _validate_index(reference_index, len(stack), "reference_index")
+        return _estimate_previous(
+            stack, reference_index, mode, executor, max_workers, chunk_size,
+            prealign, registration_scale, progress_callback,
+        )
+    if reference_strategy == "mean":
+        ref_frame = _mean_frame(stack, chunk_size)
+    else:
+        ref_frame = _select_reference_frame(
+            stack, reference_index, external_reference_file, external_reference_index
+        )
+    if reference_strategy == "running_mean":
+        chunks = (
+            chunk_tmats for chunk_tmats, _ in _iter_running_mean(
+                stack, ref_frame, mode, running_mean_window, executor, max_workers,
+                chunk_size, prealign, registration_scale,
+            )
+        )
+        return np.concatenate(list(_with_progress(chunks, _stack_len(stack), progress_callback)))
+    return _estimate_frames(
+        stack, ref_frame, mode, executor, max_workers, chunk_size,
+        progress_callback, prealign, registration_scale,
+    )
+
+
+def _align_channels(
+    stack,
+    out_path: str,
+    estimate: Callable[..., np.ndarray],
+    mode: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    output_dtype: str = "uint8",
+    output: Optional[TiffOutput] = None,
+    progress_callback: Optional[Callable[..., None]] = None,
+) -> None:
+    """Align every channel of *stack* with the matrices of its registration channel.
+
+    ``estimate(progress_callback)`` computes the matrices on the registration
+    channel (the frames of *stack*); they are then applied to all channels by the transform step
+    alone and written with the original axes. Both passes count towards the
+    progress, which runs up to twice the number of frames.
+    """
+    total = len(stack)
+
+    def estimate_progress(current_iteration: int, end_iteration: int) -> None:
+        progress_callback(current_iteration=current_iteration, end_iteration=2 * total)
+
+    tmats = estimate(estimate_progress if progress_callback is not None else None)
+    _write_hyperstack(
+        _with_progress(
+            _iter_apply_channels(stack, tmats, mode, executor, max_workers, chunk_size),
+            2 * total, progress_callback, start=total,
+        ),
+        out_path, stack, output_dtype, output,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Transformation sidecars
+# ---------------------------------------------------------------------------
+
+def _save_transforms(tmats: np.ndarray, mode: str) -> str:
+    """Write *tmats* and *mode* to a compressed ``.npz`` sidecar in WORK_DIR."""
+    out_path = ARTIFACTS.create(".npz")
+    with open(out_path, "wb") as f:
+        np.savez_compressed(f, tmats=tmats, mode=np.array(mode))
+    return out_path
+
+
+def _load_transforms(path: str) -> tuple:
+    """Read a sidecar written by _save_transforms(). Returns ``(tmats, mode)``.
+
+    Raises ValueError if the file is not a valid transformation sidecar.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            tmats = np.asarray(data["tmats"], dtype=np.float64)
+            mode = str(data["mode"])
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as exc:
+        raise ValueError(f"Not a valid transformation file: {path}") from exc
+    _validate_mode(mode)
+    dim = 4 if mode == "BILINEAR" else 3
+    if tmats.ndim != 3 or tmats.shape[1:] != (dim, dim):
+        raise ValueError(
+            f"Transformation file holds matrices of shape {tmats.shape[1:]}, "
+            f"expected ({dim}, {dim}) for mode {mode}."
+        )
+    return tmats, mode
+
+
+def _reference_params(
+    reference_index: int,
+    external_reference_file: Optional[str],
+    external_reference_index: int,
+    reference_strategy: str = "fixed",
+    running_mean_window: int = 10,
+) -> dict:
+    """Return the reference-selection arguments that actually affect the output."""
+    if reference_strategy == "mean":
+        return {"reference_strategy": reference_strategy}
+    if external_reference_file is not None:
+        params = {"external_reference_index": external_reference_index}
+    else:
+        params = {"reference_index": reference_index}
+    if reference_strategy == "previous":
+        params["reference_strategy"] = reference_strategy
+    elif reference_strategy == "running_mean":
+        params.update(reference_strategy=reference_strategy, running_mean_window=running_mean_window)
+    return params
+
+
+def _cached(kind: str, inputs: list, params: dict, run: Callable[[], str]) -> str:
+    """Return the cached output of *kind* for *inputs*/*params*, or call *run*.
+
+    *inputs* are local file paths (hashed by content, None allowed); *params*
+    must hold every argument that affects the output and nothing that does not
+    (executor settings are deliberately left out).
+    """
+    if not RESULT_CACHE.enabled:
+        out_path = run()
+    else:
+        with span("cache"):
+            key = RESULT_CACHE.key(kind, inputs, params)
+            out_path = RESULT_CACHE.get(key)
+        if out_path is None:
+            out_path = run()
+            with span("cache"):
+                RESULT_CACHE.put(key, out_path)
+    ARTIFACTS.add(out_path)
+    return out_path
+
+
+def _process_file(path: str, process: Callable[..., str], channel: Optional[int] = None) -> str:
+    """Call *process* on the raw-intensity stack stored at *path* (its *channel*, if given)."""
+    with open_stack(path, normalize=False, channel=channel) as stack:
+        return process(stack)
+
+
+def _pipelined(
+    download: StreamingDownload,
+    kind: str,
+    extra_inputs: list,
+    params: dict,
+    process: Callable[..., str],
+) -> str:
+    """Run *process* on a stack while it is still being downloaded.
+
+    Frames are decoded page by page as their bytes arrive and handed straight
+    to *process*, so the job takes roughly max(download, compute) instead of
+    their sum. Once the download is complete, the streamed result is accepted
+    only if it covered every frame of the file; it is then stored in the
+    result cache under the same key as a regular run.
+
+    Falls back to the regular path (wait for the download, consult the cache,
+    process the complete file) when there is nothing to stream (cached or
+    demo file, no Content-Length) or the TIFF cannot be read page by page
+    (TiffStreamError). Errors raised by *process* itself are not retried.
+    """
+    out_path = None
+    try:
+        fh = download.open()
+        if fh is not None:
+            try:
+                with fh, TiffPageStream(fh) as pages:
+                    if pages.supported:
+                        out_path = process(pages)
+                        n_frames, dataoffset = pages.frames_read, pages.dataoffset
+            except TiffStreamError:
+                # Report a failed download rather than its symptoms; a file
+                # that cannot be decoded page by page is retried (and the error
+                # reported, if it recurs) on the complete file. Anything else,
+                # including a cancelled job, cancels the download below.
+                download.result()
+                out_path = None
+        stack_file = download.result()
+    except BaseException:
+        download.cancel()
+        if out_path is not None:
+            ARTIFACTS.remove(out_path)
+        raise
+
+    inputs = [stack_file] + extra_inputs
+    if out_path is not None:
+        with open_stack(stack_file, normalize=False) as stack:
+            complete = len(stack) == n_frames and dataoffset in (None, stack.dataoffset)
+        if complete:
+            if RESULT_CACHE.enabled:
+                with span("cache"):
+                    RESULT_CACHE.put(RESULT_CACHE.key(kind, inputs, params), out_path)
+            ARTIFACTS.add(out_path)
+            return out_path
+        ARTIFACTS.remove(out_path)
+    return _cached(kind, inputs, params, lambda: _process_file(stack_file, process))
+
+
+def _validate_reference_call(
+    mode: str,
+    prealign: str,
+    registration_scale: int,
+    reference_strategy: str,
+    external_reference_file: Optional[str],
+    running_mean_window: int,
+    channel: Optional[int],
+    output_dtype: str,
+) -> None:
+    """Validate the registration arguments of an align_stack_to_reference() call."""
+    _validate_mode(mode)
+    _validate_prealign(prealign, mode)
+    _validate_registration_scale(registration_scale)
+    _validate_reference_strategy(reference_strategy, mode, external_reference_file, running_mean_window)
+    _validate_channel(channel)
+    _validate_output_dtype(output_dtype)
+
+
+def _align_to_reference(
+    stack,
+    out_path: str,
+    reference_index: int = 0,
+    mode: str = "RIGID_BODY",
+    external_reference_file: Optional[str] = None,
+    external_reference_index: int = 0,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    output_dtype: str = "uint8",
+    prealign: str = "none",
+    registration_scale: int = 1,
+    reference_strategy: str = "fixed",
+    running_mean_window: int = 10,
+    channel: Optional[int] = None,
+    output: Optional[TiffOutput] = None,
+    progress_callback: Optional[Callable[..., None]] = None,
+) -> None:
+    """Align *stack* as align_stack_to_reference() does and write it to *out_path*.
+
+    Takes validated arguments and local files only, and touches neither
+    ARTIFACTS nor RESULT_CACHE, so align_batch() can run it in a worker
+    process.
+    """
+    if channel is not None and stack.n_channels > 1:
+        _align_channels(
+            stack, out_path,
+            lambda callback: _estimate_strategy(
+                stack, mode, reference_index, external_reference_file, external_reference_index,
+                reference_strategy, running_mean_window, executor, max_workers, chunk_size,
+                prealign, registration_scale, callback,
+            ),
+            mode, executor, max_workers, chunk_size, output_dtype, output, progress_callback,
+        )
+        return
+
+    # Raw frames are read lazily (memory-mapped where possible), registered
+    # chunk by chunk and quantised only when appended to the output, so neither
+    # the input nor the aligned stack is ever fully materialised.
+    if reference_strategy == "previous":
+        _validate_index(reference_index, len(stack), "reference_index")
+        chunks = _iter_previous_frames(
+            stack, reference_index, mode, executor, max_workers, chunk_size,
+            prealign, registration_scale, progress_callback,
+        )
+    else:
+        if reference_strategy == "mean":
+            ref_frame = _mean_frame(stack, chunk_size)
+        else:
+            ref_frame = _select_reference_frame(
+                stack, reference_index, external_reference_file, external_reference_index
+            )
+        if reference_strategy == "running_mean":
+            aligned = (
+                chunk for _, chunk in _iter_running_mean(
+                    stack, ref_frame, mode, running_mean_window, executor, max_workers,
+                    chunk_size, prealign, registration_scale,
+                )
+            )
+        else:
+            aligned = _iter_register_frames(
+                stack, ref_frame, mode, executor, max_workers, chunk_size, prealign, registration_scale
+            )
+        chunks = _with_progress(aligned, _stack_len(stack), progress_callback)
+    _write_stream(chunks, out_path, output_dtype, stack.dtype, output, _stack_len(stack))
+
+
+def _align_to_reference_params(
+    reference_index: int,
+    mode: str,
+    external_reference_file: Optional[str],
+    external_reference_index: int,
+    output_dtype: str,
+    prealign: str,
+    registration_scale: int,
+    reference_strategy: str,
+    running_mean_window: int,
+    channel: Optional[int],
+    output: TiffOutput,
+) -> dict:
+    """Return the result cache parameters of an align_stack_to_reference() call."""
+    params = {
+        **_reference_params(
+            reference_index, external_reference_file, external_reference_index,
+            reference_strategy, running_mean_window,
+        ),
+        "mode": mode,
+        "output_dtype": output_dtype,
+        "prealign": prealign,
+        "registration_scale": registration_scale,
+    }
+    if channel is not None:
+        params["channel"] = channel
+    params.update(output.params())
+    return params
 
 
 # ---------------------------------------------------------------------------
@@ -216,19 +1221,35 @@ def _run_align_to_stack(
 # ---------------------------------------------------------------------------
 
 
+@traced
 def align_stack_to_reference(
     stack_file: str,
     reference_index: int = 0,
     mode: str = "RIGID_BODY",
     external_reference_file: Optional[str] = None,
     external_reference_index: int = 0,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    output_dtype: str = "uint8",
+    pipelined: bool = False,
+    prealign: str = "none",
+    registration_scale: int = 1,
+    reference_strategy: str = "fixed",
+    running_mean_window: int = 10,
+    channel: Optional[int] = None,
+    compression: str = "none",
+    tile_size: Optional[int] = None,
+    output_format: str = "tiff",
+    progress_callback: Optional[Callable[..., None]] = None,
 ) -> str:
     """
     Align every frame in a TIFF stack to a chosen reference frame (intra-stack alignment).
 
     Each frame in *stack_file* is registered to the selected reference frame using
     the chosen transformation model. The reference frame can come from the same
-    stack or from a separate external TIFF stack.
+    stack or from a separate external TIFF stack; alternatively each frame can
+    be registered to its predecessor or to a (running) mean of the stack.
 
     Args:
         stack_file: Path to the input TIFF stack whose frames will be aligned.
@@ -242,49 +1263,148 @@ def align_stack_to_reference(
             is ignored and *external_reference_index* is used instead.
         external_reference_index: Zero-based index of the reference frame inside
             *external_reference_file*. Default is 0.
+        executor: How frames are distributed across workers. One of: serial,
+            thread, process. Default is serial. The output frame order does
+            not depend on the executor.
+        max_workers: Number of workers for the thread/process executors.
+            Defaults to the number of CPUs.
+        chunk_size: Number of frames sent to a worker per task. Default is 16.
+        output_dtype: Sample type of the output TIFF. "uint8" (default) applies
+            a 1-99% percentile stretch, "float32" keeps the raw transformed
+            intensities, "native" casts back to the input dtype. Registration
+            always runs on the full-precision input.
+        pipelined: If True and *stack_file* is a URL, frames are registered as
+            soon as they have been downloaded, overlapping the transfer with the
+            computation (reference strategies "fixed" and "running_mean"
+            only). Default is False.
+        prealign: Optional FFT phase-correlation stage, run on whole chunks of
+            frames before TurboReg. "none" (default) uses TurboReg only;
+            "phase" estimates the translation first and lets TurboReg refine
+            from there, which recovers drifts too large for TurboReg alone
+            (not available for BILINEAR); "phase_only" takes the
+            phase-correlation translation as the result and skips TurboReg
+            (TRANSLATION only, several times faster).
+        registration_scale: Integer downsampling factor N for estimating the
+            matrices. With N > 1 frames are registered as NxN block-mean
+            binned copies and the matrices are rescaled, then applied to the
+            full-resolution frames; estimation cost drops by roughly N^2.
+            Default is 1 (full resolution).
+        reference_strategy: How the reference of each frame is chosen.
+            "fixed" (default) uses the frame selected by *reference_index* /
+            the external reference. "previous" registers every frame to the
+            one before it and composes the matrices along the stack (anchored
+            on *reference_index*; not available for BILINEAR), which follows
+            slow drift and converges faster. "mean" uses the mean of all
+            frames. "running_mean" registers blocks of *running_mean_window*
+            frames against the mean of the previous block's aligned frames,
+            starting from the selected reference frame.
+        running_mean_window: Number of frames per running-mean block (the
+            frames averaged into each template). Default is 10.
+        channel: Zero-based registration channel of a multi-channel stack
+            (ImageJ hyperstack C axis, e.g. TCYX or TZCYX, or RGB samples).
+            The matrices are estimated on this channel only, applied to every
+            channel, and the output keeps the input axes (the channel axis is
+            written just before Y, X, as ImageJ does). None (default) treats
+            every plane as a frame and averages RGB samples. Not pipelined.
+        compression: Lossless compression of the output TIFF: "none"
+            (default), "zlib", "zstd" or "lzw", always with the TIFF
+            predictor. Pages are encoded in parallel; compressed outputs are
+            typically several times smaller to store and download.
+        tile_size: Write the output in square tiles of this many pixels (a
+            multiple of 16) instead of strips. Default is None (strips).
+        output_format: Container of the output. "tiff" (default) switches to
+            BigTIFF when the output would exceed 4 GB; "bigtiff" always uses
+            BigTIFF; "ome" writes an OME-TIFF (not pipelined).
+        progress_callback: Optional function called after every chunk as
+            ``progress_callback(current_iteration=..., end_iteration=...)``
+            with the number of frames done and the total (0 if not yet known),
+            following pystackreg's convention; "previous" and multi-channel
+            stacks are read twice (estimate, then transform) and both passes
+            count. Raising from it aborts the run.
 
     Returns:
-        Path to the aligned output TIFF file (same number of frames as input).
+        Path to the aligned output TIFF file (same number of frames as input,
+        or the same axes for a multi-channel stack with *channel*).
 
     Raises:
         FileNotFoundError: If *stack_file* or *external_reference_file* does not
             exist on disk.
-        IndexError: If *reference_index* or *external_reference_index* is out of
-            range for the corresponding stack.
-        ValueError: If *mode* is not one of the supported transformation modes.
+        IndexError: If *reference_index*, *external_reference_index* or
+            *channel* is out of range for the corresponding stack.
+        ValueError: If *mode* is not one of the supported transformation modes,
+            or the executor settings, *output_dtype*, *prealign*,
+            *registration_scale*, reference strategy settings, *channel* or
+            output encoding settings are invalid.
     """
-    _validate_mode(mode)
-    stack_file = _resolve_path(stack_file, "stack_file")
-
-    stack = load_stack(stack_file)
-
-    if external_reference_file is not None:
-        external_reference_file = _resolve_path(external_reference_file, "external_reference_file")
-        ext_stack = load_stack(external_reference_file)
-        _validate_index(external_reference_index, len(ext_stack), "external_reference_index")
-        ref_frame = ext_stack[external_reference_index]
+    _validate_reference_call(
+        mode, prealign, registration_scale, reference_strategy, external_reference_file,
+        running_mean_window, channel, output_dtype,
+    )
+    validate_executor(executor, max_workers, chunk_size)
+    output = TiffOutput(compression, tile_size, output_format)
+    download = None
+    if pipelined and _is_url(stack_file) and reference_strategy in ("fixed", "running_mean") \
+            and channel is None and output_format != "ome":
+        download = StreamingDownload(stack_file, "stack_file")
+        try:
+            if external_reference_file is not None:
+                external_reference_file = _resolve_path(external_reference_file, "external_reference_file")
+        except BaseException:
+            download.cancel()
+            raise
     else:
-        _validate_index(reference_index, len(stack), "reference_index")
-        ref_frame = stack[reference_index]
-
-    aligned = _run_align_to_reference(stack, ref_frame, mode)
-
-    fd, out_path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-    tifffile.imwrite(out_path, aligned, photometric="minisblack")
-    return out_path
-
+        stack_file, external_reference_file = _resolve_all(
+            (_resolve_path, stack_file, "stack_file"),
+            (_resolve_path, external_reference_file, "external_reference_file"),
+        )
 
+    def process(stack) -> str:
+        with _new_output() as out_path:
+            _align_to_reference(
+                stack, out_path, reference_index, mode, external_reference_file, external_reference_index,
+                executor, max_workers, chunk_size, output_dtype, prealign, registration_scale,
+                reference_strategy, running_mean_window, channel, output, progress_callback,
+            )
+        return out_path
+
+    params = _align_to_reference_params(
+        reference_index, mode, external_reference_file, external_reference_index, output_dtype,
+        prealign, registration_scale, reference_strategy, running_mean_window, channel, output,
+    )
+    if download is not None:
+        return _pipelined(download, "align_stack_to_reference", [external_reference_file], params, process)
+    return _cached(
+        "align_stack_to_reference",
+        [stack_file, external_reference_file],
+        params,
+        lambda: _process_file(stack_file, process, channel),
+    )
+
+
+@traced
 def align_stack_to_stack(
     reference_stack_file: str,
     moving_stack_file: str,
     mode: str = "RIGID_BODY",
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    output_dtype: str = "uint8",
+    prealign: str = "none",
+    registration_scale: int = 1,
+    pairing: str = "first",
+    compression: str = "none",
+    tile_size: Optional[int] = None,
+    output_format: str = "tiff",
+    progress_callback: Optional[Callable[..., None]] = None,
 ) -> str:
     """
-    Align every frame in a moving TIFF stack to the first frame of a reference TIFF stack.
+    Align every frame in a moving TIFF stack to a reference TIFF stack.
 
-    All frames in *moving_stack_file* are registered against the first frame of
-    *reference_stack_file* using the specified transformation model.
+    By default all frames in *moving_stack_file* are registered against the
+    first frame of *reference_stack_file* using the specified transformation
+    model; *pairing* can instead match frame i with reference frame i (e.g.
+    two cameras recording the same scene) or use the mean reference frame.
 
     Args:
         reference_stack_file: Path to the reference TIFF stack. Its first frame
@@ -292,6 +1412,32 @@ def align_stack_to_stack(
         moving_stack_file: Path to the moving TIFF stack to align.
         mode: Transformation model for registration. One of: TRANSLATION,
             RIGID_BODY, SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+        executor: How frames are distributed across workers. One of: serial,
+            thread, process. Default is serial. The output frame order does
+            not depend on the executor.
+        max_workers: Number of workers for the thread/process executors.
+            Defaults to the number of CPUs.
+        chunk_size: Number of frames sent to a worker per task. Default is 16.
+        output_dtype: Sample type of the output TIFF. "uint8" (default) applies
+            a 1-99% percentile stretch, "float32" keeps the raw transformed
+            intensities, "native" casts back to the input dtype. Registration
+            always runs on the full-precision input.
+        prealign: Optional phase-correlation pre-alignment ("none", "phase"
+            or "phase_only"), as in align_stack_to_reference(). Default is none.
+        registration_scale: Downsampling factor for estimating the matrices,
+            as in align_stack_to_reference(). Default is 1.
+        pairing: Which reference frame each moving frame is registered to.
+            "first" (default): the first frame of the reference stack.
+            "pairwise": the reference frame with the same index (both stacks
+            must have the same number of frames). "mean": the mean of the
+            whole reference stack.
+        compression: Output compression ("none", "zlib", "zstd" or "lzw"),
+            as in align_stack_to_reference(). Default is none.
+        tile_size: Output tile size in pixels, or None (default) for strips.
+        output_format: "tiff" (default), "bigtiff" or "ome", as in
+            align_stack_to_reference().
+        progress_callback: Optional per-chunk progress function, called as
+            in align_stack_to_reference().
 
     Returns:
         Path to the aligned output TIFF file (same number of frames as the
@@ -300,28 +1446,71 @@ def align_stack_to_stack(
     Raises:
         FileNotFoundError: If *reference_stack_file* or *moving_stack_file* does
             not exist on disk.
-        ValueError: If *mode* is not one of the supported transformation modes.
+        ValueError: If *mode* is not one of the supported transformation modes,
+            the executor settings, *output_dtype*, *prealign*,
+            *registration_scale*, *pairing* or output encoding settings are
+            invalid, or the stacks differ in length with "pairwise".
     """
     _validate_mode(mode)
-    reference_stack_file = _resolve_path(reference_stack_file, "reference_stack_file")
-    moving_stack_file = _resolve_path(moving_stack_file, "moving_stack_file")
-
-    ref_stack = load_stack(reference_stack_file)
-    mov_stack = load_stack(moving_stack_file)
-
-    aligned = _run_align_to_stack(ref_stack, mov_stack, mode)
-
-    fd, out_path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-    tifffile.imwrite(out_path, aligned, photometric="minisblack")
-    return out_path
-
-
+    _validate_prealign(prealign, mode)
+    _validate_registration_scale(registration_scale)
+    _validate_pairing(pairing)
+    validate_executor(executor, max_workers, chunk_size)
+    _validate_output_dtype(output_dtype)
+    output = TiffOutput(compression, tile_size, output_format)
+    reference_stack_file, moving_stack_file = _resolve_all(
+        (_resolve_path, reference_stack_file, "reference_stack_file"),
+        (_resolve_path, moving_stack_file, "moving_stack_file"),
+    )
+
+    def run() -> str:
+        with open_stack(reference_stack_file, normalize=False) as ref_stack, \
+                open_stack(moving_stack_file, normalize=False) as mov_stack, \
+                _new_output() as out_path:
+            if pairing == "pairwise" and len(ref_stack) != len(mov_stack):
+                raise ValueError(
+                    f"pairing 'pairwise' needs stacks of equal length, but reference_stack_file has "
+                    f"{len(ref_stack)} frame(s) and moving_stack_file has {len(mov_stack)}."
+                )
+            _write_stream(
+                _with_progress(
+                    _iter_register_to_stack(
+                        ref_stack, mov_stack, mode, pairing, executor, max_workers, chunk_size,
+                        prealign, registration_scale,
+                    ),
+                    len(mov_stack), progress_callback,
+                ),
+                out_path, output_dtype, mov_stack.dtype, output, len(mov_stack),
+            )
+        return out_path
+
+    return _cached(
+        "align_stack_to_stack",
+        [reference_stack_file, moving_stack_file],
+        {
+            "mode": mode,
+            "output_dtype": output_dtype,
+            "prealign": prealign,
+            "registration_scale": registration_scale,
+            "pairing": pairing,
+            **output.params(),
+        },
+        run,
+    )
+
+
+@traced
 def align_frame_to_frame(
     stack_file: str,
     reference_index: int,
     moving_index: int,
     mode: str = "RIGID_BODY",
+    output_dtype: str = "uint8",
+    prealign: str = "none",
+    registration_scale: int = 1,
+    compression: str = "none",
+    tile_size: Optional[int] = None,
+    output_format: str = "tiff",
 ) -> str:
     """
     Align a single moving frame to a reference frame within the same TIFF stack.
@@ -335,6 +1524,19 @@ def align_frame_to_frame(
         moving_index: Zero-based index of the frame to align (the moving frame).
         mode: Transformation model for registration. One of: TRANSLATION,
             RIGID_BODY, SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+        output_dtype: Sample type of the output TIFF. "uint8" (default) applies
+            a 1-99% percentile stretch, "float32" keeps the raw transformed
+            intensities, "native" casts back to the input dtype. Registration
+            always runs on the full-precision input.
+        prealign: Optional phase-correlation pre-alignment ("none", "phase"
+            or "phase_only"), as in align_stack_to_reference(). Default is none.
+        registration_scale: Downsampling factor for estimating the matrices,
+            as in align_stack_to_reference(). Default is 1.
+        compression: Output compression ("none", "zlib", "zstd" or "lzw"),
+            as in align_stack_to_reference(). Default is none.
+        tile_size: Output tile size in pixels, or None (default) for strips.
+        output_format: "tiff" (default), "bigtiff" or "ome", as in
+            align_stack_to_reference().
 
     Returns:
         Path to the aligned output TIFF file (single-frame TIFF).
@@ -343,19 +1545,621 @@ def align_frame_to_frame(
         FileNotFoundError: If *stack_file* does not exist on disk.
         IndexError: If *reference_index* or *moving_index* is out of range for
             the stack.
-        ValueError: If *mode* is not one of the supported transformation modes.
+        ValueError: If *mode*, *output_dtype*, *prealign*,
+            *registration_scale* or the output encoding is not supported.
     """
     _validate_mode(mode)
+    _validate_prealign(prealign, mode)
+    _validate_registration_scale(registration_scale)
+    _validate_output_dtype(output_dtype)
+    output = TiffOutput(compression, tile_size, output_format)
     stack_file = _resolve_path(stack_file, "stack_file")
 
-    stack = load_stack(stack_file)
-    _validate_index(reference_index, len(stack), "reference_index")
-    _validate_index(moving_index, len(stack), "moving_index")
+    # Only the two requested pages are decoded; the frame count comes from the
+    # TIFF headers, so the cost does not grow with the length of the stack.
+    with open_stack(stack_file, normalize=False) as stack:
+        _validate_index(reference_index, len(stack), "reference_index")
+        _validate_index(moving_index, len(stack), "moving_index")
+        ref_frame, mov_frame = stack[reference_index], stack[moving_index]
+        native_dtype = stack.dtype
+
+    def run() -> str:
+        aligned = _register_chunk(mode, ref_frame, mov_frame[np.newaxis, ...], prealign, registration_scale)
+        aligned = _quantize(aligned, output_dtype, native_dtype)
+
+        with _new_output() as out_path:
+            output.save(out_path, aligned, photometric="minisblack")
+        return out_path
+
+    # Keyed on the two frames rather than the whole file, which would have to
+    # be read in full to be hashed.
+    return _cached(
+        "align_frame_to_frame",
+        [],
+        {
+            "frames": array_digest(ref_frame, mov_frame, np.empty(0, native_dtype)),
+            "mode": mode,
+            "output_dtype": output_dtype,
+            "prealign": prealign,
+            "registration_scale": registration_scale,
+            **output.params(),
+        },
+        run,
+    )
+
+
+@traced
+def estimate_transforms(
+    stack_file: str,
+    reference_index: int = 0,
+    mode: str = "RIGID_BODY",
+    external_reference_file: Optional[str] = None,
+    external_reference_index: int = 0,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pipelined: bool = False,
+    prealign: str = "none",
+    registration_scale: int = 1,
+    reference_strategy: str = "fixed",
+    running_mean_window: int = 10,
+    channel: Optional[int] = None,
+    progress_callback: Optional[Callable[..., None]] = None,
+) -> str:
+    """
+    Estimate the per-frame transformation matrices of a TIFF stack without transforming it.
+
+    This is the expensive half of align_stack_to_reference(). The matrices are
+    saved to a compact ``.npz`` sidecar that can be passed to apply_transforms()
+    any number of times, e.g. to align further channels of the same acquisition
+    with the same motion.
 
-    sr = StackReg(get_sr_mode(mode))
-    aligned = normalize_stack(np.stack([sr.register_transform(stack[reference_index], stack[moving_index])]))[0]
+    Args:
+        stack_file: Path to the TIFF stack whose motion will be estimated.
+        reference_index: Zero-based index of the reference frame inside
+            *stack_file* (ignored when *external_reference_file* is provided).
+            Default is 0.
+        mode: Transformation model for registration. One of: TRANSLATION,
+            RIGID_BODY, SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+        external_reference_file: Optional path to an external TIFF stack from
+            which the reference frame is taken.
+        external_reference_index: Zero-based index of the reference frame inside
+            *external_reference_file*. Default is 0.
+        executor: How frames are distributed across workers. One of: serial,
+            thread, process. Default is serial.
+        max_workers: Number of workers for the thread/process executors.
+            Defaults to the number of CPUs.
+        chunk_size: Number of frames sent to a worker per task. Default is 16.
+        pipelined: If True and *stack_file* is a URL, frames are registered as
+            soon as they have been downloaded. Default is False.
+        prealign: Optional phase-correlation pre-alignment ("none", "phase"
+            or "phase_only"), as in align_stack_to_reference(). Default is none.
+        registration_scale: Downsampling factor for estimating the matrices,
+            as in align_stack_to_reference(). Default is 1.
+        reference_strategy: "fixed" (default), "previous", "mean" or
+            "running_mean", as in align_stack_to_reference().
+        running_mean_window: Frames per running-mean block. Default is 10.
+        channel: Zero-based channel of a multi-channel stack to estimate the
+            motion on; apply_transforms() then applies the matrices to every
+            channel. None (default) treats every plane as a frame.
+        progress_callback: Optional per-chunk progress function, called as
+            in align_stack_to_reference().
+
+    Returns:
+        Path to the ``.npz`` file holding one matrix per frame (3x3, or 4x4 for
+        BILINEAR) and the transformation mode.
+
+    Raises:
+        FileNotFoundError: If *stack_file* or *external_reference_file* does not
+            exist on disk.
+        IndexError: If *reference_index*, *external_reference_index* or
+            *channel* is out of range for the corresponding stack.
+        ValueError: If *mode* is not one of the supported transformation modes,
+            or the executor settings, *prealign*, *registration_scale*,
+            reference strategy settings or *channel* are invalid.
+    """
+    _validate_mode(mode)
+    _validate_prealign(prealign, mode)
+    _validate_registration_scale(registration_scale)
+    _validate_reference_strategy(reference_strategy, mode, external_reference_file, running_mean_window)
+    _validate_channel(channel)
+    validate_executor(executor, max_workers, chunk_size)
+    download = None
+    if pipelined and _is_url(stack_file) and reference_strategy in ("fixed", "running_mean") \
+            and channel is None:
+        download = StreamingDownload(stack_file, "stack_file")
+        try:
+            if external_reference_file is not None:
+                external_reference_file = _resolve_path(external_reference_file, "external_reference_file")
+        except BaseException:
+            download.cancel()
+            raise
+    else:
+        stack_file, external_reference_file = _resolve_all(
+            (_resolve_path, stack_file, "stack_file"),
+            (_resolve_path, external_reference_file, "external_reference_file"),
+        )
+
+    def process(stack) -> str:
+        return _save_transforms(_estimate_strategy(
+            stack, mode, reference_index, external_reference_file, external_reference_index,
+            reference_strategy, running_mean_window, executor, max_workers, chunk_size,
+            prealign, registration_scale, progress_callback,
+        ), mode)
+
+    params = {
+        **_reference_params(
+            reference_index, external_reference_file, external_reference_index,
+            reference_strategy, running_mean_window,
+        ),
+        "mode": mode,
+        "prealign": prealign,
+        "registration_scale": registration_scale,
+    }
+    if channel is not None:
+        params["channel"] = channel
+    if download is not None:
+        return _pipelined(download, "estimate_transforms", [external_reference_file], params, process)
+    return _cached(
+        "estimate_transforms",
+        [stack_file, external_reference_file],
+        params,
+        lambda: _process_file(stack_file, process, channel),
+    )
+
+
+@traced
+def apply_transforms(
+    stack_file: str,
+    transforms_file: str,
+    executor: str = "serial",
+    max_workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    output_dtype: str = "uint8",
+    compression: str = "none",
+    tile_size: Optional[int] = None,
+    output_format: str = "tiff",
+    progress_callback: Optional[Callable[..., None]] = None,
+) -> str:
+    """
+    Apply previously estimated transformation matrices to a TIFF stack.
+
+    Every frame of *stack_file* is transformed with the matching matrix from
+    *transforms_file* (as returned by estimate_transforms()). No registration
+    is performed, which makes this much cheaper than a full alignment.
+
+    Args:
+        stack_file: Path to the TIFF stack to transform. It must have the same
+            number of frames as the stack the matrices were estimated on. For
+            an ImageJ hyperstack whose frame count per channel matches (e.g.
+            matrices estimated with *channel*), every channel is transformed
+            and the output keeps the input axes.
+        transforms_file: Path to the ``.npz`` file returned by
+            estimate_transforms().
+        executor: How frames are distributed across workers. One of: serial,
+            thread, process. Default is serial.
+        max_workers: Number of workers for the thread/process executors.
+            Defaults to the number of CPUs.
+        chunk_size: Number of frames sent to a worker per task. Default is 16.
+        output_dtype: Sample type of the output TIFF. "uint8" (default) applies
+            a 1-99% percentile stretch, "float32" keeps the raw transformed
+            intensities, "native" casts back to the input dtype. The matrices
+            are always applied to the full-precision input.
+        compression: Output compression ("none", "zlib", "zstd" or "lzw"),
+            as in align_stack_to_reference(). Default is none.
+        tile_size: Output tile size in pixels, or None (default) for strips.
+        output_format: "tiff" (default), "bigtiff" or "ome", as in
+            align_stack_to_reference().
+        progress_callback: Optional per-chunk progress function, called as
+            in align_stack_to_reference().
+
+    Returns:
+        Path to the transformed output TIFF file.
+
+    Raises:
+        FileNotFoundError: If *stack_file* or *transforms_file* does not exist on
+            disk.
+        ValueError: If *transforms_file* is not a valid transformation file, its
+            frame count does not match *stack_file*, or the executor settings,
+            *output_dtype* or output encoding settings are invalid.
+    """
+    validate_executor(executor, max_workers, chunk_size)
+    _validate_output_dtype(output_dtype)
+    output = TiffOutput(compression, tile_size, output_format)
+    stack_file, transforms_file = _resolve_all(
+        (_resolve_path, stack_file, "stack_file"),
+        (_resolve_transforms_path, transforms_file, "transforms_file"),
+    )
+
+    def run() -> str:
+        tmats, mode = _load_transforms(transforms_file)
+        with open_stack(stack_file, normalize=False) as stack:
+            channels = stack.channel_axis == "C" and len(tmats) == stack.channel_frames
+            if len(tmats) != len(stack) and not channels:
+                raise ValueError(
+                    f"transforms_file holds {len(tmats)} matrices but stack_file has "
+                    f"{len(stack)} frame(s)."
+                )
+            with _new_output() as out_path:
+                if channels:
+                    _write_hyperstack(
+                        _with_progress(
+                            _iter_apply_channels(stack, tmats, mode, executor, max_workers, chunk_size),
+                            len(tmats), progress_callback,
+                        ),
+                        out_path, stack, output_dtype, output,
+                    )
+                else:
+                    _write_stream(
+                        _with_progress(
+                            _iter_apply_frames(stack, tmats, mode, executor, max_workers, chunk_size),
+                            len(stack), progress_callback,
+                        ),
+                        out_path, output_dtype, stack.dtype, output, len(stack),
+                    )
+        return out_path
+
+    return _cached(
+        "apply_transforms",
+        [stack_file, transforms_file],
+        {"output_dtype": output_dtype, **output.params()},
+        run,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Batch registration
+# ---------------------------------------------------------------------------
+
+# align_stack_to_reference() arguments that may be set per batch item.
+BATCH_ITEM_PARAMS = {
+    "reference_index",
+    "mode",
+    "external_reference_file",
+    "external_reference_index",
+    "output_dtype",
+    "prealign",
+    "registration_scale",
+    "reference_strategy",
+    "running_mean_window",
+    "channel",
+    "compression",
+    "tile_size",
+    "output_format",
+}
+
+
+def _is_zip_name(path_or_url: str) -> bool:
+    return os.path.splitext(urllib.parse.urlparse(path_or_url).path)[1].lower() == ".zip"
+
+
+def _expand_archive(path_or_url: str, label: str) -> List[Tuple[str, str]]:
+    """Extract the TIFF members of a ZIP archive into WORK_DIR.
+
+    Returns ``(member name, extracted path)`` pairs in archive order. Members
+    are written under fresh temp names (never their archive paths), members
+    that are not TIFFs are skipped, and the total extracted size is capped at
+    the download limit.
+    """
+    if _is_url(path_or_url):
+        archive = _download_to_work_dir(path_or_url, label, ".zip", _ZIP_MAGIC, "ZIP archive")
+    else:
+        _require_file(path_or_url, label)
+        archive = path_or_url
+
+    members = []
+    total = 0
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                total += info.file_size
+                if total > _MAX_DOWNLOAD_BYTES:
+                    raise ValueError(
+                        f"{label} expands to more than "
+                        f"{_MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB."
+                    )
+                with zf.open(info) as src:
+                    if not any(src.read(4).startswith(m) for m in _TIFF_MAGIC):
+                        continue
+                out_path = ARTIFACTS.create(".tif")
+                members.append((info.filename, out_path))
+                with open(out_path, "wb") as dst, zf.open(info) as src:
+                    while True:
+                        chunk = src.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                ARTIFACTS.add(out_path)
+    except zipfile.BadZipFile as exc:
+        raise ValueError(f"{label} is not a valid ZIP archive.") from exc
+    except BaseException:
+        for _, out_path in members:
+            ARTIFACTS.remove(out_path)
+        raise
+    if not members:
+        raise ValueError(f"{label} does not contain any TIFF files.")
+    return members
+
+
+def _prepare_batch_item(stack_file: str, params: dict) -> Tuple[str, Optional[str], dict, dict]:
+    """Validate one batch item and resolve its inputs (in the calling process).
+
+    Returns ``(stack path, external reference path, _align_to_reference()
+    arguments, result cache params)``; raises like align_stack_to_reference().
+    """
+    external_reference_file = params.get("external_reference_file")
+    _validate_reference_call(
+        params["mode"], params["prealign"], params["registration_scale"], params["reference_strategy"],
+        external_reference_file, params["running_mean_window"], params["channel"], params["output_dtype"],
+    )
+    output = TiffOutput(params["compression"], params["tile_size"], params["output_format"])
+    stack_file, external_reference_file = _resolve_all(
+        (_resolve_path, stack_file, "stack_file"),
+        (_resolve_path, external_reference_file, "external_reference_file"),
+    )
+    arguments = {
+        "reference_index": params["reference_index"],
+        "mode": params["mode"],
+        "external_reference_file": external_reference_file,
+        "external_reference_index": params.get("external_reference_index", 0),
+        "output_dtype": params["output_dtype"],
+        "prealign": params["prealign"],
+        "registration_scale": params["registration_scale"],
+        "reference_strategy": params["reference_strategy"],
+        "running_mean_window": params["running_mean_window"],
+        "channel": params["channel"],
+    }
+    cache_params = _align_to_reference_params(output=output, **arguments)
+    return stack_file, external_reference_file, dict(arguments, output=output), cache_params
+
+
+def _align_batch_item(index: int, stack_file: str, out_path: str, arguments: dict) -> dict:
+    """Align one prepared batch item serially into *out_path* (runs in a worker); never raises.
+
+    Only computes: a process worker holds mere copies of ARTIFACTS and
+    RESULT_CACHE, so the parent records the output in both.
+    """
+    start = time.perf_counter()
+    try:
+        with open_stack(stack_file, normalize=False, channel=arguments["channel"]) as stack:
+            _align_to_reference(stack, out_path, **arguments)
+    except Exception as exc:
+        return {
+            "index": index,
+            "status": "failed",
+            "output": None,
+            "error": f"{type(exc).__name__}: {exc}",
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+    return {
+        "index": index,
+        "status": "succeeded",
+        "output": out_path,
+        "error": None,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def _batch_outputs(manifest_path: str) -> List[str]:
+    """Return the output paths of the succeeded items of an align_batch manifest."""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return [item["output"] for item in manifest["items"] if item["output"] is not None]
+
+
+@traced
+def align_batch(
+    stack_files: List[str],
+    reference_index: int = 0,
+    mode: str = "RIGID_BODY",
+    output_dtype: str = "uint8",
+    item_params: Optional[List[Optional[dict]]] = None,
+    executor: str = "process",
+    max_workers: Optional[int] = None,
+    prealign: str = "none",
+    registration_scale: int = 1,
+    reference_strategy: str = "fixed",
+    running_mean_window: int = 10,
+    channel: Optional[int] = None,
+    compression: str = "none",
+    tile_size: Optional[int] = None,
+    output_format: str = "tiff",
+    progress_callback: Optional[Callable[..., None]] = None,
+) -> str:
+    """
+    Align every frame of many TIFF stacks to a reference frame, in one call.
+
+    Each stack is processed as by align_stack_to_reference(). Whole stacks
+    are spread across the worker pool (each one registered serially inside
+    its worker), which keeps every core busy even when the stacks are small.
+    URLs are downloaded and the result cache is consulted before the stacks
+    are handed to the workers.
+    A failing item does not stop the batch; its error is recorded in the
+    manifest instead.
+
+    Args:
+        stack_files: Paths or HTTP/HTTPS URLs of the TIFF stacks. An entry
+            ending in ``.zip`` is a ZIP archive whose TIFF members become
+            items of their own.
+        reference_index: Zero-based reference frame index shared by all items.
+            Default is 0.
+        mode: Transformation model shared by all items. One of: TRANSLATION,
+            RIGID_BODY, SCALED_ROTATION, AFFINE, BILINEAR. Default is RIGID_BODY.
+        output_dtype: Output sample type shared by all items. One of: uint8,
+            float32, native. Default is uint8.
+        item_params: Optional list with one entry (a dict or None) per entry of
+            *stack_files*, overriding the shared arguments for that entry (and
+            all members of an archive). Allowed keys: reference_index, mode,
+            external_reference_file, external_reference_index, output_dtype,
+            prealign, registration_scale, reference_strategy,
+            running_mean_window, channel, compression, tile_size,
+            output_format.
+        executor: How items are distributed across workers. One of: serial,
+            thread, process. Default is process.
+        max_workers: Number of workers for the thread/process executors.
+            Defaults to the number of CPUs.
+        prealign: Phase-correlation pre-alignment shared by all items ("none",
+            "phase" or "phase_only"), as in align_stack_to_reference().
+            Default is none.
+        registration_scale: Estimation downsampling factor shared by all
+            items, as in align_stack_to_reference(). Default is 1.
+        reference_strategy: Reference strategy shared by all items ("fixed",
+            "previous", "mean" or "running_mean"), as in
+            align_stack_to_reference(). Default is fixed.
+        running_mean_window: Frames per running-mean block. Default is 10.
+        channel: Registration channel of multi-channel stacks, shared by all
+            items, as in align_stack_to_reference(). Default is None.
+        compression: Output compression shared by all items ("none", "zlib",
+            "zstd" or "lzw"), as in align_stack_to_reference(). Default is
+            none.
+        tile_size: Output tile size shared by all items, or None (default)
+            for strips.
+        output_format: Output container shared by all items ("tiff",
+            "bigtiff" or "ome"). Default is tiff.
+        progress_callback: Optional function called after every finished item
+            as ``progress_callback(current_iteration=..., end_iteration=...)``
+            with the number of items done and the total.
+
+    Returns:
+        Path to a JSON manifest with one record per item, in input order
+        (``index``, ``input``, ``member`` for archive members, ``status``
+        "succeeded" or "failed", ``output``, ``error``, ``seconds``), plus
+        the ``succeeded`` / ``failed`` counts and the total ``seconds``.
+
+    Raises:
+        ValueError: If *stack_files* is empty, *item_params* does not match it
+            or holds unknown keys, the shared *mode* / *output_dtype* /
+            *prealign* / *registration_scale* / reference strategy / *channel*
+            / output encoding or the executor settings are invalid, or an archive cannot be read.
+    """
+    if not stack_files:
+        raise ValueError("stack_files must contain at least one stack.")
+    _validate_mode(mode)
+    _validate_prealign(prealign, mode)
+    _validate_registration_scale(registration_scale)
+    _validate_reference_strategy(reference_strategy, mode, running_mean_window=running_mean_window)
+    _validate_channel(channel)
+    _validate_output_dtype(output_dtype)
+    validate_output(compression, tile_size, output_format)
+    validate_executor(executor, max_workers)
+    if item_params is None:
+        item_params = [None] * len(stack_files)
+    if len(item_params) != len(stack_files):
+        raise ValueError(
+            f"item_params has {len(item_params)} entries but stack_files has {len(stack_files)}."
+        )
+    shared = {
+        "reference_index": reference_index,
+        "mode": mode,
+        "output_dtype": output_dtype,
+        "prealign": prealign,
+        "registration_scale": registration_scale,
+        "reference_strategy": reference_strategy,
+        "running_mean_window": running_mean_window,
+        "channel": channel,
+        "compression": compression,
+        "tile_size": tile_size,
+        "output_format": output_format,
+    }
+    for overrides in item_params:
+        unknown = set(overrides or {}) - BATCH_ITEM_PARAMS
+        if unknown:
+            raise ValueError(
+                f"Invalid item_params key(s): {', '.join(sorted(unknown))}. "
+                f"Allowed: {', '.join(sorted(BATCH_ITEM_PARAMS))}."
+            )
+
+    start = time.perf_counter()
+    records, tasks = [], []
+    for i, (entry, overrides) in enumerate(zip(stack_files, item_params)):
+        params = {**shared, **(overrides or {})}
+        if _is_zip_name(entry):
+            members = _expand_archive(entry, f"stack_files[{i}]")
+        else:
+            members = [(None, entry)]
+        for member, path in members:
+            record = {"index": len(records), "input": entry}
+            if member is not None:
+                record["member"] = member
+            records.append(record)
+            tasks.append((record["index"], path, params))
+
+    if progress_callback is not None:
+        progress_callback(current_iteration=0, end_iteration=len(tasks))
+
+    # Inputs are resolved (URLs downloaded) and the result cache consulted
+    # here, so that every file and cache entry is known to this process; the
+    # workers only compute.
+    def prepare(task: tuple) -> tuple:
+        index, path, params = task
+        item_start = time.perf_counter()
+        try:
+            prepared = _prepare_batch_item(path, params)
+        except Exception as exc:
+            prepared = exc
+        return index, prepared, time.perf_counter() - item_start
+
+    with ThreadPoolExecutor(max_workers=resolve_workers(max_workers)) as pool:
+        prepared_items = list(pool.map(prepare, tasks))
+
+    work, keys, prepare_seconds = [], {}, {}
+    for index, prepared, seconds in prepared_items:
+        if isinstance(prepared, Exception):
+            records[index].update(
+                status="failed", output=None, error=f"{type(prepared).__name__}: {prepared}",
+                seconds=round(seconds, 3),
+            )
+            continue
+        stack_file, external_reference_file, arguments, cache_params = prepared
+        prepare_seconds[index] = seconds
+        if RESULT_CACHE.enabled:
+            with span("cache"):
+                keys[index] = RESULT_CACHE.key(
+                    "align_stack_to_reference", [stack_file, external_reference_file], cache_params
+                )
+                cached = RESULT_CACHE.get(keys[index])
+            if cached is not None:
+                ARTIFACTS.add(cached)
+                records[index].update(status="succeeded", output=cached, error=None, seconds=round(seconds, 3))
+                continue
+        work.append((index, stack_file, ARTIFACTS.create(".tif"), arguments))
+
+    done = len(tasks) - len(work)
+    if progress_callback is not None and done:
+        progress_callback(current_iteration=done, end_iteration=len(tasks))
+    pending = {index: out_path for index, _, out_path, _ in work}
+    try:
+        for result in iter_map(_align_batch_item, work, executor, max_workers):
+            index = result["index"]
+            out_path = pending.pop(index)
+            if result["status"] == "succeeded":
+                ARTIFACTS.add(out_path)
+                if index in keys:
+                    with span("cache"):
+                        RESULT_CACHE.put(keys[index], out_path)
+            else:
+                ARTIFACTS.remove(out_path)
+            result["seconds"] = round(result["seconds"] + prepare_seconds[index], 3)
+            records[index].update(result)
+            done += 1
+            if progress_callback is not None:
+                progress_callback(current_iteration=done, end_iteration=len(tasks))
+    except BaseException:
+        for out_path in pending.values():
+            ARTIFACTS.remove(out_path)
+        raise
 
-    fd, out_path = tempfile.mkstemp(suffix=".tif", dir=WORK_DIR)
-    os.close(fd)
-    tifffile.imwrite(out_path, aligned[np.newaxis, ...], photometric="minisblack")
+    succeeded = sum(1 for r in records if r["status"] == "succeeded")
+    manifest = {
+        "items": records,
+        "succeeded": succeeded,
+        "failed": len(records) - succeeded,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    out_path = ARTIFACTS.create(".json")
+    with open(out_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    ARTIFACTS.add(out_path)
     return out_path
@@ -1,12 +1,16 @@
 from pystackreg import StackReg
 import numpy as np
 import imageio.v2 as iio
+import tifffile
 from PIL import Image
-import time
 import threading
 import hashlib
+import json
 import tempfile
 import os
+import urllib.parse
+
+from core.instrument import span
 
 def get_sr_mode(mode_str): return {
     "TRANSLATION": StackReg.TRANSLATION,
@@ -16,27 +20,409 @@ def get_sr_mode(mode_str): return {
     "BILINEAR": StackReg.BILINEAR,
 }.get(mode_str, StackReg.RIGID_BODY)
 
-def normalize_stack(stack):
-    norm_stack = []
-    for frame in stack:
-        f = frame.astype(np.float32)
-        low, high = np.percentile(f, (1, 99))
-        f = np.clip(f, low, high)
-        fmin = f.min()
-        fmax = f.max()
-        rng = fmax - fmin
-        f = (f - fmin) / (rng + 1e-8) * 255 if rng > 0 else np.zeros_like(f)
-        norm_stack.append(f.astype(np.uint8))
-    return np.stack(norm_stack)
+# Scratch memory used per normalisation batch (frames are processed in groups
+# that fit this budget, so large stacks never need a full float copy).
+_NORMALIZE_BATCH_BYTES = 64 * 1024 * 1024
+_NORMALIZE_PERCENTILES = (1, 99)
+
+def _lerp(a, b, t):
+    # Same linear interpolation as np.percentile's default method.
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+def _batch_percentiles(flat, q=_NORMALIZE_PERCENTILES):
+    """Row-wise percentiles of a 2D array using one np.partition pass."""
+    n = flat.shape[1]
+    virtual = np.asarray(q, dtype=np.float64) / 100 * (n - 1)
+    lo = np.floor(virtual).astype(np.intp)
+    hi = np.minimum(lo + 1, n - 1)
+    part = np.partition(flat, np.unique(np.concatenate([lo, hi])), axis=1)
+    a = part[:, lo].astype(np.float64)
+    b = part[:, hi].astype(np.float64)
+    return _lerp(a, b, virtual - lo)
+
+def _hist_percentiles(counts, offset, q=_NORMALIZE_PERCENTILES):
+    """Exact percentiles from a histogram of integer values (value = bin - offset)."""
+    cum = np.cumsum(counts)
+    virtual = np.asarray(q, dtype=np.float64) / 100 * (cum[-1] - 1)
+    lo = np.floor(virtual).astype(np.int64)
+    hi = np.minimum(lo + 1, cum[-1] - 1)
+    a = np.searchsorted(cum, lo, side="right").astype(np.float64) - offset
+    b = np.searchsorted(cum, hi, side="right").astype(np.float64) - offset
+    return _lerp(a, b, virtual - lo)
+
+def _is_small_int(dtype):
+    return dtype.kind in "ui" and dtype.itemsize <= 2
+
+def _frame_percentiles(chunk, flat, q=_NORMALIZE_PERCENTILES):
+    """Per-frame percentiles: histogram based for <=16-bit integers, else np.partition."""
+    if not _is_small_int(chunk.dtype):
+        return _batch_percentiles(flat, q)
+    offset = -int(np.iinfo(chunk.dtype).min)
+    ints = chunk.reshape(len(chunk), -1)
+    if offset:
+        ints = ints.astype(np.int32) + offset
+    return np.stack([_hist_percentiles(np.bincount(f), offset, q) for f in ints])
+
+def stretch_rows(buf, low, high):
+    """Rescale each row of the float32 *buf* from its [low, high] range to 0-255, in place."""
+    rng = high - low
+    low32 = low.astype(np.float32)[:, np.newaxis]
+    np.clip(buf, low32, high.astype(np.float32)[:, np.newaxis], out=buf)
+    buf -= low32
+    buf /= (rng + 1e-8).astype(np.float32)[:, np.newaxis]
+    buf *= 255
+    buf[rng <= 0] = 0
+    return buf
+
+def frame_percentiles(frame, q=_NORMALIZE_PERCENTILES):
+    """The (low, high) percentiles normalize_stack() stretches *frame* between."""
+    frame = np.asarray(frame)
+    return _frame_percentiles(frame[np.newaxis], frame.reshape(1, -1).astype(np.float32), q)[0]
+
+def normalize_stack(stack, out=None):
+    """Clip every frame to its 1st-99th percentile range and rescale to uint8.
+
+    Frames are processed in batches with in-place float32 arithmetic and
+    written into a preallocated uint8 array (*out*, if given).
+    """
+    with span("normalize"):
+        n = len(stack)
+        if out is None:
+            out = np.empty((n,) + np.shape(stack[0]), dtype=np.uint8)
+        if n == 0:
+            return out
+        frame_size = out[0].size
+        batch = max(1, _NORMALIZE_BATCH_BYTES // max(1, frame_size * 4))
+
+        for start in range(0, n, batch):
+            chunk = np.asarray(stack[start:start + batch])
+            buf = chunk.reshape(len(chunk), frame_size).astype(np.float32)
+            low, high = _frame_percentiles(chunk, buf).T
+            stretch_rows(buf, low, high)
+            out[start:start + len(chunk)] = buf.reshape(chunk.shape[:1] + out.shape[1:])
+        return out
 
 def upscale(image, factor=3):
     return image.resize((image.width * factor, image.height * factor), Image.NEAREST)
 
 def load_stack(file):
-    stack = np.array(iio.mimread(file))
-    if stack.ndim == 4 and stack.shape[-1] == 3:
-        stack = np.mean(stack, axis=-1)
-    return normalize_stack(stack)
+    with open_stack(file) as stack:
+        return stack[:]
+
+
+class TiffStack:
+    """Lazy, frame-addressable view of an image stack on disk.
+
+    Uncompressed TIFF/BigTIFF files are memory-mapped; other TIFFs are decoded
+    one page at a time, so only the frames actually requested are ever held in
+    memory. Non-TIFF files fall back to a full in-memory read. Indexing returns
+    the frames normalised to uint8 when *normalize* is True, and the raw
+    intensities otherwise (``dtype`` is the on-disk sample type).
+
+    By default all axes other than Y, X (and RGB samples, which are averaged)
+    are flattened into frames. With a *channel* index the channel axis of the
+    series (ImageJ ``C``, or the RGB samples) is kept apart instead: frames
+    run over the remaining axes (``frame_axes``, e.g. "T" or "TZ") and hold
+    only that channel. ``channel_axis`` is "C", "S" or None for single-channel
+    stacks, and channel_planes() returns every channel of a frame.
+    """
+
+    def __init__(self, file, normalize=True, channel=None):
+        self.normalize = normalize
+        self._tf = None
+        self._data = None
+        self._pages = None  # page-indexed access for plain multi-page TIFFs
+        self.dataoffset = None  # file offset of the frames, when memory-mapped
+        self._lock = threading.Lock()
+        try:
+            self._tf = tifffile.TiffFile(file)
+        except tifffile.TiffFileError:
+            self._data = np.array(iio.mimread(file))
+            self._rgb = self._data.ndim == 4 and self._data.shape[-1] == 3
+            self.dtype = self._data.dtype
+            self.frame_shape = self._data.shape[1:3] if self._rgb else self._data.shape[1:]
+            self._len = len(self._data)
+            self._init_channels("IYXS" if self._rgb else "IYX", self._data.shape, channel)
+            return
+
+        first = self._tf.pages.first
+        if not first.flags and first.axes in ("YX", "YXS") and self._tf.is_uniform:
+            # Plain multi-page TIFF: every page is one frame. Counting pages
+            # only walks the IFD chain, and each page is parsed when it is
+            # first read, so opening costs the same for 30 or 30,000 frames.
+            self._pages = self._tf.pages
+            self._rgb = first.axes == "YXS"
+            self.dtype = first.dtype
+            self.frame_shape = tuple(first.shape[:2])
+            self._len = len(self._pages)
+            self._init_channels("I" + first.axes, (self._len,) + tuple(first.shape), channel)
+            return
+
+        series = self._tf.series[0]
+        self._rgb = series.axes.endswith("S")
+        self.dtype = series.dtype
+        yx_ndim = 3 if self._rgb else 2
+        self.frame_shape = tuple(series.shape[-yx_ndim:][:2])
+        self._len = int(np.prod(series.shape[:-yx_ndim], dtype=np.int64))
+        frame_full_shape = (self._len,) + tuple(series.shape[-yx_ndim:])
+
+        if series.dataoffset is not None:
+            self._data = tifffile.memmap(file, mode="r").reshape(frame_full_shape)
+            self.dataoffset = series.dataoffset
+        elif len(series.pages) != self._len:
+            # Unusual page layout: decode the whole series once.
+            self._data = series.asarray().reshape(frame_full_shape)
+        self._init_channels(series.axes, tuple(series.shape), channel)
+
+    def _init_channels(self, axes, shape, channel):
+        """Locate the channel axis of the *axes* / *shape* series and select *channel*."""
+        self.axes = axes
+        lead_ndim = len(axes) - (3 if self._rgb else 2)
+        self._lead_shape = tuple(shape[:lead_ndim])  # one plane per index
+        lead_axes = axes[:lead_ndim]
+        self._channel_axis = lead_axes.find("C") if "C" in lead_axes else None
+        if self._channel_axis is not None:
+            self.channel_axis = "C"
+            self.n_channels = self._lead_shape[self._channel_axis]
+        elif self._rgb:
+            self.channel_axis = "S"
+            self.n_channels = shape[-1]
+        else:
+            self.channel_axis = None
+            self.n_channels = 1
+        self.frame_axes = lead_axes.replace("C", "")
+        self.frame_axes_shape = tuple(
+            n for i, n in enumerate(self._lead_shape) if i != self._channel_axis
+        )
+        self.channel_frames = int(np.prod(self.frame_axes_shape, dtype=np.int64))
+        self.channel = None if channel is None else int(channel)
+        if self.channel is not None:
+            if not 0 <= self.channel < self.n_channels:
+                raise IndexError(
+                    f"channel {channel} is out of range for a stack with {self.n_channels} channel(s)."
+                )
+            self._len = self.channel_frames
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def shape(self):
+        return (self._len,) + self.frame_shape
+
+    def _read_plane(self, idx):
+        """Decode plane *idx* of the flattened series (samples included)."""
+        if self._data is not None:
+            return self._data[idx]
+        with self._lock:
+            if self._pages is not None:
+                return self._pages[idx].asarray()
+            return self._tf.asarray(key=idx, series=0)
+
+    def _plane_index(self, idx, c):
+        """Flat plane index of channel *c* of frame *idx* (C-axis series only)."""
+        pos = list(np.unravel_index(idx, self.frame_axes_shape))
+        pos.insert(self._channel_axis, c)
+        return int(np.ravel_multi_index(pos, self._lead_shape))
+
+    def _raw_frame(self, idx):
+        if self.channel is None:
+            frame = self._read_plane(idx)
+        elif self._channel_axis is None:
+            frame = self._read_plane(idx)
+            if self._rgb:
+                return frame[..., self.channel]
+        else:
+            frame = self._read_plane(self._plane_index(idx, self.channel))
+        return np.mean(frame, axis=-1) if self._rgb else frame
+
+    def channel_planes(self, idx):
+        """Raw (C, Y, X) array holding every channel of frame *idx* (0 <= idx < channel_frames)."""
+        if self._channel_axis is None:
+            plane = self._read_plane(idx)
+            return np.moveaxis(plane, -1, 0) if self._rgb else plane[np.newaxis]
+        planes = np.stack([self._read_plane(self._plane_index(idx, c)) for c in range(self.n_channels)])
+        return np.mean(planes, axis=-1) if self._rgb else planes
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            frames = np.stack([self._raw_frame(i) for i in range(*key.indices(self._len))])
+            return normalize_stack(frames) if self.normalize else frames
+        idx = int(key)
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError(f"frame index {key} is out of range for a stack with {self._len} frame(s).")
+        frame = self._raw_frame(idx)
+        return normalize_stack(frame[np.newaxis])[0] if self.normalize else frame
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self[i]
+
+    def close(self):
+        self._data = None
+        if self._tf is not None:
+            self._tf.close()
+            self._tf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_stack(file, normalize=True, channel=None):
+    with span("open"):
+        return TiffStack(file, normalize=normalize, channel=channel)
+
+def count_frames(file):
+    """Number of frames in *file*, read from the TIFF headers only."""
+    with open_stack(file, normalize=False) as stack:
+        return len(stack)
+
+def count_channels(file):
+    """Number of channels (ImageJ C axis, or RGB samples) in *file*, read from the headers only."""
+    with open_stack(file, normalize=False) as stack:
+        return stack.n_channels
+
+def read_frame(file, index, normalize=False):
+    """Decode only frame *index* of *file* (raw, or normalised to uint8)."""
+    with open_stack(file, normalize=normalize) as stack:
+        return stack[index]
+
+
+class TiffStreamError(ValueError):
+    """A page of a TiffPageStream could not be parsed or decoded."""
+
+
+class TiffPageStream:
+    """Sequential, page-by-page view of a TIFF whose tail may still be arriving.
+
+    Unlike TiffStack, nothing beyond the first page is parsed up front, so
+    frames can be consumed from a file object that blocks until the bytes it
+    is asked for have been downloaded. Only the plain one-frame-per-page
+    layout (grey or RGB) is handled: ``supported`` is False otherwise, and
+    iteration stops at the first page that does not match the first one.
+    Frames are always raw (``normalize`` is False); ``frames_read`` counts the
+    frames yielded by iteration so far. Any failure to parse or decode the
+    file (including a download that ended early) is raised as TiffStreamError.
+
+    Uncompressed stacks written as one contiguous block (the tifffile and
+    ImageJ default) store every IFD but the first after the pixel data, so
+    their frames are instead located from the shape declared in the first
+    page's description; ``dataoffset`` is then the offset of frame 0.
+    """
+
+    normalize = False
+
+    def __init__(self, file):
+        try:
+            self._tf = tifffile.TiffFile(file)
+        except Exception as exc:
+            raise TiffStreamError(f"could not parse TIFF header: {exc}") from exc
+        try:
+            self._init(self._tf.pages[0])
+        except Exception as exc:
+            self._tf.close()
+            raise TiffStreamError(f"could not parse first TIFF page: {exc}") from exc
+
+    def _init(self, first):
+        self._rgb = first.axes == "YXS"
+        self.dtype = first.dtype
+        self.frame_shape = tuple(first.shape[:2])
+        self._page_shape = first.shape
+        self.supported = first.axes in ("YX", "YXS")
+        self.frames_read = 0
+        self.dataoffset = None
+        self._declared = self._declared_frames(first)
+        if (
+            self._declared > 1
+            and first.is_contiguous
+            and first.compression == 1
+            and first.bitspersample == self.dtype.itemsize * 8
+        ):
+            self.dataoffset = first.dataoffsets[0]
+            self._frame_items = int(np.prod(first.shape))
+
+    def _declared_frames(self, first):
+        if first.is_imagej:
+            return int(self._tf.imagej_metadata.get("images", 1))
+        if first.is_shaped:
+            try:
+                shape = json.loads(first.description)["shape"]
+            except (ValueError, KeyError, TypeError):
+                return 0
+            return int(np.prod(shape[:-first.ndim], dtype=np.int64))
+        return 0
+
+    def _matches(self, page):
+        return page.shape == self._page_shape and page.dtype == self.dtype and not page.is_reduced
+
+    def _frame(self, page):
+        try:
+            frame = page.asarray()
+        except Exception as exc:
+            raise TiffStreamError(f"could not decode TIFF page {page.index}: {exc}") from exc
+        return np.mean(frame, axis=-1) if self._rgb else frame
+
+    def _contiguous_frame(self, idx):
+        try:
+            frame = self._tf.filehandle.read_array(
+                self._tf.byteorder + self.dtype.char,
+                self._frame_items,
+                self.dataoffset + idx * self._frame_items * self.dtype.itemsize,
+            ).reshape(self._page_shape)
+        except Exception as exc:
+            raise TiffStreamError(f"could not read frame {idx}: {exc}") from exc
+        return np.mean(frame, axis=-1) if self._rgb else frame
+
+    def _page(self, idx):
+        """Page *idx*, or None past the last page."""
+        try:
+            return self._tf.pages[idx]
+        except IndexError:
+            return None
+        except Exception as exc:
+            raise TiffStreamError(f"could not parse TIFF page {idx}: {exc}") from exc
+
+    def __getitem__(self, idx):
+        if self.dataoffset is not None:
+            if not 0 <= idx < self._declared:
+                raise IndexError(f"frame index {idx} is out of range.")
+            return self._contiguous_frame(idx)
+        page = self._page(idx) if idx >= 0 else None
+        if page is None or not self._matches(page):
+            raise IndexError(f"frame index {idx} is out of range.")
+        return self._frame(page)
+
+    def __iter__(self):
+        if self.dataoffset is not None:
+            for idx in range(self._declared):
+                frame = self._contiguous_frame(idx)
+                self.frames_read += 1
+                yield frame
+            return
+        idx = 0
+        while True:
+            page = self._page(idx)
+            if page is None or not self._matches(page):
+                return
+            idx += 1
+            frame = self._frame(page)
+            self.frames_read += 1
+            yield frame
+
+    def close(self):
+        self._tf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 ##### CACHE #####
@@ -48,30 +434,24 @@ DEMO_DIR = os.path.join(APP_TMP_ROOT, "demo")   # persistent demo cache
 os.makedirs(WORK_DIR, exist_ok=True)
 os.makedirs(DEMO_DIR, exist_ok=True)
 
-TTL_SECONDS = 30 * 60  # 30 minutes
+TTL_SECONDS = 30 * 60  # 30 minutes (idle WORK_DIR files, see core/artifacts.py)
 
-def _cleanup_old_files(folder, older_than_seconds):
-    now = time.time()
-    for root, _, files in os.walk(folder):
-        for name in files:
-            p = os.path.join(root, name)
-            try:
-                if now - os.path.getmtime(p) > older_than_seconds:
-                    os.remove(p)
-            except Exception as e:
-                print(f"[cleanup] {e}")
 
-def _start_cleaner():
-    def loop():
-        while True:
-            _cleanup_old_files(WORK_DIR, TTL_SECONDS)  # only clean WORK_DIR
-            time.sleep(TTL_SECONDS)
-    threading.Thread(target=loop, daemon=True).start()
+# Demo files are only ever fetched from the pystackreg repository itself; a
+# query string or fragment would let one file be stored under many names.
+_DEMO_HOSTS = {"github.com", "raw.githubusercontent.com"}
+_DEMO_PATH_PREFIX = "/glichtner/pystackreg/"
 
 
 def _is_demo_url(url: str) -> bool:
-    return ("github.com/glichtner/pystackreg" in url) or \
-           ("raw.githubusercontent.com/glichtner/pystackreg" in url)
+    parsed = urllib.parse.urlparse(url)
+    return (
+        parsed.scheme == "https"
+        and parsed.hostname in _DEMO_HOSTS
+        and parsed.port is None
+        and parsed.path.startswith(_DEMO_PATH_PREFIX)
+        and not (parsed.params or parsed.query or parsed.fragment)
+    )
 
 def _demo_path_for_url(url: str, suffix=".tif"):
     h = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
@@ -115,7 +495,9 @@ documentation_markdown = """
         1. Upload the stack you want to align.
         2. (Optional) Check "Use external reference stack" to align to a frame from another file.
         3. Choose the reference frame using the slider.
-        4. (Optional) Choose transformation mode.
+        4. (Optional) Choose transformation mode and reference strategy: a **fixed** frame, the
+           **previous** frame (follows slow drift in long recordings), the stack **mean**, or a
+           **running mean** of the last aligned frames.
         5. Click **▶️ Align Stack**.
         6. Use sliders to browse original/aligned results and download the output.
 
@@ -126,7 +508,9 @@ documentation_markdown = """
         Align one stack (moving) to another (reference).
 
         1. Upload both **reference** and **moving** stacks.
-        2. (Optional) Choose transformation mode.
+        2. (Optional) Choose transformation mode and pairing: align every moving frame to the
+           **first** reference frame, frame *i* to reference frame *i* (**pairwise**), or to the
+           reference **mean**.
         3. Click **▶️ Register** to align.
         4. Browse and download registered stack.
 
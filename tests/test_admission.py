@@ -0,0 +1,81 @@
+"""AdmissionController budgets, rejection and queue order."""
+
+import threading
+import time
+
+import pytest
+
+from core.admission import _DEFAULT_SECONDS_PER_UNIT, HEAVY, LIGHT, AdmissionController, ServerBusy, Ticket
+
+
+def _ticket(lane: str = HEAVY, seconds: float = 5.0) -> Ticket:
+    return Ticket("align_stack_to_reference", lane, slots=1, memory_bytes=0,
+                  work=seconds / _DEFAULT_SECONDS_PER_UNIT)
+
+
+def _wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_busy_lane_raises_server_busy_with_retry_after():
+    controller = AdmissionController(cpu_slots=1, light_slots=1)
+    running = _ticket(seconds=5.0)
+    assert controller.acquire(running, timeout=1)
+
+    with pytest.raises(ServerBusy) as info:
+        controller.acquire(_ticket(), timeout=0.1)
+    # The running call is estimated to need about 5 more seconds.
+    assert info.value.retry_after == 5
+    # The light lane has its own budget.
+    light = _ticket(LIGHT)
+    assert controller.acquire(light, timeout=0.1)
+
+    controller.release(light)
+    controller.release(running)
+    stats = controller.stats()[HEAVY]
+    assert (stats["admitted"], stats["rejected"], stats["running"]) == (1, 1, 0)
+
+
+def test_full_queue_rejects_without_waiting():
+    controller = AdmissionController(cpu_slots=1, max_waiting=1)
+    running = _ticket()
+    controller.acquire(running)
+    waiter = threading.Thread(target=controller.acquire, args=(_ticket(),))
+    waiter.start()
+    _wait_for(lambda: controller.stats()[HEAVY]["waiting"] == 1)
+
+    start = time.monotonic()
+    with pytest.raises(ServerBusy, match="already waiting") as info:
+        controller.acquire(_ticket(), timeout=10)
+    assert time.monotonic() - start < 1
+    # Both the running call and the one queued ahead count.
+    assert info.value.retry_after == 10
+
+    controller.release(running)
+    waiter.join()
+
+
+def test_lane_admits_in_fifo_order():
+    controller = AdmissionController(cpu_slots=1)
+    running = _ticket()
+    controller.acquire(running)
+    order, threads = [], []
+
+    def call(name):
+        ticket = _ticket(seconds=0.0)
+        controller.acquire(ticket)
+        order.append(name)
+        controller.release(ticket)
+
+    for i, name in enumerate("abcd"):
+        threads.append(threading.Thread(target=call, args=(name,)))
+        threads[-1].start()
+        _wait_for(lambda: controller.stats()[HEAVY]["waiting"] == i + 1)
+
+    controller.release(running)
+    for t in threads:
+        t.join()
+    assert order == list("abcd")
@@ -0,0 +1,60 @@
+"""ArtifactStore eviction and the leases held by finished jobs."""
+
+import os
+import time
+
+import pytest
+
+from core import jobs
+from core.admission import AdmissionController
+from core.artifacts import ArtifactStore
+from core.jobs import SUCCEEDED, JobManager
+from core.utils import TTL_SECONDS
+
+
+def _store(root, max_bytes=1) -> ArtifactStore:
+    # Every file is over the budget and out of its grace period at once.
+    return ArtifactStore(root=str(root), max_bytes=max_bytes, min_free_bytes=0, ttl=3600, grace=0)
+
+
+def _write(store: ArtifactStore, data: bytes = b"x" * 64) -> str:
+    path = store.create(".tif")
+    with open(path, "wb") as f:
+        f.write(data)
+    store.add(path)
+    return path
+
+
+def test_sweep_evicts_over_budget_and_spares_leased_files(tmp_path):
+    store = _store(tmp_path)
+    leased, free = _write(store), _write(store)
+    store.lease(leased, "holder")
+
+    store.sweep()
+    assert os.path.exists(leased) and not os.path.exists(free)
+    assert store.stats()["evictions"]["budget"] == 1
+
+    store.release("holder")
+    store.sweep()
+    assert not os.path.exists(leased)
+
+
+def test_job_lease_stops_eviction_until_job_is_pruned(monkeypatch, tmp_path):
+    store = _store(tmp_path)
+    monkeypatch.setattr(jobs, "ARTIFACTS", store)
+    monkeypatch.setattr(jobs, "ADMISSION", AdmissionController(cpu_slots=4, light_slots=4))
+    monkeypatch.setitem(jobs.JOB_TOOLS, "align_stack_to_reference", lambda stack_file=None: _write(store))
+    manager = JobManager(max_running=1)
+
+    job = manager.submit("align_stack_to_reference", {})
+    assert manager.wait(job.id, timeout=5)["state"] == SUCCEEDED
+    result = manager.result(job.id)
+    store.sweep()
+    assert os.path.exists(result)
+
+    # Once the job has expired, its result ages out like any other file.
+    job.finished_at = time.time() - TTL_SECONDS - 1
+    with pytest.raises(ValueError, match="Unknown job id"):
+        manager.get(job.id)
+    store.sweep()
+    assert not os.path.exists(result)
@@ -0,0 +1,187 @@
+"""DownloadCache against a local HTTP server standing in for a remote host."""
+
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import tifffile
+
+from core import downloads
+from core.downloads import _TIFF_MAGIC, DownloadCache
+
+
+def _tiff_bytes(value: int) -> bytes:
+    buf = io.BytesIO()
+    tifffile.imwrite(buf, np.full((2, 16, 16), value, dtype=np.uint8))
+    return buf.getvalue()
+
+
+class _Server:
+    """Serves ``/<name>.tif`` from *files*, with an ETag unless *etag* is False."""
+
+    def __init__(self, files, etag=True, delay=0.0):
+        self.files = files
+        self.etag = etag
+        self.delay = delay
+        self.requests = []  # (path, status)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.lstrip("/")
+                body = server.files[name]
+                tag = f'"{name}-{len(body)}"'
+                if server.etag and self.headers.get("If-None-Match") == tag:
+                    server.requests.append((self.path, 304))
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                server.requests.append((self.path, 200))
+                time.sleep(server.delay)
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                if server.etag:
+                    self.send_header("ETag", tag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def _allow_loopback(monkeypatch):
+    monkeypatch.setattr(downloads, "_block_private_url", lambda url: None)
+
+
+def _fetch(cache: DownloadCache, url: str) -> str:
+    return cache.fetch(url, "test file", ".tif", _TIFF_MAGIC, "TIFF")
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_revalidation_reuses_cached_file(tmp_path):
+    body = _tiff_bytes(1)
+    cache = DownloadCache(root=str(tmp_path), max_bytes=10 * len(body))
+    with _Server({"a.tif": body}) as server:
+        first = _fetch(cache, server.url("a.tif"))
+        second = _fetch(cache, server.url("a.tif"))
+
+    assert [status for _, status in server.requests] == [200, 304]
+    assert first != second
+    assert _read(first) == _read(second) == body
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["revalidated"]) == (1, 1, 1)
+
+
+def test_eviction_keeps_cache_within_byte_budget(tmp_path):
+    files = {"a.tif": _tiff_bytes(1), "b.tif": _tiff_bytes(2)}
+    size = len(files["a.tif"])
+    cache = DownloadCache(root=str(tmp_path), max_bytes=size + size // 2)
+    with _Server(files) as server:
+        a = _fetch(cache, server.url("a.tif"))
+        _fetch(cache, server.url("b.tif"))
+        stats = cache.stats()
+        _fetch(cache, server.url("a.tif"))
+
+    assert stats["entries"] == 1 and stats["bytes"] <= cache.max_bytes
+    # "a" was evicted, so it is downloaded again rather than revalidated ...
+    assert [status for _, status in server.requests] == [200, 200, 200]
+    # ... and the path handed out before the eviction is still readable.
+    assert _read(a) == files["a.tif"]
+
+
+@pytest.mark.parametrize("etag", [True, False], ids=["cached", "uncached"])
+def test_concurrent_fetches_share_one_download(tmp_path, etag):
+    body = _tiff_bytes(3)
+    cache = DownloadCache(root=str(tmp_path), max_bytes=10 * len(body))
+    paths, errors = [], []
+
+    def fetch():
+        try:
+            paths.append(_fetch(cache, server.url("a.tif")))
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+
+    with _Server({"a.tif": body}, etag=etag, delay=0.5) as server:
+        threads = [threading.Thread(target=fetch) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert not errors
+    assert len(server.requests) == 1
+    # Every caller owns its path, even when the download was not cached.
+    assert len(set(paths)) == 2
+    assert all(_read(p) == body for p in paths)
+
+
+def test_cancelled_follower_stops_waiting(tmp_path):
+    body = _tiff_bytes(4)
+    cache = DownloadCache(root=str(tmp_path), max_bytes=10 * len(body))
+    cancel = threading.Event()
+    with _Server({"a.tif": body}, delay=2.0) as server:
+        leader = threading.Thread(target=_fetch, args=(cache, server.url("a.tif")))
+        leader.start()
+        while not server.requests:
+            time.sleep(0.01)
+        threading.Timer(0.2, cancel.set).start()
+        start = time.monotonic()
+        with pytest.raises(downloads.DownloadCancelled):
+            cache.fetch(server.url("a.tif"), "test file", ".tif", _TIFF_MAGIC, "TIFF", cancel=cancel)
+        waited = time.monotonic() - start
+        leader.join()
+
+    assert waited < 1.5
+
+
+def test_cached_file_is_checked_against_the_expected_kind(tmp_path):
+    body = _tiff_bytes(5)
+    cache = DownloadCache(root=str(tmp_path), max_bytes=10 * len(body))
+    with _Server({"a.tif": body}) as server:
+        _fetch(cache, server.url("a.tif"))
+        with pytest.raises(ValueError, match="valid transforms"):
+            cache.fetch(server.url("a.tif"), "transforms_file", ".npz", downloads._NPZ_MAGIC, "transforms")
+
+    assert [status for _, status in server.requests] == [200, 304]
+
+
+def test_unread_streaming_handle_is_closed(monkeypatch, tmp_path):
+    body = _tiff_bytes(6)
+    monkeypatch.setattr(downloads, "DOWNLOAD_CACHE", DownloadCache(root=str(tmp_path), max_bytes=10 * len(body)))
+    handles = []
+    start = downloads._Progress.start
+
+    def record_start(progress, path, size):
+        start(progress, path, size)
+        handles.append(progress.file)
+
+    monkeypatch.setattr(downloads._Progress, "start", record_start)
+    with _Server({"a.tif": body}) as server:
+        download = downloads.StreamingDownload(server.url("a.tif"), "stack_file")
+        assert _read(download.result()) == body
+
+    # The consumer never called open(): the download closed its read handle.
+    assert len(handles) == 1 and handles[0].closed
+    assert download.open() is None
@@ -0,0 +1,70 @@
+"""JobManager cancellation, with a stand-in tool that runs until told to stop."""
+
+import threading
+
+import pytest
+
+from core import jobs
+from core.admission import AdmissionController
+from core.jobs import CANCELLED, QUEUED, RUNNING, SUCCEEDED, JobManager
+
+TOOL = "align_stack_to_reference"
+
+
+class _Tool:
+    """Reports progress every few milliseconds until *finish* is set."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.finish = threading.Event()
+        self.calls = 0
+
+    def __call__(self, stack_file=None, progress_callback=None):
+        self.calls += 1
+        self.started.set()
+        done = 0
+        while not self.finish.wait(0.01):
+            done += 1
+            progress_callback(done, 1000)
+        return "result.tif"
+
+
+@pytest.fixture
+def tool(monkeypatch):
+    tool = _Tool()
+    monkeypatch.setitem(jobs.JOB_TOOLS, TOOL, tool)
+    monkeypatch.setattr(jobs, "ADMISSION", AdmissionController(cpu_slots=4, light_slots=4))
+    yield tool
+    tool.finish.set()
+
+
+def test_cancel_running_job(tool):
+    manager = JobManager(max_running=1)
+    job = manager.submit(TOOL, {})
+    assert tool.started.wait(5)
+    assert manager.status(job.id)["state"] == RUNNING
+
+    manager.cancel(job.id)
+    status = manager.wait(job.id, timeout=5)
+
+    # The tool stopped at its next progress report, without being told to finish.
+    assert status["state"] == CANCELLED and not tool.finish.is_set()
+    with pytest.raises(RuntimeError, match="cancelled"):
+        manager.result(job.id)
+
+
+def test_cancel_queued_job(tool):
+    manager = JobManager(max_running=1)
+    first = manager.submit(TOOL, {})
+    assert tool.started.wait(5)
+    second = manager.submit(TOOL, {})
+    assert manager.status(second.id)["state"] == QUEUED
+
+    status = manager.cancel(second.id)
+    assert status["state"] == CANCELLED
+
+    tool.finish.set()
+    assert manager.wait(first.id, timeout=5)["state"] == SUCCEEDED
+    # The cancelled job never ran.
+    assert tool.calls == 1
+    assert manager.stats()[CANCELLED] == 1